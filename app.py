@@ -1,49 +1,74 @@
 # app.py
-from flask import Flask, request, jsonify, g
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, g
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.errors
 import uuid
 import os
 import json
 import secrets
-from datetime import datetime, timedelta
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-import base64
+from datetime import datetime, timedelta, timezone
 from threading import Thread
+import threading
 import functools
-from apscheduler.schedulers.background import BackgroundScheduler
+import hashlib
+import heapq
+import html
+import itertools
+import random
+import re
+import time
 import atexit
+import base64
+import copy
 import logging
 from flask import redirect
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+from logging_config import configure_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, JOB_BUCKETS, REGISTRY as METRICS_REGISTRY, Counter, Gauge, Histogram
+from tracking_common import (
+    TRACKING_EVENT_BATCH_SIZE, TRACKING_EVENT_FLUSH_INTERVAL, TRACKING_EVENT_MAX_BUFFER,
+    TRACKING_PIXEL_GIF, TRACKING_PIXEL_HEADERS, BEACON_OK_BODY, BEACON_ERROR_BODY, BEACON_HEADERS, FALLBACK_REDIRECT_URL, CLICK_DESTINATION_SQL, EVENT_JOIN_BY_PIXEL, EVENT_JOIN_BY_TRACKING_ID,
+    INSERT_TRACKING_EVENTS_SQL, EMAIL_TRACKING_ROLLUP_SQL, URL_TRACKING_ROLLUP_SQL, CAMPAIGN_LINKS_ROLLUP_SQL,
+    ENGAGEMENT_ROLLUP_SQL, OpenDedupCache, RedirectCache, classify_user_agent, month_start, parse_uuid,
+    summarize_engagement_buckets, summarize_link_clicks, summarize_tracking_events, tracking_event_partition_ddl,
+    TRACKING_EVENT_BUFFER_DEPTH, TRACKING_EVENT_FLUSH_SECONDS, TRACKING_EVENTS_DROPPED, TRACKING_EVENTS_FLUSHED,
+    HEALTH_CACHE_SECONDS, HEALTH_MAX_EVENT_BACKLOG, HEALTH_PROBE_TIMEOUT,
 )
 
-# Initialize Flask app
-app = Flask(__name__)
+# Importing this module only defines things - the Flask app is built by create_app() and
+# background services (scheduler, send worker) are started by the entry points at the bottom.
+# Logging is configured by create_app()/main(); this is the same logger as app.logger.
+logger = logging.getLogger('app')
 
-# Configure CORS to allow cross-origin requests
-CORS(app, 
-     resources={r"/*": {"origins": "*"}},
-     supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin"],
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     expose_headers=["Content-Type", "Authorization"])
+# All routes and request hooks live on this blueprint, registered by create_app()
+api = Blueprint('api', __name__)
 
 # Email and SMTP Configuration - better to use environment variables in production
 SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
 SMTP_USERNAME = os.environ.get('SMTP_USERNAME', 'sugil.s@vdartinc.com')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', 'elka vboz rmvq lucw')
+SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'true').lower() == 'true'  # set to false (and SMTP_USERNAME empty) for a local relay
+
+# Reply mailbox - the SMTP account's INBOX, polled every minute, or with IMAP_IDLE=true watched
+# over one long-lived connection; IDLE is re-issued every IMAP_IDLE_SECONDS (servers drop idle
+# clients after 30 minutes, NAT gateways often sooner)
+IMAP_SERVER = os.environ.get('IMAP_SERVER', 'imap.gmail.com')
+IMAP_PORT = int(os.environ.get('IMAP_PORT', '993'))
+IMAP_IDLE = os.environ.get('IMAP_IDLE', 'false').lower() == 'true'
+IMAP_IDLE_SECONDS = int(os.environ.get('IMAP_IDLE_SECONDS', '540'))
+IMAP_RECONNECT_MAX_SECONDS = int(os.environ.get('IMAP_RECONNECT_MAX_SECONDS', '300'))
+
+# Registered reply mailboxes - logins live in IMAP_CREDENTIALS, a JSON object of
+# {"ref": {"server": ..., "port": 993, "username": ..., "password": ...}}, and mailboxes refer to an
+# entry by name. Each poll scans up to IMAP_SCAN_WORKERS mailboxes at a time.
+IMAP_CREDENTIALS = json.loads(os.environ.get('IMAP_CREDENTIALS') or '{}')
+IMAP_SCAN_WORKERS = int(os.environ.get('IMAP_SCAN_WORKERS', '8'))
+IMAP_TIMEOUT_SECONDS = float(os.environ.get('IMAP_TIMEOUT_SECONDS', '30'))
 
 # Base URL for your application - used for tracking links
 BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5000/')
@@ -58,50 +83,394 @@ DB_NAME = os.environ.get('DB_NAME', 'email_app')
 DB_USER = os.environ.get('DB_USER', 'postgres')
 DB_PASS = os.environ.get('DB_PASS', 'Admin@123')
 
+# Tracking event log - batch size, flush interval, dedup window and the prebuilt tracking
+# responses are shared with tracking_service.py and live in tracking_common.py
+TRACKING_EVENT_RETENTION_MONTHS = int(os.environ.get('TRACKING_EVENT_RETENTION_MONTHS', '12'))
+
+# Engagement timeseries - rollups are stored in 5 minute buckets (ROLLUP_BUCKET_SECONDS),
+# coarser buckets are summed from these at query time
+TIMESERIES_BUCKETS = {'5m': 300, '1h': 3600, '1d': 86400}
+
+# Tracking access log - only a sample of open/beacon/click hits is logged, capped per second;
+# TRACKING_LOG_HITS=false drops per-hit logs entirely
+TRACKING_LOG_HITS = os.environ.get('TRACKING_LOG_HITS', 'true').lower() == 'true'
+TRACKING_LOG_SAMPLE_RATE = float(os.environ.get('TRACKING_LOG_SAMPLE_RATE', '0.01'))
+TRACKING_LOG_MAX_PER_SECOND = int(os.environ.get('TRACKING_LOG_MAX_PER_SECOND', '10'))
+
+# SQL instrumentation - per request/background job statement counts and DB time, reported in
+# Server-Timing headers and logged with the slowest statements when over the threshold
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+SLOW_JOB_MS = float(os.environ.get('SLOW_JOB_MS', '60000'))
+SQL_SLOWEST_STATEMENTS = int(os.environ.get('SQL_SLOWEST_STATEMENTS', '3'))
+
+# Database connection pool - shared by request handlers and background threads
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+
+# Metrics - /metrics is open unless METRICS_TOKEN is set, then it needs "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # JWT Configuration
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', generated_key)
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', generated_key)
+JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+
+# Startup - INIT_DB=false skips the schema check in create_app(), SEND_MODE=queue makes the
+# send endpoint queue campaigns for `python app.py worker` instead of sending in a thread
+INIT_DB = os.environ.get('INIT_DB', 'true').lower() == 'true'
+SEND_MODE = os.environ.get('SEND_MODE', 'thread')
+WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', '5'))  # seconds
+
+# Send checkpoints - recipients are claimed from the campaign outbox and their results committed
+# SEND_BATCH_SIZE at a time; a campaign whose sender hasn't checkpointed for SEND_LEASE_SECONDS
+# is treated as interrupted and picked up again by startup recovery
+SEND_BATCH_SIZE = int(os.environ.get('SEND_BATCH_SIZE', '50'))
+SEND_LEASE_SECONDS = int(os.environ.get('SEND_LEASE_SECONDS', '300'))
+
+# Outbound throttling - SEND_RATE messages/second for the whole process and SEND_DOMAIN_RATE per
+# recipient domain (0 = unlimited), with SEND_DOMAIN_RATES="gmail.com=5,outlook.com=2" overrides.
+# A 4xx reply backs the domain off from SEND_BACKOFF_SECONDS doubling up to SEND_BACKOFF_MAX_SECONDS.
+# Recipients that can't go out yet are re-queued with next_attempt_at instead of failing.
+SEND_RATE = float(os.environ.get('SEND_RATE', '0'))
+SEND_BURST = int(os.environ.get('SEND_BURST', '20'))
+SEND_DOMAIN_RATE = float(os.environ.get('SEND_DOMAIN_RATE', '0'))
+SEND_DOMAIN_BURST = int(os.environ.get('SEND_DOMAIN_BURST', '10'))
+SEND_DOMAIN_RATES = {
+    domain.strip().lower(): float(rate)
+    for domain, _, rate in (item.partition('=') for item in os.environ.get('SEND_DOMAIN_RATES', '').split(','))
+    if domain.strip() and rate
+}
+SEND_BACKOFF_SECONDS = float(os.environ.get('SEND_BACKOFF_SECONDS', '30'))
+SEND_BACKOFF_MAX_SECONDS = float(os.environ.get('SEND_BACKOFF_MAX_SECONDS', '1800'))
+
+# Retries - a transient (4xx) failure re-queues the recipient SEND_RETRY_BASE_SECONDS later, doubling
+# per attempt up to SEND_RETRY_MAX_SECONDS with jitter; after SEND_MAX_RETRIES retries it fails
+SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', '5'))
+SEND_RETRY_BASE_SECONDS = float(os.environ.get('SEND_RETRY_BASE_SECONDS', '60'))
+SEND_RETRY_MAX_SECONDS = float(os.environ.get('SEND_RETRY_MAX_SECONDS', '3600'))
+
+# Why an address is on a user's suppression list
+SUPPRESSION_REASONS = ('unsubscribed', 'hard_bounce', 'complained', 'manual')
+
+# The JWT manager is bound to the app in create_app()
+jwt = JWTManager()
+
+# Metrics (scraped from /metrics, tracking event buffer metrics live in tracking_common.py)
+PROCESS_START_TIME = Gauge('process_start_time_seconds', 'Start time of the process since unix epoch')
+PROCESS_START_TIME.set(time.time())
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route', ('route',))
+HTTP_RESPONSES = Counter('http_responses_total', 'Responses by route and status class', ('route', 'status'))
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Pooled database connections by state', ('state',))
+DB_POOL_MAX_CONNECTIONS = Gauge('db_pool_max_connections', 'Upper bound on pooled database connections')
+DB_POOL_MAX_CONNECTIONS.set(DB_POOL_SIZE)
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Time spent waiting to check out a connection')
+DB_POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that gave up waiting for a free connection')
+EMAIL_MESSAGES = Counter('email_messages_total', 'Campaign emails by send result', ('result',))
+EMAIL_MESSAGES_IN_FLIGHT = Gauge('email_messages_in_flight', 'Emails being rendered or handed to SMTP right now')
+EMAIL_MESSAGE_SECONDS = Histogram('email_message_send_seconds', 'Time to render and send one email')
+EMAIL_CAMPAIGNS_SENDING = Gauge('email_campaigns_sending', 'Campaign sends in progress')
+SMTP_CONNECTIONS = Counter('smtp_connections_total', 'SMTP sessions opened')
+SMTP_RECONNECTS = Counter('smtp_reconnects_total', 'SMTP sessions reopened after the server dropped the connection')
+SMTP_CONNECTION_ERRORS = Counter('smtp_connection_errors_total', 'Failed attempts to open an SMTP session')
+SEND_THROTTLE_WAIT_SECONDS = Counter('email_send_throttle_wait_seconds_total',
+                                     'Time send loops slept waiting for the global send rate')
+SEND_DOMAINS_BACKED_OFF = Gauge('email_send_domains_backed_off', 'Recipient domains backing off after a 4xx reply')
+IMAP_SCAN_SECONDS = Histogram('imap_scan_duration_seconds', 'Duration of one reply mailbox scan', buckets=JOB_BUCKETS)
+IMAP_MESSAGES_SCANNED = Counter('imap_messages_scanned_total', 'Mailbox messages fetched by reply scans')
+IMAP_REPLIES_MATCHED = Counter('imap_replies_matched_total', 'Replies matched to a campaign recipient')
+IMAP_BOUNCES_MATCHED = Counter('imap_bounces_matched_total', 'Delivery failure reports matched to a sent email')
+SUPPRESSIONS_ADDED = Counter('suppressions_added_total', 'Addresses added to a suppression list', ('reason',))
+IMAP_SCAN_ERRORS = Counter('imap_scan_errors_total', 'Reply scans that failed')
+IMAP_MAILBOX_SCANS = Counter('imap_mailbox_scans_total', 'Reply mailbox scans by outcome', ('outcome',))
+IMAP_IDLE_RECONNECTS = Counter('imap_idle_reconnects_total', 'Reply mailbox IDLE connections re-established after an error')
+JOB_SECONDS = Histogram('job_duration_seconds', 'Background and scheduled job runtimes', ('job',), buckets=JOB_BUCKETS)
+
+EMAIL_SENT = EMAIL_MESSAGES.labels('sent')
+EMAIL_FAILED = EMAIL_MESSAGES.labels('failed')
+EMAIL_DEFERRED = EMAIL_MESSAGES.labels('deferred')
+EMAIL_RETRIED = EMAIL_MESSAGES.labels('retried')
+STATUS_CLASSES = ('other', '1xx', '2xx', '3xx', '4xx', '5xx')
+
+# SQL Instrumentation
+_sql_scope = threading.local()
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_ROW_LIST = re.compile(r"(\([^()]*\?[^()]*\))(?:\s*,\s*\([^()]*\?[^()]*\))+")
+
+def normalize_sql(query):
+    """Collapse whitespace, literals and VALUES lists so similar statements read the same"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = _SQL_LITERAL.sub('?', ' '.join(str(query).split()))
+    query = _SQL_ROW_LIST.sub(r'\1, ...', query)
+    return query if len(query) <= 300 else query[:297] + '...'
+
+class SqlStats:
+    """Statement count, DB time and the slowest statements of one request or background job"""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []  # min-heap of (seconds, sequence, query)
+
+    def record(self, query, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if len(self.slowest) < SQL_SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, self.count, query))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, self.count, query))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self):
+        # Normalizing is only done here, for the statements that actually get logged
+        slowest = ' | '.join(f"{seconds * 1000:.1f}ms {normalize_sql(query)}"
+                             for seconds, _, query in sorted(self.slowest, reverse=True))
+        return f"{self.count} statements, {self.seconds * 1000:.1f}ms in DB" + (f"; slowest: {slowest}" if slowest else "")
+
+class InstrumentedCursor(psycopg2.extras.RealDictCursor):
+    """RealDictCursor that reports every statement to the current request's or job's SqlStats"""
+
+    def execute(self, query, vars=None):
+        stats = getattr(_sql_scope, 'stats', None)
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            stats.record(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        stats = getattr(_sql_scope, 'stats', None)
+        if stats is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            stats.record(query, time.perf_counter() - started)
+
+DB_CURSOR_FACTORY = InstrumentedCursor if SQL_INSTRUMENTATION else psycopg2.extras.RealDictCursor
+
+def instrumented_job(name, log_every_run=True):
+    """Time a background job into job_duration_seconds, collect its SqlStats and log them when it finishes"""
+    def decorator(func):
+        job_seconds = JOB_SECONDS.labels(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            if not SQL_INSTRUMENTATION:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    job_seconds.observe(time.perf_counter() - started)
+            previous = getattr(_sql_scope, 'stats', None)
+            stats = _sql_scope.stats = SqlStats(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _sql_scope.stats = previous
+                job_seconds.observe(time.perf_counter() - started)
+                elapsed_ms = stats.elapsed_ms()
+                if elapsed_ms >= SLOW_JOB_MS:
+                    logger.warning("🐢 Slow job %s: %.0fms, %s", name, elapsed_ms, stats.summary(),
+                                   extra={'event': 'slow_job', 'job': name})
+                elif log_every_run:
+                    logger.info("📊 Job %s: %.0fms, %s", name, elapsed_ms, stats.summary(),
+                                extra={'event': 'job_completed', 'job': name})
+        return wrapper
+    return decorator
+
+# Database Connection Pool
+class PoolTimeout(psycopg2.OperationalError):
+    """No pooled connection became free within DB_POOL_TIMEOUT"""
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that goes back to its pool on close()"""
+    pool = None
+    pid = None
+    checked_out = False
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        self.pool.putconn(self)
+
+    def discard(self):
+        """Really close the connection"""
+        self.pool = None
+        super().close()
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are opened on demand up to max_connections and reused LIFO. A connection
+    handed back mid-transaction is rolled back, a broken one is dropped. After a fork the
+    child starts with an empty pool and never touches the parent's sockets.
+    """
+    connection_class = PooledConnection
+
+    def __init__(self, max_connections=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, **connect_kwargs):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._inherited = []
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Closing (or garbage collecting) inherited connections would end the parent's sessions
+            self._inherited.extend(self._idle)
+            self._idle = []
+            self._size = 0
+            self._in_use = 0
+            self._pid = os.getpid()
+
+    def getconn(self, timeout=None):
+        started = time.perf_counter()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._check_fork()
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_connections:
+                    conn = None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    DB_POOL_TIMEOUTS.inc()
+                    raise PoolTimeout(f"No database connection free after {timeout}s "
+                                      f"({self.max_connections} in use)")
+                self._cond.wait(remaining)
+            self._in_use += 1
+        if conn is None or conn.closed:
+            try:
+                conn = psycopg2.connect(connection_factory=self.connection_class, **self.connect_kwargs)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            conn.pool = self
+            conn.pid = os.getpid()
+        conn.checked_out = True
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        return conn
+
+    def putconn(self, conn):
+        if not conn.checked_out:
+            return  # already returned, e.g. close() called twice
+        conn.checked_out = False
+        if conn.pid != os.getpid():
+            self._inherited.append(conn)
+            return
+        keep = not conn.closed
+        if keep:
+            try:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    keep = False
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if keep and conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not keep:
+            conn.discard()
+
+    def close_idle(self):
+        """Close connections nobody is using, e.g. before changing connection_class"""
+        with self._cond:
+            self._check_fork()
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.discard()
 
-app.logger.info(f"Using JWT secret key: {app.config['JWT_SECRET_KEY'][:8]}...") # Show first 8 chars for debugging
+    def stats(self):
+        with self._cond:
+            return {'size': self._size, 'in_use': self._in_use, 'idle': len(self._idle),
+                    'max': self.max_connections}
 
-# Initialize the JWT manager
-jwt = JWTManager(app)
+db_pool = ConnectionPool(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+DB_POOL_CONNECTIONS.labels('in_use').set_function(lambda: db_pool._in_use)
+DB_POOL_CONNECTIONS.labels('idle').set_function(lambda: len(db_pool._idle))
 
 # Database Connection Functions
 def get_db_connection():
     """Get PostgreSQL database connection using Flask's g object for request scoping"""
     if 'db' not in g:
-        g.db = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        g.db = db_pool.getconn()
         g.db.autocommit = False
         # Set cursor factory to return dictionaries
-        g.cursor = g.db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        g.cursor = g.db.cursor(cursor_factory=DB_CURSOR_FACTORY)
     return g.db, g.cursor
 
 def get_direct_db_connection():
     """Get a direct database connection (not tied to Flask's g)
-    Use this for background threads or scheduled tasks"""
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        database=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
+    Use this for background threads or scheduled tasks. close() returns it to the pool."""
+    conn = db_pool.getconn()
     conn.autocommit = False
-    return conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    return conn, conn.cursor(cursor_factory=DB_CURSOR_FACTORY)
 
-@app.teardown_appcontext
 def close_db_connection(exception):
-    """Close database connection at the end of request"""
+    """Return the request's database connection to the pool"""
     db = g.pop('db', None)
     if db is not None:
         g.pop('cursor', None)
         db.close()
 
+# Tracking event partitions - tracking_events is range partitioned by month on occurred_at
+def ensure_tracking_event_partitions(cur, months_ahead=2):
+    """Create the monthly tracking_events partitions for the current month and the next few"""
+    for statement in tracking_event_partition_ddl(months_ahead):
+        cur.execute(statement)
+
+def drop_expired_tracking_event_partitions(cur, retention_months):
+    """Drop whole monthly partitions that are older than the retention window"""
+    cutoff = month_start(datetime.now(timezone.utc), -retention_months)
+    cur.execute("""
+        SELECT child.relname AS partition_name
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = 'tracking_events'
+    """)
+    dropped = []
+    for row in cur.fetchall():
+        name = row['partition_name']
+        try:
+            start = datetime(int(name[-7:-3]), int(name[-2:]), 1, tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        if start < cutoff:
+            cur.execute(f"DROP TABLE IF EXISTS {name}")
+            dropped.append(name)
+    return dropped
+
 # Initialize Database Tables
 def init_db():
     """Create database tables if they don't exist"""
@@ -167,6 +536,15 @@ def init_db():
     )
     ''')
     
+    # Library templates have no campaign_id. compiled holds compile_email_template() output,
+    # built when a template is saved; campaign templates made from a library template keep
+    # its id in source_template_id
+    cur.execute('''
+    ALTER TABLE email_templates
+    ADD COLUMN IF NOT EXISTS compiled JSONB,
+    ADD COLUMN IF NOT EXISTS source_template_id UUID REFERENCES email_templates(template_id)
+    ''')
+    
     # Create recipients table (UPDATED with group_id)
     cur.execute('''
     CREATE TABLE IF NOT EXISTS recipients (
@@ -245,7 +623,132 @@ def init_db():
         is_active BOOLEAN DEFAULT TRUE
     )
     ''')
-    
+
+    # Create tracking_events table - append-only log of every open/click/beacon/reply,
+    # partitioned by month so old data can be dropped a partition at a time
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS tracking_events (
+        event_id BIGINT GENERATED ALWAYS AS IDENTITY,
+        occurred_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        event_type VARCHAR(20) NOT NULL,
+        tracking_id UUID NOT NULL,
+        campaign_id UUID NOT NULL,
+        url_tracking_id UUID,
+        source VARCHAR(50),
+        user_agent TEXT,
+        ip_address VARCHAR(64),
+        agent_class VARCHAR(20) NOT NULL DEFAULT 'human'
+    ) PARTITION BY RANGE (occurred_at)
+    ''')
+    cur.execute('''
+    ALTER TABLE tracking_events ADD COLUMN IF NOT EXISTS agent_class VARCHAR(20) NOT NULL DEFAULT 'human'
+    ''')
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS tracking_events_occurred_at_brin
+    ON tracking_events USING BRIN (occurred_at)
+    ''')
+    ensure_tracking_event_partitions(cur)
+
+    # Opens/clicks from mail proxies, prefetchers and link scanners are counted separately
+    cur.execute('''
+    ALTER TABLE email_tracking
+    ADD COLUMN IF NOT EXISTS automated_open_count INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS automated_click_count INTEGER DEFAULT 0
+    ''')
+
+    # Create campaign_links table - one row per distinct URL per campaign, with campaign-level click counters
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_links (
+        link_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        campaign_id UUID NOT NULL REFERENCES email_campaigns(campaign_id),
+        original_url TEXT NOT NULL,
+        url_hash CHAR(32) GENERATED ALWAYS AS (md5(original_url)) STORED,
+        total_clicks INTEGER NOT NULL DEFAULT 0,
+        unique_clicks INTEGER NOT NULL DEFAULT 0,
+        first_clicked_at TIMESTAMP WITH TIME ZONE,
+        last_clicked_at TIMESTAMP WITH TIME ZONE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        CONSTRAINT unique_campaign_link UNIQUE (campaign_id, url_hash)
+    )
+    ''')
+
+    # url_tracking rows reference campaign_links instead of repeating the URL for every recipient
+    cur.execute('''
+    ALTER TABLE url_tracking
+    ADD COLUMN IF NOT EXISTS link_id UUID REFERENCES campaign_links(link_id)
+    ''')
+    cur.execute('''
+    ALTER TABLE url_tracking ALTER COLUMN original_url DROP NOT NULL
+    ''')
+
+    # Campaign outbox - every recipient gets a 'queued' email_tracking row before the first
+    # message goes out, and the sender claims queued rows and checkpoints them in batches
+    cur.execute('''
+    ALTER TABLE email_campaigns ADD COLUMN IF NOT EXISTS send_heartbeat_at TIMESTAMP WITH TIME ZONE
+    ''')
+    cur.execute('''
+    ALTER TABLE email_tracking
+    ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS retry_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_error TEXT
+    ''')
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS email_tracking_campaign_recipient
+    ON email_tracking (campaign_id, recipient_id)
+    ''')
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS email_tracking_outbox
+    ON email_tracking (campaign_id) WHERE email_status IN ('queued', 'sending')
+    ''')
+    # Bounces without a tracking id are matched to the owner's recipients by address
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS recipients_user_lower_email
+    ON recipients (user_id, lower(email))
+    ''')
+
+    # Suppressions - addresses a user's campaigns must not be sent to again (SUPPRESSION_REASONS),
+    # keyed by the lowercased address and checked when the outbox is filled and claimed
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS suppressions (
+        user_id UUID NOT NULL REFERENCES users(user_id),
+        email VARCHAR(255) NOT NULL,
+        reason VARCHAR(20) NOT NULL,
+        tracking_id UUID,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        PRIMARY KEY (user_id, email)
+    )
+    ''')
+
+    # Reply mailboxes - registered per user and reply-to address; the login is an IMAP_CREDENTIALS
+    # entry named by credential_ref, the UID state is written back after every scan
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS reply_mailboxes (
+        mailbox_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        user_id UUID NOT NULL REFERENCES users(user_id),
+        address VARCHAR(255) NOT NULL,
+        credential_ref VARCHAR(100) NOT NULL,
+        uid_validity BIGINT,
+        last_uid BIGINT,
+        last_checked_at TIMESTAMP WITH TIME ZONE,
+        last_error TEXT,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        CONSTRAINT unique_mailbox_per_user UNIQUE (user_id, address)
+    )
+    ''')
+
+    # Create campaign_engagement_rollups table - 5 minute buckets maintained by the event flusher
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_engagement_rollups (
+        campaign_id UUID NOT NULL REFERENCES email_campaigns(campaign_id),
+        metric VARCHAR(20) NOT NULL,
+        bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+        event_count INTEGER NOT NULL DEFAULT 0,
+        unique_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (campaign_id, metric, bucket_start)
+    )
+    ''')
+
     # Check if group_id column exists in recipients table, if not add it
     cur.execute("""
         SELECT column_name 
@@ -255,18 +758,14 @@ def init_db():
     
     
     if not cur.fetchone():
-        app.logger.info("Adding group_id column to recipients table...")
+        logger.info("Adding group_id column to recipients table...")
         cur.execute("""
             ALTER TABLE recipients 
             ADD COLUMN group_id UUID REFERENCES groups(group_id) ON DELETE SET NULL
         """)
     
     conn.commit()
-    app.logger.info("Database tables initialized")
-
-# Initialize database tables on app startup
-with app.app_context():
-    init_db()
+    logger.info("Database tables initialized")
 
 # Helper Functions
 def to_dict(row):
@@ -290,29 +789,263 @@ def handle_transaction(func):
             return result
         except Exception as e:
             conn.rollback()
-            app.logger.error(f"Database error: {str(e)}")
+            logger.error(f"Database error: {str(e)}")
             return jsonify({"error": str(e)}), 500
     return wrapper
 
-from bs4 import BeautifulSoup
-import uuid
+# Tracking Event Log
+class TrackingEventBuffer:
+    """Buffer tracking hits in memory and write them to tracking_events in batches.
+
+    Each flush inserts the batch into the append-only tracking_events table and
+    rolls the same batch up into the email_tracking and url_tracking counters,
+    so the tracking routes never touch the database themselves.
+    """
+
+    def __init__(self, batch_size=TRACKING_EVENT_BATCH_SIZE, flush_interval=TRACKING_EVENT_FLUSH_INTERVAL,
+                 max_buffer=TRACKING_EVENT_MAX_BUFFER):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, event_type, tracking_pixel_id=None, tracking_id=None, url_tracking_id=None,
+               source=None, user_agent=None, ip_address=None, agent_class='human'):
+        """Queue a single tracking event. Either tracking_pixel_id or tracking_id must be given."""
+        event = (datetime.now(timezone.utc), event_type, tracking_pixel_id, tracking_id,
+                 url_tracking_id, source, user_agent, ip_address, agent_class)
+        with self._lock:
+            if len(self._events) >= self.max_buffer:
+                TRACKING_EVENTS_DROPPED.inc()
+                logger.warning("Tracking event buffer full, dropping event")
+                return
+            self._events.append(event)
+            pending = len(self._events)
+        self._ensure_started()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def _ensure_started(self):
+        # Start lazily and restart after a fork so every worker process flushes its own buffer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = Thread(target=self._run, name='tracking-event-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("❌ Error flushing tracking events: %s", e, extra={'event': 'tracking_flush_failed'})
+
+    def flush(self):
+        """Write all buffered events to the database"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            started = time.perf_counter()
+            try:
+                write_tracking_events(events)
+            except Exception:
+                # Put the batch back so a transient database error doesn't lose events
+                with self._lock:
+                    if len(events) + len(self._events) <= self.max_buffer:
+                        self._events[:0] = events
+                    else:
+                        TRACKING_EVENTS_DROPPED.inc(len(events))
+                        logger.error("❌ Dropping %s tracking events, buffer is full", len(events),
+                                     extra={'event': 'tracking_events_dropped'})
+                raise
+            finally:
+                TRACKING_EVENT_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            TRACKING_EVENTS_FLUSHED.inc(len(events))
+            return len(events)
+
+@instrumented_job('flush_tracking_events', log_every_run=False)
+def write_tracking_events(events):
+    """Insert a batch of buffered events and roll it up into the tracking counters"""
+    conn, cur = get_direct_db_connection()
+    try:
+        try:
+            resolved = _insert_tracking_events(cur, events)
+        except psycopg2.errors.CheckViolation:
+            # No partition for the event time yet (e.g. first flush of a new month)
+            conn.rollback()
+            ensure_tracking_event_partitions(cur)
+            resolved = _insert_tracking_events(cur, events)
+        first_touches = _rollup_tracking_events(cur, resolved)
+        _rollup_engagement_buckets(cur, resolved, first_touches)
+        conn.commit()
+        logger.debug("✅ Flushed %s tracking events (%s received)", len(resolved), len(events),
+                     extra={'event': 'tracking_flushed'})
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _insert_tracking_events(cur, events):
+    """Insert events, resolving tracking/campaign ids from email_tracking. Unknown ids are dropped."""
+    by_pixel = [e for e in events if e[2] is not None]
+    by_tracking_id = [e for e in events if e[2] is None and e[3] is not None]
+    resolved = []
+    for rows, join_condition in ((by_pixel, EVENT_JOIN_BY_PIXEL), (by_tracking_id, EVENT_JOIN_BY_TRACKING_ID)):
+        if not rows:
+            continue
+        resolved.extend(psycopg2.extras.execute_values(
+            cur, INSERT_TRACKING_EVENTS_SQL.format(source="(VALUES %s)", join_condition=join_condition), rows,
+            template="(%s::timestamptz, %s, %s, %s, %s, %s, %s, %s, %s)", page_size=len(rows), fetch=True))
+    return resolved
+
+def _rollup_tracking_events(cur, resolved):
+    """Apply a batch of inserted events to email_tracking and url_tracking in one statement each.
+
+    Returns the email_tracking rows whose first open or first click happened in this batch.
+    """
+    tracking_rows, url_rows = summarize_tracking_events(resolved)
+
+    first_touches = []
+    if tracking_rows:
+        first_touches = psycopg2.extras.execute_values(
+            cur, EMAIL_TRACKING_ROLLUP_SQL.format(source="(VALUES %s)"), tracking_rows,
+            template="(%s::uuid, %s, %s::timestamptz, %s, %s::timestamptz, %s, %s)", page_size=len(tracking_rows),
+            fetch=True)
+
+    if url_rows:
+        url_updates = psycopg2.extras.execute_values(
+            cur, URL_TRACKING_ROLLUP_SQL.format(source="(VALUES %s)"), url_rows,
+            template="(%s::uuid, %s, %s::timestamptz, %s::timestamptz)", page_size=len(url_rows), fetch=True)
+
+        # Roll the per-recipient link clicks up into the campaign-level link counters
+        link_rows = summarize_link_clicks(url_updates)
+        if link_rows:
+            psycopg2.extras.execute_values(
+                cur, CAMPAIGN_LINKS_ROLLUP_SQL.format(source="(VALUES %s)"), link_rows,
+                template="(%s::uuid, %s, %s, %s::timestamptz, %s::timestamptz)", page_size=len(link_rows))
+
+    return [row for row in first_touches if row['is_first_open'] or row['is_first_click']]
+
+def _rollup_engagement_buckets(cur, resolved, first_touches):
+    """Add a batch of events to the per-campaign 5 minute engagement rollups"""
+    bucket_rows = summarize_engagement_buckets(resolved, first_touches)
+    if not bucket_rows:
+        return
+    psycopg2.extras.execute_values(
+        cur, ENGAGEMENT_ROLLUP_SQL.format(source="VALUES %s"), bucket_rows,
+        template="(%s::uuid, %s, %s, %s, %s)", page_size=len(bucket_rows))
+
+class SampledAccessLog:
+    """Log roughly `sample_rate` of the hits passed to it, never more than `max_per_second`"""
+
+    def __init__(self, sample_rate=TRACKING_LOG_SAMPLE_RATE, max_per_second=TRACKING_LOG_MAX_PER_SECOND,
+                 enabled=TRACKING_LOG_HITS):
+        self.every = max(1, round(1 / sample_rate)) if enabled and sample_rate > 0 else 0
+        self.max_per_second = max_per_second
+        self._counter = itertools.count()
+        self._second = 0
+        self._logged_this_second = 0
+
+    def log(self, message, *args, **fields):
+        """Log message % args, with fields as structured extras, if this hit is sampled.
+        Formatting only happens for sampled hits."""
+        if not self.every or next(self._counter) % self.every:
+            return
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second = second
+            self._logged_this_second = 0
+        if self._logged_this_second >= self.max_per_second:
+            return
+        self._logged_this_second += 1
+        logger.info(message, *args, extra=fields)
+
+tracking_event_buffer = TrackingEventBuffer()
+TRACKING_EVENT_BUFFER_DEPTH.set_function(tracking_event_buffer.pending)
+open_dedup_cache = OpenDedupCache()
+tracking_access_log = SampledAccessLog()
+
+def tracking_pixel_response():
+    """1x1 transparent GIF response built from the prebuilt body and headers"""
+    return Response(TRACKING_PIXEL_GIF, status=200, headers=TRACKING_PIXEL_HEADERS, mimetype='image/gif')
+
+def beacon_response(body=BEACON_OK_BODY):
+    return Response(body, status=200, headers=BEACON_HEADERS, mimetype='application/json')
+
+redirect_cache = RedirectCache()
+
+def resolve_click_destination(url_tracking_id):
+    """Return (original_url, tracking_id) for a tracked link, or None if it doesn't exist"""
+    entry = redirect_cache.get(url_tracking_id)
+    if entry is not None:
+        return entry
+    conn, cur = get_direct_db_connection()
+    try:
+        cur.execute(CLICK_DESTINATION_SQL.format(url_tracking_id="%s"), (url_tracking_id,))
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return redirect_cache.put(url_tracking_id, row['original_url'], str(row['tracking_id']))
+
+def flush_tracking_events_at_exit():
+    """Flush whatever is still buffered when the process exits"""
+    try:
+        tracking_event_buffer.flush()
+    except Exception as e:
+        logger.error("❌ Error flushing tracking events at exit: %s", e, extra={'event': 'tracking_flush_failed'})
+
+atexit.register(flush_tracking_events_at_exit)
+
+@instrumented_job('maintain_tracking_event_partitions')
+def maintain_tracking_event_partitions():
+    """Scheduled job: create upcoming partitions and drop ones past the retention window"""
+    conn = None
+    try:
+        conn, cur = get_direct_db_connection()
+        ensure_tracking_event_partitions(cur)
+        dropped = drop_expired_tracking_event_partitions(cur, TRACKING_EVENT_RETENTION_MONTHS)
+        conn.commit()
+        if dropped:
+            logger.info("Dropped expired tracking event partitions: %s", ', '.join(dropped),
+                        extra={'event': 'tracking_partitions_dropped'})
+    except Exception as e:
+        logger.error("Error maintaining tracking event partitions: %s", e,
+                     extra={'event': 'tracking_partition_maintenance_failed'})
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
 
 def add_tracking_links(html_content, campaign_id, tracking_id, base_url):
     """Replace all links in HTML content with tracking links"""
+    from bs4 import BeautifulSoup
     
     
     soup = BeautifulSoup(html_content, 'html.parser')
     conn = None
     
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
         # Find all links
         for a_tag in soup.find_all('a', href=True):
@@ -341,7 +1074,7 @@ def add_tracking_links(html_content, campaign_id, tracking_id, base_url):
         return str(soup)
         
     except Exception as e:
-        app.logger.error(f"Error adding tracking links: {str(e)}")
+        logger.error(f"Error adding tracking links: {str(e)}")
         if conn:
             conn.rollback()
         return html_content  # Return original content on error
@@ -349,89 +1082,137 @@ def add_tracking_links(html_content, campaign_id, tracking_id, base_url):
         if conn:
             conn.close()
 
-def rewrite_links(html_content, tracking_id, base_url):
+# (campaign_id, original_url) -> link_id, so each send only resolves a campaign's links once
+_campaign_link_cache = {}
+
+def get_campaign_link_ids(cur, campaign_id, urls):
+    """Map each URL to its campaign_links id, creating missing dictionary rows"""
+    campaign_id = str(campaign_id)
+    link_ids = {}
+    missing = []
+    for url in urls:
+        link_id = _campaign_link_cache.get((campaign_id, url))
+        if link_id:
+            link_ids[url] = link_id
+        else:
+            missing.append(url)
+    if missing:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO campaign_links (campaign_id, original_url)
+            VALUES %s
+            ON CONFLICT (campaign_id, url_hash) DO NOTHING
+        """, [(campaign_id, url) for url in sorted(set(missing))])
+        cur.execute("""
+            SELECT link_id, original_url FROM campaign_links
+            WHERE campaign_id = %s AND url_hash = ANY(ARRAY(SELECT md5(u) FROM unnest(%s::text[]) AS u))
+        """, (campaign_id, missing))
+        if len(_campaign_link_cache) > 10000:
+            _campaign_link_cache.clear()
+        for row in cur.fetchall():
+            _campaign_link_cache[(campaign_id, row['original_url'])] = str(row['link_id'])
+            link_ids[row['original_url']] = str(row['link_id'])
+    return link_ids
+
+def trackable_links(soup):
+    """The <a> tags click tracking rewrites - mailto: links, anchors, and javascript: links are skipped"""
+    return [a_tag for a_tag in soup.find_all('a', href=True)
+            if not a_tag['href'].startswith(('mailto:', '#', 'javascript:'))]
+
+def click_tracking_url(base_url, tracking_id, url_tracking_id):
+    return f"{base_url}track/click/{tracking_id}/{url_tracking_id}"
+
+def add_click_beacon(soup, tracking_id, base_url):
+    """Add JavaScript beacon tracking as a backup for image blocking.
+    This only works if the email client allows JavaScript"""
+    js_beacon = soup.new_tag('script')
+    js_beacon.string = f"""
+            (function() {{
+                try {{
+                    setTimeout(function() {{
+                        var img = new Image();
+                        img.onload = function() {{ /* loaded */ }};
+                        img.onerror = function() {{ /* error */ }};
+                        img.src = '{base_url}track/beacon/{tracking_id}?t=' + new Date().getTime();
+                    }}, 1000);
+                }} catch(e) {{
+                    // Silently fail if JS is blocked
+                }}
+            }})();
+        """
+    
+    # Add the beacon script to the body
+    if soup.body:
+        soup.body.append(js_beacon)
+
+def insert_url_tracking(cur, url_rows):
+    """Insert (url_tracking_id, tracking_id, link_id, tracking_url) rows in one statement;
+    the URL itself lives in campaign_links. Rows that already exist are left alone"""
+    if url_rows:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO url_tracking
+            (url_tracking_id, tracking_id, link_id, tracking_url, click_count)
+            VALUES %s
+            ON CONFLICT (url_tracking_id) DO NOTHING
+        """, url_rows, template="(%s, %s, %s, %s, 0)", page_size=len(url_rows))
+
+def track_batch_links(cur, batch, link_ids, base_url):
+    """url_tracking rows for the compiled template's links in every message of a claimed batch.
+
+    The ids are derived from the tracking id, so a recipient deferred and claimed again
+    gets the same rows. Returns tracking_id -> url_tracking_ids in link order.
+    """
+    url_tracking_ids = {}
+    url_rows = []
+    for recipient in batch:
+        tracking_id = str(recipient['tracking_id'])
+        ids = url_tracking_ids[tracking_id] = [str(uuid.uuid5(uuid.UUID(tracking_id), str(index)))
+                                               for index in range(len(link_ids))]
+        url_rows.extend((url_tracking_id, tracking_id, link_id, click_tracking_url(base_url, tracking_id, url_tracking_id))
+                        for url_tracking_id, link_id in zip(ids, link_ids))
+    insert_url_tracking(cur, url_rows)
+    return url_tracking_ids
+
+def rewrite_links(html_content, tracking_id, base_url, campaign_id):
     """Replace all links in HTML content with tracking links"""
     from bs4 import BeautifulSoup
     import uuid
     
-    app.logger.info(f"🔗 Rewriting links for tracking_id: {tracking_id}")
+    logger.debug("🔗 Rewriting links for tracking_id: %s", tracking_id)
     soup = BeautifulSoup(html_content, 'html.parser')
     conn = None
     
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
-        link_count = 0
         # Find all links
-        for a_tag in soup.find_all('a', href=True):
-            original_url = a_tag['href']
-            
-            # Skip mailto: links, anchors, and javascript: links
-            if original_url.startswith('mailto:') or original_url.startswith('#') or original_url.startswith('javascript:'):
-                continue
-                
+        a_tags = trackable_links(soup)
+        link_ids = get_campaign_link_ids(cur, campaign_id, [a_tag['href'] for a_tag in a_tags])
+        
+        url_rows = []
+        for a_tag in a_tags:
             # Create a unique ID for this link
             url_tracking_id = str(uuid.uuid4())
             
             # Create tracking URL
-            tracking_url = f"{base_url}track/click/{tracking_id}/{url_tracking_id}"
-            
-            # Insert into url_tracking table
-            cur.execute("""
-                INSERT INTO url_tracking
-                (tracking_id, original_url, tracking_url, click_count)
-                VALUES (%s, %s, %s, 0)
-                RETURNING url_tracking_id
-            """, (tracking_id, original_url, tracking_url))
-            
-            # Get the inserted ID
-            db_url_id = cur.fetchone()['url_tracking_id']
-            
-            # Update tracking URL with actual ID from database
-            tracking_url = f"{base_url}track/click/{tracking_id}/{db_url_id}"
+            tracking_url = click_tracking_url(base_url, tracking_id, url_tracking_id)
+            url_rows.append((url_tracking_id, tracking_id, link_ids[a_tag['href']], tracking_url))
             
             # Replace the href attribute
             a_tag['href'] = tracking_url
-            link_count += 1
+        link_count = len(url_rows)
+        insert_url_tracking(cur, url_rows)
             
         # Commit all the URL tracking entries
         conn.commit()
-        app.logger.info(f"✅ Rewrote {link_count} links for tracking_id: {tracking_id}")
-        
-        # Add JavaScript beacon tracking as a backup for image blocking
-        # This only works if the email client allows JavaScript
-        js_beacon = soup.new_tag('script')
-        js_beacon.string = f"""
-            (function() {{
-                try {{
-                    setTimeout(function() {{
-                        var img = new Image();
-                        img.onload = function() {{ /* loaded */ }};
-                        img.onerror = function() {{ /* error */ }};
-                        img.src = '{base_url}track/beacon/{tracking_id}?t=' + new Date().getTime();
-                    }}, 1000);
-                }} catch(e) {{
-                    // Silently fail if JS is blocked
-                }}
-            }})();
-        """
+        logger.debug("✅ Rewrote %s links for tracking_id: %s", link_count, tracking_id)
         
-        # Add the beacon script to the body
-        if soup.body:
-            soup.body.append(js_beacon)
+        add_click_beacon(soup, tracking_id, base_url)
         
         # Return the modified HTML
         return str(soup)
         
     except Exception as e:
-        app.logger.error(f"❌ Error rewriting links: {str(e)}")
+        logger.error(f"❌ Error rewriting links: {str(e)}")
         if conn:
             conn.rollback()
         # If there's an error, return the original HTML
@@ -440,232 +1221,614 @@ def rewrite_links(html_content, tracking_id, base_url):
         if conn:
             conn.close()
 
-# Email Sending Functions
-# def send_email_async(campaign_id, test_mode=False, base_url=None):
-    """Asynchronously send emails for a campaign"""
-    # Create a new app context for the thread
-    with app.app_context():
-        # Use a direct connection instead of Flask's g since this runs in a background thread
-        conn = None
-        try:
-            # Get public URL for tracking
-            if not base_url:
-                base_url = os.environ.get('BASE_URL', 'http://localhost:5000/')
-                if not base_url.endswith('/'):
-                    base_url += '/'
-            
-            app.logger.info(f"📧 Starting email sending for campaign {campaign_id}, test_mode={test_mode}, base_url={base_url}")
-            
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASS
-            )
-            conn.autocommit = False
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            
-            # Get campaign details
-            cur.execute("""
-                SELECT * FROM email_campaigns WHERE campaign_id = %s
-            """, (campaign_id,))
-            campaign = cur.fetchone()
-            
-            if not campaign:
-                app.logger.error(f"❌ Campaign {campaign_id} not found")
-                return
-            
-            # Get template for campaign
-            cur.execute("""
-                SELECT * FROM email_templates 
-                WHERE campaign_id = %s AND is_active = TRUE
-                LIMIT 1
-            """, (campaign_id,))
-            template = cur.fetchone()
-            
-            if not template:
-                app.logger.error(f"❌ No active template found for campaign {campaign_id}")
-                return
-            
-            if test_mode:
-                # Send only to the campaign owner for testing
-                cur.execute("""
-                    SELECT * FROM users WHERE user_id = %s
-                """, (campaign['user_id'],))
-                user = cur.fetchone()
-                recipients = [{'email': user['email'], 'recipient_id': None}]
-                app.logger.info(f"📧 Test mode: Sending to campaign owner {user['email']}")
+# Merge tags - {{first_name}}, {{company | our customer}}, {{custom_fields.plan}}. A tag names
+# any recipient column or custom_fields key (bare keys that aren't columns are looked up in
+# custom_fields too); the text after | is used when the value is missing or empty
+MERGE_TAG_RE = re.compile(r'\{\{\s*([A-Za-z_][\w.]*)\s*(?:\|\s*(.*?)\s*)?\}\}')
+
+class MergeTemplate:
+    """Template text tokenized once into literal and merge-tag segments.
+
+    render() is a single pass over the segments, so personalizing a message costs
+    the same whether the template uses one merge field or fifty. Values are passed
+    through `escape` (html.escape for HTML bodies); literals and defaults are not.
+    """
+
+    def __init__(self, source, escape=None):
+        self.source = source or ''
+        self.escape = escape
+        self.segments = []  # str literals and (column, custom_key, default) tags
+        position = 0
+        for match in MERGE_TAG_RE.finditer(self.source):
+            if match.start() > position:
+                self.segments.append(self.source[position:match.start()])
+            name, default = match.group(1), match.group(2) or ''
+            if len(default) >= 2 and default[0] == default[-1] and default[0] in '"\'':
+                default = default[1:-1]
+            if name.startswith('custom_fields.'):
+                self.segments.append((None, name[len('custom_fields.'):], default))
             else:
-                # Get all direct recipients for this campaign
-                cur.execute("""
-                    SELECT r.* FROM recipients r
-                    JOIN campaign_recipients cr ON r.recipient_id = cr.recipient_id
-                    WHERE cr.campaign_id = %s AND cr.is_active = TRUE AND r.is_active = TRUE
-                """, (campaign_id,))
-                direct_recipients = cur.fetchall()
-                
-                # Get recipients from groups
-                cur.execute("""
-                    SELECT r.* FROM recipients r
-                    JOIN groups g ON r.group_id = g.group_id
-                    JOIN campaign_groups cg ON g.group_id = cg.group_id
-                    WHERE cg.campaign_id = %s AND cg.is_active = TRUE AND g.is_active = TRUE AND r.is_active = TRUE
-                    AND r.recipient_id NOT IN (
-                        SELECT cr.recipient_id FROM campaign_recipients cr 
-                        WHERE cr.campaign_id = %s AND cr.is_active = TRUE
-                    )
-                """, (campaign_id, campaign_id))
-                group_recipients = cur.fetchall()
-                
-                # Combine both sets of recipients, avoiding duplicates
-                recipients = list(direct_recipients)
-                
-                # Add group recipients that aren't already direct recipients
-                recipient_ids = set(r['recipient_id'] for r in recipients)
-                for recipient in group_recipients:
-                    if recipient['recipient_id'] not in recipient_ids:
-                        recipients.append(recipient)
-                        recipient_ids.add(recipient['recipient_id'])
-                
-                app.logger.info(f"📧 Sending campaign to {len(recipients)} recipients ({len(direct_recipients)} direct, {len(group_recipients)} from groups)")
-            
-            # Email configuration
-            smtp_server = SMTP_SERVER
-            smtp_port = SMTP_PORT
-            smtp_username = SMTP_USERNAME
-            smtp_password = SMTP_PASSWORD
-            
-            # Initialize SMTP server connection
-            app.logger.info(f"🔌 Connecting to SMTP server {smtp_server}:{smtp_port}")
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.ehlo()
+                self.segments.append((name, name, default))
+            position = match.end()
+        if position < len(self.source):
+            self.segments.append(self.source[position:])
+        self.fields = sorted({segment[0] or f"custom_fields.{segment[1]}"
+                              for segment in self.segments if isinstance(segment, tuple)})
+
+    @classmethod
+    def from_compiled(cls, compiled, base_url, escape=None):
+        """Rebuild a template stored by compile_email_template() for one send.
+
+        Its tracking slots become int segments: link i is slot i, then the tracking id
+        and the tracking pixel id, whose values are passed to render() in that order.
+        """
+        template = cls.__new__(cls)
+        template.source = None
+        template.escape = escape
+        template.fields = compiled['fields']
+        link_count = len(compiled['links'])
+        slots = {'tracking_id': link_count, 'pixel_id': link_count + 1}
+        template.segments = []
+        for segment in compiled['segments']:
+            if isinstance(segment, list):
+                kind = segment[0]
+                if kind == 'merge':
+                    segment = tuple(segment[1:])
+                elif kind == 'link':
+                    segment = segment[1]
+                elif kind == 'base_url':
+                    segment = base_url
+                else:
+                    segment = slots[kind]
+            # base_url is the same for every message, so it joins the literals around it
+            if segment.__class__ is str and template.segments and template.segments[-1].__class__ is str:
+                template.segments[-1] += segment
+            else:
+                template.segments.append(segment)
+        return template
+
+    def render(self, recipient, slots=None):
+        if not self.fields and not slots:
+            return self.source
+        custom = recipient.get('custom_fields') or {}
+        if isinstance(custom, str):
+            custom = json.loads(custom)
+        escape = self.escape
+        parts = []
+        for segment in self.segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+                continue
+            if segment.__class__ is int:
+                parts.append(slots[segment])
+                continue
+            column, custom_key, default = segment
+            value = recipient.get(column) if column else None
+            if value is None and column != 'custom_fields':
+                value = custom.get(custom_key)
+            if value is None or value == '':
+                parts.append(default)
+            else:
+                value = value if isinstance(value, str) else str(value)
+                parts.append(escape(value) if escape else value)
+        return ''.join(parts)
+
+class TemplateError(ValueError):
+    """A template that can't be saved to the library as given"""
+
+# Bumped whenever compile_email_template() output changes, so stored forms get rebuilt
+TEMPLATE_COMPILER_VERSION = 1
+
+def compile_email_template(html_content):
+    """Parse an HTML template once into the form tracked sends render from.
+
+    Returns a JSON-able dict: the merge fields used, the inventory of tracked links, the
+    source size and md5, and `segments` - the fully tracked HTML (rewritten links, click
+    beacon, tracking pixels) as literals and slots for merge tags, base_url, link ids and
+    the tracking ids, so sending needs no HTML parsing at all. Templates whose tracked
+    links or tag names contain merge tags get `segments` None and are sent the slow way.
+    Raises TemplateError for empty templates and malformed merge tags.
+    """
+    from bs4 import BeautifulSoup
+    
+    if not html_content or not html_content.strip():
+        raise TemplateError('Template HTML is empty')
+    merge = MergeTemplate(html_content)
+    for segment in merge.segments:
+        if isinstance(segment, str) and ('{{' in segment or '}}' in segment):
+            brace = segment.find('{{') if '{{' in segment else segment.find('}}')
+            raise TemplateError(f"Malformed merge tag near: {segment[max(brace - 20, 0):brace + 40]!r}")
+    
+    # Every slot becomes a lowercase alphanumeric word the parser leaves as it is
+    marker = f"x{uuid.uuid4().hex[:12]}"
+    def slot(kind, index=''):
+        return f"{marker}{kind}{index}z"
+    
+    source = []
+    tags = []
+    for segment in merge.segments:
+        if isinstance(segment, tuple):
+            source.append(slot('m', len(tags)))
+            tags.append(segment)
+        else:
+            source.append(segment)
+    slot_re = re.compile(marker + r'([mltpb])(\d*)z')
+    def tag_text(match):
+        column, custom_key, _ = tags[int(match.group(2))]
+        return '{{' + (column or f"custom_fields.{custom_key}") + '}}'
+    
+    soup = BeautifulSoup(''.join(source), 'html.parser')
+    a_tags = trackable_links(soup)
+    compiled = {
+        'version': TEMPLATE_COMPILER_VERSION,
+        'source_md5': hashlib.md5(html_content.encode('utf-8')).hexdigest(),
+        'size': len(html_content.encode('utf-8')),
+        'fields': merge.fields,
+        'links': [slot_re.sub(tag_text, a_tag['href']) for a_tag in a_tags],
+        'segments': None,
+    }
+    # A personalized link needs its own campaign_links row per recipient, and a merge tag
+    # standing in for a tag or attribute name would be reparsed differently once filled in
+    if any(marker in a_tag['href'] for a_tag in a_tags) or any(
+            marker in tag.name or any(marker in name for name in tag.attrs) for tag in soup.find_all(True)):
+        return compiled
+    
+    for index, a_tag in enumerate(a_tags):
+        a_tag['href'] = click_tracking_url(slot('b'), slot('t'), slot('l', index))
+    add_click_beacon(soup, slot('t'), slot('b'))
+    tracked = add_tracking_elements(str(soup), slot('p'), slot('t'), slot('b'))
+    
+    kinds = {'b': ['base_url'], 't': ['tracking_id'], 'p': ['pixel_id']}
+    segments = []
+    seen_tags = []
+    position = 0
+    for match in slot_re.finditer(tracked):
+        if match.start() > position:
+            segments.append(tracked[position:match.start()])
+        kind, index = match.group(1), match.group(2)
+        if kind == 'm':
+            seen_tags.append(int(index))
+            segments.append(['merge', *tags[int(index)]])
+        elif kind == 'l':
+            segments.append(['link', int(index)])
+        else:
+            segments.append(kinds[kind])
+        position = match.end()
+    if position < len(tracked):
+        segments.append(tracked[position:])
+    # Each merge tag has to come through exactly once, or the slow path is the safe one
+    if sorted(seen_tags) == list(range(len(tags))):
+        compiled['segments'] = segments
+    return compiled
+
+def stored_compiled_template(template):
+    """The template row's compiled form if it is current for its HTML, else None"""
+    compiled = template.get('compiled')
+    if (compiled and compiled.get('version') == TEMPLATE_COMPILER_VERSION
+            and compiled.get('source_md5') == hashlib.md5(template['html_content'].encode('utf-8')).hexdigest()):
+        return compiled
+    return None
+
+def compiled_template_json(html_content):
+    """compile_email_template() as JSON text for the compiled column, or None for templates
+    saved with a campaign that don't compile - those are still accepted and sent uncompiled"""
+    try:
+        return json.dumps(compile_email_template(html_content))
+    except TemplateError as e:
+        logger.info("Template saved without a compiled form: %s", e)
+        return None
+
+# Email Sending Functions
+def open_smtp_connection():
+    """Open an authenticated SMTP session with the configured server"""
+    import smtplib
+    logger.info(f"🔌 Connecting to SMTP server {SMTP_SERVER}:{SMTP_PORT}")
+    try:
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        server.ehlo()
+        if SMTP_USE_TLS:
             server.starttls()
-            server.login(smtp_username, smtp_password)
-            app.logger.info("✅ SMTP connection established")
-            
-            # Track send counts
-            success_count = 0
-            failure_count = 0
-            
-            for recipient in recipients:
-                try:
-                    # Create unique tracking pixel for this email
-                    tracking_pixel_id = str(uuid.uuid4())
-                    app.logger.debug(f"🔍 Created tracking pixel ID: {tracking_pixel_id} for {recipient['email']}")
-                    
-                    # Create tracking entry
-                    if not test_mode:
-                        cur.execute("""
-                            INSERT INTO email_tracking 
-                            (campaign_id, recipient_id, tracking_pixel_id, email_status)
-                            VALUES (%s, %s, %s, 'sending')
-                            RETURNING tracking_id
-                        """, (campaign_id, recipient['recipient_id'], tracking_pixel_id))
-                        tracking = cur.fetchone()
-                        conn.commit()
-                        app.logger.debug(f"✅ Created tracking entry: {tracking['tracking_id']}")
-                    else:
-                        # For test mode, create a temporary tracking ID
-                        tracking = {'tracking_id': str(uuid.uuid4())}
-                    
-                    # Personalize email content
-                    html_content = template['html_content']
-                    text_content = template.get('text_content', '')
-                    
-                    if not test_mode and recipient.get('first_name'):
-                        html_content = html_content.replace('{{first_name}}', recipient['first_name'])
-                        text_content = text_content.replace('{{first_name}}', recipient['first_name'])
-                        if recipient.get('last_name'):
-                            html_content = html_content.replace('{{last_name}}', recipient['last_name'])
-                            text_content = text_content.replace('{{last_name}}', recipient['last_name'])
-                    
-                    # Add tracking pixel
-                    tracking_pixel_url = f"{base_url}track/open/{tracking_pixel_id}"
-                    tracking_pixel = f'<img src="{tracking_pixel_url}" width="1" height="1" alt="" style="display:none" />'
-                    
-                    # First rewrite links for click tracking
-                    if not test_mode:
-                        html_content = rewrite_links(html_content, tracking['tracking_id'], base_url)
-                    
-                    # Add the tracking pixel at the very end
-                    html_content = html_content + tracking_pixel
-                    
-                    # Create email message
-                    msg = MIMEMultipart('alternative')
-                    msg['Subject'] = campaign['subject_line']
-                    msg['From'] = f"{campaign['from_name']} <{campaign['from_email']}>"
-                    msg['To'] = recipient['email']
-                    msg['Reply-To'] = campaign['reply_to_email']
-                    # Add important headers for better deliverability
-                    msg['List-Unsubscribe'] = f"<mailto:{campaign['reply_to_email']}?subject=Unsubscribe>"
-                    
-                    # Add text and HTML parts
-                    if text_content:
-                        part1 = MIMEText(text_content, 'plain')
-                        msg.attach(part1)
-                    
-                    part2 = MIMEText(html_content, 'html')
-                    msg.attach(part2)
-                    
-                    # Send the email
-                    server.send_message(msg)
-                    success_count += 1
-                    
-                    # Log that message was sent
-                    app.logger.info(f"✅ Email sent to {recipient['email']}")
-                    
-                    # Update tracking status
-                    if not test_mode:
-                        cur.execute("""
-                            UPDATE email_tracking
-                            SET email_status = 'sent', sent_at = NOW(), updated_at = NOW()
-                            WHERE tracking_id = %s
-                        """, (tracking['tracking_id'],))
-                        conn.commit()
-                
-                except Exception as e:
-                    app.logger.error(f"❌ Error sending email to {recipient['email']}: {str(e)}")
-                    failure_count += 1
-                    if not test_mode:
-                        try:
-                            cur.execute("""
-                                UPDATE email_tracking
-                                SET email_status = 'failed', updated_at = NOW()
-                                WHERE tracking_id = %s
-                            """, (tracking['tracking_id'],))
-                            conn.commit()
-                        except Exception as ex:
-                            app.logger.error(f"❌ Error updating tracking status: {str(ex)}")
-                            conn.rollback()
-            
-            # Close the SMTP connection
-            server.quit()
-            app.logger.info(f"✅ SMTP connection closed, sent {success_count} emails, {failure_count} failures")
-            
-            # Update campaign status
-            if not test_mode:
-                cur.execute("""
-                    UPDATE email_campaigns
-                    SET status = 'completed', sent_at = NOW()
-                    WHERE campaign_id = %s
-                """, (campaign_id,))
-                conn.commit()
-                app.logger.info(f"✅ Campaign {campaign_id} marked as completed")
-                
-        except Exception as e:
-            app.logger.error(f"❌ Error in send_email_async: {str(e)}")
-            if conn:
-                conn.rollback()
-        finally:
-            if conn:
-                conn.close()
+        if SMTP_USERNAME:
+            server.login(SMTP_USERNAME, SMTP_PASSWORD)
+    except Exception:
+        SMTP_CONNECTION_ERRORS.inc()
+        raise
+    SMTP_CONNECTIONS.inc()
+    logger.info("✅ SMTP connection established")
+    return server
+
+# Outbound throttling
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`. take() never blocks."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token and return 0, or return the seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+class SendThrottle:
+    """Outbound limits shared by every campaign send in this process.
+
+    The global rate is enforced by sleeping, since every message waits on it
+    anyway. A domain that is over its rate or backing off after a 4xx reply only
+    delays its own recipients - the send loop re-queues them and moves on.
+    """
+
+    def __init__(self, rate=SEND_RATE, burst=SEND_BURST, domain_rate=SEND_DOMAIN_RATE,
+                 domain_burst=SEND_DOMAIN_BURST, domain_rates=SEND_DOMAIN_RATES,
+                 backoff=SEND_BACKOFF_SECONDS, backoff_max=SEND_BACKOFF_MAX_SECONDS):
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.domain_rates = dict(domain_rates or {})
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._domain_buckets = {}
+        self._backoffs = {}  # domain -> (monotonic deadline, consecutive 4xx replies)
+        self._lock = threading.Lock()
+
+    def wait(self, keepalive=None):
+        """Block until the global rate allows another message.
+
+        With `keepalive`, long waits are slept in slices with a keepalive() call after
+        each, so a sender holding a lease can renew it while it waits.
+        """
+        if self.bucket is None:
+            return
+        delay = self.bucket.take()
+        while delay > 0:
+            if keepalive:
+                delay = min(delay, SEND_LEASE_SECONDS / 4)
+            SEND_THROTTLE_WAIT_SECONDS.inc(delay)
+            time.sleep(delay)
+            if keepalive:
+                keepalive()
+            delay = self.bucket.take()
+
+    def domain_delay(self, domain):
+        """0 if a message to `domain` may go now (taking its token), else seconds to wait"""
+        now = time.monotonic()
+        with self._lock:
+            backoff = self._backoffs.get(domain)
+            if backoff and backoff[0] > now:
+                return backoff[0] - now
+            bucket = self._domain_buckets.get(domain)
+            if bucket is None:
+                rate = self.domain_rates.get(domain, self.domain_rate)
+                if rate <= 0:
+                    return 0.0
+                bucket = self._domain_buckets[domain] = TokenBucket(rate, self.domain_burst)
+        return bucket.take()
+
+    def deferred(self, domain):
+        """The server answered 4xx for `domain`: back off and return the delay in seconds"""
+        with self._lock:
+            _, failures = self._backoffs.get(domain, (0, 0))
+            delay = min(self.backoff * 2 ** failures, self.backoff_max)
+            self._backoffs[domain] = (time.monotonic() + delay, failures + 1)
+        return delay
+
+    def delivered(self, domain):
+        """A message to `domain` was accepted, so its backoff starts over"""
+        if domain in self._backoffs:
+            with self._lock:
+                self._backoffs.pop(domain, None)
+
+    def backed_off(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for deadline, _ in self._backoffs.values() if deadline > now)
+
+send_throttle = SendThrottle()
+SEND_DOMAINS_BACKED_OFF.set_function(send_throttle.backed_off)
+
+# Send failures - classified per message by classify_send_error()
+class SMTPUnavailable(Exception):
+    """The SMTP server can't be reached even after reconnecting; the send stops and is recovered later"""
+
+def smtp_reply_code(error):
+    """SMTP reply code carried by an smtplib exception, or None"""
+    import smtplib
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return codes[0] if codes else None
+    return getattr(error, 'smtp_code', None)
+
+def classify_send_error(error):
+    """'connection', 'transient' or 'permanent' for an exception raised while sending one message.
+
+    Connection-level errors (dropped session, socket errors) are worth an immediate
+    reconnect; 4xx replies are worth retrying later; 5xx replies and anything else
+    (rendering bugs included) fail the recipient.
+    """
+    import smtplib
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return 'connection'
+    code = smtp_reply_code(error)
+    if code is not None:
+        return 'transient' if 400 <= code < 500 else 'permanent'
+    # smtplib exceptions without a reply code are OSErrors too, so check this last
+    if isinstance(error, OSError):
+        return 'connection'
+    return 'permanent'
+
+def describe_send_error(error):
+    """Short reason for email_tracking.last_error"""
+    import smtplib
+    code = smtp_reply_code(error)
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        message = next(iter(error.recipients.values()))[1] if error.recipients else b''
+    else:
+        message = getattr(error, 'smtp_error', None)
+    if code is not None and message is not None:
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        reason = f"{code} {message}"
+    else:
+        reason = f"{type(error).__name__}: {error}"
+    return reason[:500]
+
+def retry_delay(attempt):
+    """Seconds before retry number `attempt` (1-based): exponential, capped, with jitter"""
+    delay = min(SEND_RETRY_BASE_SECONDS * 2 ** (attempt - 1), SEND_RETRY_MAX_SECONDS)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+# Longest line SMTP allows (RFC 5321), without the CRLF
+SMTP_MAX_LINE = 998
+
+class CampaignMessage:
+    """Wire-format builder for one campaign's multipart/alternative messages.
+
+    Everything that is the same for every recipient - From, Reply-To, the MIME
+    boundary, the part headers and the Subject unless it has merge tags - is encoded
+    to bytes once per campaign. build() only encodes the To, Message-ID and
+    List-Unsubscribe headers, a personalized Subject and the two bodies and joins
+    the pieces, so the result can go straight to SMTP.sendmail() without building
+    and flattening an email.message tree per recipient.
+    """
+
+    def __init__(self, campaign, base_url=None):
+        from email.header import Header
+        from email.utils import formataddr
+        self._header_class = Header
+        self.envelope_from = campaign['from_email']
+        self.message_id_domain = self.envelope_from.rpartition('@')[2].encode('idna').decode('ascii') or 'localhost'
+        self.boundary = f"==============={secrets.token_hex(16)}=="
+        reply_to = campaign['reply_to_email']
+        self.headers = b''.join([
+            b'Content-Type: multipart/alternative; boundary="' + self.boundary.encode('ascii') + b'"\r\n',
+            b'MIME-Version: 1.0\r\n',
+            self._header('From', formataddr((campaign['from_name'] or '', campaign['from_email']), charset='utf-8')),
+            self._header('Reply-To', reply_to),
+        ])
+        # Add important headers for better deliverability - with a base URL the unsubscribe link
+        # is per recipient and supports one-click unsubscribe (RFC 8058)
+        self.unsubscribe_mailto = f"<mailto:{reply_to}?subject=Unsubscribe>"
+        self.unsubscribe_url = f"{base_url}unsubscribe/" if base_url else None
+        if self.unsubscribe_url:
+            self.headers += b'List-Unsubscribe-Post: List-Unsubscribe=One-Click\r\n'
+        else:
+            self.headers += self._header('List-Unsubscribe', self.unsubscribe_mailto)
+        delimiter = b'--' + self.boundary.encode('ascii')
+        self.part_headers = {}
+        for subtype in ('plain', 'html'):
+            self.part_headers[subtype, '7bit'] = (
+                delimiter + b'\r\nContent-Type: text/' + subtype.encode('ascii') + b'; charset="us-ascii"\r\n'
+                b'MIME-Version: 1.0\r\nContent-Transfer-Encoding: 7bit\r\n\r\n')
+            self.part_headers[subtype, 'base64'] = (
+                delimiter + b'\r\nContent-Type: text/' + subtype.encode('ascii') + b'; charset="utf-8"\r\n'
+                b'MIME-Version: 1.0\r\nContent-Transfer-Encoding: base64\r\n\r\n')
+        self.closing = b'\r\n' + delimiter + b'--\r\n'
+        # A subject with merge tags is encoded per recipient, otherwise it's part of the static headers
+        self.subject = MergeTemplate(campaign['subject_line'])
+        if not self.subject.fields:
+            self.headers += self._header('Subject', self.subject.source)
+
+    def _header(self, name, value):
+        value = value or ''
+        if value.isascii() and len(name) + len(value) + 2 <= SMTP_MAX_LINE and '\n' not in value:
+            return f"{name}: {value}\r\n".encode('ascii')
+        encoded = self._header_class(value, 'utf-8', header_name=name).encode(linesep='\r\n')
+        return f"{name}: {encoded}\r\n".encode('ascii')
+
+    def _part(self, subtype, body):
+        # Plain ASCII goes as 7bit like MIMEText would send it; anything else is UTF-8 base64
+        if body.isascii():
+            lines = body.splitlines()
+            if all(len(line) <= SMTP_MAX_LINE for line in lines):
+                return self.part_headers[subtype, '7bit'] + '\r\n'.join(lines).encode('ascii') + b'\r\n'
+        encoded = base64.encodebytes(body.encode('utf-8')).replace(b'\n', b'\r\n')
+        return self.part_headers[subtype, 'base64'] + encoded
+
+    def build(self, recipient, text_content, html_content):
+        """Complete message bytes for one recipient"""
+        # The tracking id in Message-ID ties bounces (and replies) back to this email
+        parts = [self.headers, self._header('To', recipient['email']),
+                 f"Message-ID: <{recipient['tracking_id']}@{self.message_id_domain}>\r\n".encode('ascii')]
+        if self.unsubscribe_url:
+            parts.append(self._header('List-Unsubscribe', f"<{self.unsubscribe_url}{recipient['tracking_id']}>, "
+                                                          f"{self.unsubscribe_mailto}"))
+        if self.subject.fields:
+            parts.append(self._header('Subject', self.subject.render(recipient)))
+        parts.append(b'\r\n')
+        if text_content:
+            parts.append(self._part('plain', text_content))
+        parts.append(self._part('html', html_content))
+        parts.append(self.closing)
+        return b''.join(parts)
+
+# Campaign outbox - email_tracking rows double as the send queue: 'queued' until a sender
+# claims them, 'sending' while their batch is in flight, then 'sent' or 'failed'. Rows still
+# 'sending' when a campaign is resumed may or may not have gone out and become 'unconfirmed'
+# rather than being sent twice.
+def enqueue_campaign_recipients(cur, campaign_id):
+    """Add a 'queued' row for every unsuppressed audience member without one yet; returns the count"""
+    cur.execute("""
+        INSERT INTO email_tracking (campaign_id, recipient_id, tracking_pixel_id, email_status)
+        SELECT %(campaign_id)s, audience.recipient_id, gen_random_uuid()::text, 'queued'
+        FROM (
+            SELECT r.recipient_id, r.user_id, r.email FROM recipients r
+            JOIN campaign_recipients cr ON r.recipient_id = cr.recipient_id
+            WHERE cr.campaign_id = %(campaign_id)s AND cr.is_active = TRUE AND r.is_active = TRUE
+            UNION
+            SELECT r.recipient_id, r.user_id, r.email FROM recipients r
+            JOIN groups g ON r.group_id = g.group_id
+            JOIN campaign_groups cg ON g.group_id = cg.group_id
+            WHERE cg.campaign_id = %(campaign_id)s AND cg.is_active = TRUE AND g.is_active = TRUE AND r.is_active = TRUE
+        ) audience
+        WHERE NOT EXISTS (
+            SELECT 1 FROM email_tracking et
+            WHERE et.campaign_id = %(campaign_id)s AND et.recipient_id = audience.recipient_id
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM suppressions s
+            WHERE s.user_id = audience.user_id AND s.email = lower(audience.email)
+        )
+    """, {'campaign_id': campaign_id})
+    return cur.rowcount
+
+def release_unconfirmed_recipients(cur, campaign_id):
+    """Mark rows a previous sender left 'sending' as 'unconfirmed'; returns the count"""
+    cur.execute("""
+        UPDATE email_tracking
+        SET email_status = 'unconfirmed', updated_at = NOW()
+        WHERE campaign_id = %s AND email_status = 'sending'
+    """, (campaign_id,))
+    return cur.rowcount
+
+def claim_outbox_batch(cur, campaign_id, limit=SEND_BATCH_SIZE):
+    """Move up to `limit` queued rows to 'sending' and return them joined with their recipient.
+
+    Addresses suppressed since the outbox was filled (an unsubscribe during a long
+    send) become 'suppressed' instead and are left out of the batch.
+    """
+    cur.execute("""
+        UPDATE email_tracking et
+        SET email_status = CASE WHEN EXISTS (
+                SELECT 1 FROM suppressions s
+                WHERE s.user_id = r.user_id AND s.email = lower(r.email)
+            ) THEN 'suppressed' ELSE 'sending' END,
+            updated_at = NOW()
+        FROM recipients r
+        WHERE et.tracking_id IN (
+            SELECT tracking_id FROM email_tracking
+            WHERE campaign_id = %s AND email_status = 'queued'
+            AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        AND r.recipient_id = et.recipient_id
+        RETURNING et.tracking_id, et.tracking_pixel_id, et.retry_count, et.email_status AS outbox_status, r.*
+    """, (campaign_id, limit))
+    batch = cur.fetchall()
+    renew_send_lease(cur, campaign_id)
+    return [row for row in batch if row['outbox_status'] == 'sending']
+
+def renew_send_lease(cur, campaign_id):
+    cur.execute("""
+        UPDATE email_campaigns SET send_heartbeat_at = NOW() WHERE campaign_id = %s
+    """, (campaign_id,))
+
+def seconds_until_next_attempt(cur, campaign_id):
+    """Seconds until the earliest re-queued recipient is due, or None if nothing is queued"""
+    cur.execute("""
+        SELECT COUNT(*) AS queued,
+               GREATEST(EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()), 0) AS wait
+        FROM email_tracking
+        WHERE campaign_id = %s AND email_status = 'queued'
+    """, (campaign_id,))
+    row = cur.fetchone()
+    if not row['queued']:
+        return None
+    return float(row['wait'] or 0)
+
+def checkpoint_outbox_batch(cur, results):
+    """Record (tracking_id, status, sent_at, next_attempt_at, retries, last_error) results
+    for a claimed batch in one statement.
+
+    Opens recorded while the batch was in flight already moved the row past 'sending',
+    so only sent_at is filled in for those.
+    """
+    psycopg2.extras.execute_values(cur, """
+        UPDATE email_tracking et
+        SET email_status = CASE WHEN et.email_status = 'sending' THEN v.status ELSE et.email_status END,
+            sent_at = v.sent_at,
+            next_attempt_at = v.next_attempt_at,
+            retry_count = et.retry_count + v.retries,
+            last_error = COALESCE(v.last_error, et.last_error),
+            updated_at = NOW()
+        FROM (VALUES %s) AS v(tracking_id, status, sent_at, next_attempt_at, retries, last_error)
+        WHERE et.tracking_id = v.tracking_id
+    """, results, template="(%s::uuid, %s, %s::timestamptz, %s::timestamptz, %s::integer, %s::text)",
+       page_size=len(results))
+
+def start_campaign_send(cur, campaign_id, base_url=None):
+    """Hand a campaign to a sender: the queue in SEND_MODE=queue, else a thread in this process.
+
+    Returns True if it was queued. Runs inside the caller's transaction.
+    """
+    if SEND_MODE == 'queue':
+        # A send worker picks it up (python app.py worker)
+        cur.execute("""
+            UPDATE email_campaigns
+            SET status = 'queued'
+            WHERE campaign_id = %s
+        """, (campaign_id,))
+        return True
+    cur.execute("""
+        UPDATE email_campaigns
+        SET status = 'sending', send_heartbeat_at = NOW()
+        WHERE campaign_id = %s
+    """, (campaign_id,))
+    Thread(target=send_email_async, args=(campaign_id, False, base_url)).start()
+    return False
+
+def recover_interrupted_sends():
+    """Restart campaigns whose sender stopped checkpointing (crash, restart, deploy)"""
+    conn, cur = get_direct_db_connection()
+    try:
+        cur.execute("""
+            SELECT campaign_id FROM email_campaigns
+            WHERE status = 'sending'
+            AND (send_heartbeat_at IS NULL OR send_heartbeat_at < NOW() - make_interval(secs => %s))
+            FOR UPDATE SKIP LOCKED
+        """, (SEND_LEASE_SECONDS,))
+        campaign_ids = [str(row['campaign_id']) for row in cur.fetchall()]
+        for campaign_id in campaign_ids:
+            logger.warning("♻️ Resuming interrupted send for campaign %s", campaign_id,
+                           extra={'event': 'send_resumed', 'campaign_id': campaign_id})
+            start_campaign_send(cur, campaign_id)
+        conn.commit()
+        return campaign_ids
+    except Exception as e:
+        logger.error("❌ Error recovering interrupted sends: %s", e, extra={'event': 'send_recovery_failed'})
+        conn.rollback()
+        return []
+    finally:
+        conn.close()
+
 # Find this function in app.py and replace it with this updated version
+@instrumented_job('send_campaign')
 def send_email_async(campaign_id, test_mode=False, base_url=None):
     """Asynchronously send emails for a campaign with improved tracking"""
     # Create a new app context for the thread
-    with app.app_context():
+    with get_app().app_context():
         # Use a direct connection instead of Flask's g since this runs in a background thread
         conn = None
+        EMAIL_CAMPAIGNS_SENDING.inc()
         try:
             # Get public URL for tracking
             if not base_url:
@@ -673,16 +1836,11 @@ def send_email_async(campaign_id, test_mode=False, base_url=None):
                 if not base_url.endswith('/'):
                     base_url += '/'
             
-            app.logger.info(f"📧 Starting email sending for campaign {campaign_id}, test_mode={test_mode}, base_url={base_url}")
+            logger.info("📧 Starting email sending for campaign %s, test_mode=%s, base_url=%s",
+                        campaign_id, test_mode, base_url,
+                        extra={'event': 'campaign_send_started', 'campaign_id': campaign_id})
             
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASS
-            )
-            conn.autocommit = False
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            conn, cur = get_direct_db_connection()
             
             # Get campaign details
             cur.execute("""
@@ -691,7 +1849,8 @@ def send_email_async(campaign_id, test_mode=False, base_url=None):
             campaign = cur.fetchone()
             
             if not campaign:
-                app.logger.error(f"❌ Campaign {campaign_id} not found")
+                logger.error("❌ Campaign %s not found", campaign_id,
+                             extra={'event': 'campaign_not_found', 'campaign_id': campaign_id})
                 return
             
             # Get template for campaign
@@ -703,179 +1862,252 @@ def send_email_async(campaign_id, test_mode=False, base_url=None):
             template = cur.fetchone()
             
             if not template:
-                app.logger.error(f"❌ No active template found for campaign {campaign_id}")
+                logger.error("❌ No active template found for campaign %s", campaign_id,
+                             extra={'event': 'campaign_template_missing', 'campaign_id': campaign_id})
                 return
             
             if test_mode:
-                # Send only to the campaign owner for testing
+                # Send only to the campaign owner for testing, without outbox rows
                 cur.execute("""
                     SELECT * FROM users WHERE user_id = %s
                 """, (campaign['user_id'],))
                 user = cur.fetchone()
-                recipients = [{'email': user['email'], 'recipient_id': None}]
-                app.logger.info(f"📧 Test mode: Sending to campaign owner {user['email']}")
+                test_recipients = [{'email': user['email'], 'recipient_id': None,
+                                    'tracking_id': str(uuid.uuid4()), 'tracking_pixel_id': str(uuid.uuid4())}]
+                logger.info("📧 Test mode: Sending to campaign owner %s", user['email'],
+                            extra={'event': 'campaign_test_send', 'campaign_id': campaign_id})
             else:
-                # Get all direct recipients for this campaign
-                cur.execute("""
-                    SELECT r.* FROM recipients r
-                    JOIN campaign_recipients cr ON r.recipient_id = cr.recipient_id
-                    WHERE cr.campaign_id = %s AND cr.is_active = TRUE AND r.is_active = TRUE
-                """, (campaign_id,))
-                direct_recipients = cur.fetchall()
-                
-                # Get recipients from groups
-                cur.execute("""
-                    SELECT r.* FROM recipients r
-                    JOIN groups g ON r.group_id = g.group_id
-                    JOIN campaign_groups cg ON g.group_id = cg.group_id
-                    WHERE cg.campaign_id = %s AND cg.is_active = TRUE AND g.is_active = TRUE AND r.is_active = TRUE
-                    AND r.recipient_id NOT IN (
-                        SELECT cr.recipient_id FROM campaign_recipients cr 
-                        WHERE cr.campaign_id = %s AND cr.is_active = TRUE
-                    )
-                """, (campaign_id, campaign_id))
-                group_recipients = cur.fetchall()
-                
-                # Combine both sets of recipients, avoiding duplicates
-                recipients = list(direct_recipients)
-                
-                # Add group recipients that aren't already direct recipients
-                recipient_ids = set(r['recipient_id'] for r in recipients)
-                for recipient in group_recipients:
-                    if recipient['recipient_id'] not in recipient_ids:
-                        recipients.append(recipient)
-                        recipient_ids.add(recipient['recipient_id'])
-                
-                app.logger.info(f"📧 Sending campaign to {len(recipients)} recipients ({len(direct_recipients)} direct, {len(group_recipients)} from groups)")
-            
-            # Email configuration
-            smtp_server = SMTP_SERVER
-            smtp_port = SMTP_PORT
-            smtp_username = SMTP_USERNAME
-            smtp_password = SMTP_PASSWORD
+                # Rows a previous sender had in flight are never sent again
+                unconfirmed = release_unconfirmed_recipients(cur, campaign_id)
+                queued = enqueue_campaign_recipients(cur, campaign_id)
+                conn.commit()
+                if unconfirmed:
+                    logger.warning("⚠️ %s recipients of campaign %s were in flight when the last send stopped, "
+                                   "marked unconfirmed", unconfirmed, campaign_id,
+                                   extra={'event': 'recipients_unconfirmed', 'campaign_id': campaign_id})
+                logger.info("📧 Sending campaign %s: %s recipients added to the outbox", campaign_id, queued,
+                            extra={'event': 'campaign_queued', 'campaign_id': campaign_id})
             
             # Initialize SMTP server connection
-            app.logger.info(f"🔌 Connecting to SMTP server {smtp_server}:{smtp_port}")
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.ehlo()
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            app.logger.info("✅ SMTP connection established")
+            try:
+                server = open_smtp_connection()
+            except Exception as e:
+                raise SMTPUnavailable(describe_send_error(e)) from e
+            
+            # Campaign-wide headers and MIME structure, encoded once
+            message = CampaignMessage(campaign, base_url)
+            
+            # Merge tags are parsed once per campaign, not per recipient
+            html_template = MergeTemplate(template['html_content'], escape=html.escape)
+            text_template = MergeTemplate(template.get('text_content'))
+            
+            # Tracked sends render from the template's compiled form, with the links and tracking
+            # elements already in place. It is built when the template is saved, or here once if
+            # it is missing or stale, and kept for the next send
+            tracked_template = None
+            if not test_mode:
+                compiled = stored_compiled_template(template)
+                if compiled is None:
+                    compiled_json = compiled_template_json(template['html_content'])
+                    if compiled_json:
+                        cur.execute("""
+                            UPDATE email_templates SET compiled = %s WHERE template_id = %s
+                        """, (compiled_json, template['template_id']))
+                        compiled = json.loads(compiled_json)
+                if compiled and compiled['segments'] is not None:
+                    tracked_template = MergeTemplate.from_compiled(compiled, base_url, escape=html.escape)
+                    link_ids = get_campaign_link_ids(cur, campaign_id, compiled['links'])
+                    tracked_link_ids = [link_ids[url] for url in compiled['links']]
+                conn.commit()
             
             # Track send counts
             success_count = 0
             failure_count = 0
             
-            # Import our helper function (will be defined above)
-            from bs4 import BeautifulSoup
+            # A batch can take longer than the lease (a low SEND_RATE, slow SMTP replies), so the
+            # heartbeat is also renewed while working through one, or recovery would start a
+            # second sender for this campaign
+            lease_renewed_at = time.monotonic()
+            def keep_lease():
+                nonlocal lease_renewed_at
+                if not test_mode and time.monotonic() - lease_renewed_at >= SEND_LEASE_SECONDS / 4:
+                    renew_send_lease(cur, campaign_id)
+                    conn.commit()
+                    lease_renewed_at = time.monotonic()
             
-            for recipient in recipients:
-                try:
-                    # Create unique tracking pixel for this email
-                    tracking_pixel_id = str(uuid.uuid4())
-                    app.logger.debug(f"🔍 Created tracking pixel ID: {tracking_pixel_id} for {recipient['email']}")
-                    
-                    # Create tracking entry
-                    if not test_mode:
-                        cur.execute("""
-                            INSERT INTO email_tracking 
-                            (campaign_id, recipient_id, tracking_pixel_id, email_status)
-                            VALUES (%s, %s, %s, 'sending')
-                            RETURNING tracking_id
-                        """, (campaign_id, recipient['recipient_id'], tracking_pixel_id))
-                        tracking = cur.fetchone()
-                        conn.commit()
-                        app.logger.debug(f"✅ Created tracking entry: {tracking['tracking_id']}")
-                    else:
-                        # For test mode, create a temporary tracking ID
-                        tracking = {'tracking_id': str(uuid.uuid4())}
-                    
-                    # Personalize email content
-                    html_content = template['html_content']
-                    text_content = template.get('text_content', '')
-                    
-                    if not test_mode and recipient.get('first_name'):
-                        html_content = html_content.replace('{{first_name}}', recipient['first_name'])
-                        text_content = text_content.replace('{{first_name}}', recipient['first_name'])
-                        if recipient.get('last_name'):
-                            html_content = html_content.replace('{{last_name}}', recipient['last_name'])
-                            text_content = text_content.replace('{{last_name}}', recipient['last_name'])
-                    
-                    # First rewrite links for click tracking
-                    if not test_mode:
-                        html_content = rewrite_links(html_content, tracking['tracking_id'], base_url)
-                    
-                    # Add multiple tracking mechanisms using our new function
-                    # The function adds tracking pixels throughout the email for redundancy
-                    html_content = add_tracking_elements(html_content, tracking_pixel_id, tracking['tracking_id'], base_url)
-                    
-                    # Create email message
-                    msg = MIMEMultipart('alternative')
-                    msg['Subject'] = campaign['subject_line']
-                    msg['From'] = f"{campaign['from_name']} <{campaign['from_email']}>"
-                    msg['To'] = recipient['email']
-                    msg['Reply-To'] = campaign['reply_to_email']
-                    # Add important headers for better deliverability
-                    msg['List-Unsubscribe'] = f"<mailto:{campaign['reply_to_email']}?subject=Unsubscribe>"
-                    
-                    # Add text and HTML parts
-                    if text_content:
-                        part1 = MIMEText(text_content, 'plain')
-                        msg.attach(part1)
-                    
-                    part2 = MIMEText(html_content, 'html')
-                    msg.attach(part2)
-                    
-                    # Send the email
-                    server.send_message(msg)
-                    success_count += 1
-                    
-                    # Log that message was sent
-                    app.logger.info(f"✅ Email sent to {recipient['email']}")
-                    
-                    # Update tracking status
-                    if not test_mode:
-                        cur.execute("""
-                            UPDATE email_tracking
-                            SET email_status = 'sent', sent_at = NOW(), updated_at = NOW()
-                            WHERE tracking_id = %s
-                        """, (tracking['tracking_id'],))
+            while True:
+                if test_mode:
+                    batch, test_recipients = test_recipients, []
+                    if not batch:
+                        break
+                else:
+                    batch = claim_outbox_batch(cur, campaign_id)
+                    if batch and tracked_template:
+                        # Committed with the claim, before anything is sent - a click can't
+                        # arrive before its url_tracking row exists
+                        batch_url_tracking_ids = track_batch_links(cur, batch, tracked_link_ids, base_url)
+                    conn.commit()
+                    lease_renewed_at = time.monotonic()
+                    if not batch:
+                        # Only recipients deferred by throttling are left - wait for the first one due.
+                        # Claiming again refreshes the heartbeat, so never sleep through the lease.
+                        wait = seconds_until_next_attempt(cur, campaign_id)
                         conn.commit()
+                        if wait is None:
+                            break
+                        time.sleep(min(max(wait, 0.05), SEND_LEASE_SECONDS / 2))
+                        continue
                 
-                except Exception as e:
-                    app.logger.error(f"❌ Error sending email to {recipient['email']}: {str(e)}")
-                    failure_count += 1
-                    if not test_mode:
+                # (tracking_id, status, sent_at, next_attempt_at, retries, last_error) per recipient,
+                # written back in one checkpoint
+                results = []
+                try:
+                    for recipient in batch:
+                        tracking_id = str(recipient['tracking_id'])
+                        domain = recipient['email'].rpartition('@')[2].lower()
+                        
+                        # A domain over its rate or backing off only delays its own recipients
+                        delay = 0 if test_mode else send_throttle.domain_delay(domain)
+                        if delay > 0:
+                            EMAIL_DEFERRED.inc()
+                            results.append((tracking_id, 'queued', None,
+                                            datetime.now(timezone.utc) + timedelta(seconds=delay), 0, None))
+                            continue
+                        
+                        keep_lease()
+                        message_started = time.perf_counter()
+                        EMAIL_MESSAGES_IN_FLIGHT.inc()
                         try:
-                            cur.execute("""
-                                UPDATE email_tracking
-                                SET email_status = 'failed', updated_at = NOW()
-                                WHERE tracking_id = %s
-                            """, (tracking['tracking_id'],))
-                            conn.commit()
-                        except Exception as ex:
-                            app.logger.error(f"❌ Error updating tracking status: {str(ex)}")
-                            conn.rollback()
+                            text_content = text_template.render(recipient)
+                            if tracked_template:
+                                # One pass over the compiled template fills in the merge tags,
+                                # click tracking ids and tracking pixel
+                                html_content = tracked_template.render(
+                                    recipient, batch_url_tracking_ids[tracking_id]
+                                    + [tracking_id, str(recipient['tracking_pixel_id'])])
+                            else:
+                                # Personalize email content
+                                html_content = html_template.render(recipient)
+                                
+                                # First rewrite links for click tracking
+                                if not test_mode:
+                                    html_content = rewrite_links(html_content, tracking_id, base_url, campaign_id)
+                                
+                                # Add multiple tracking mechanisms using our new function
+                                # The function adds tracking pixels throughout the email for redundancy
+                                html_content = add_tracking_elements(html_content, recipient['tracking_pixel_id'],
+                                                                     tracking_id, base_url)
+                            
+                            # Only the To header and the bodies are encoded per recipient
+                            msg = message.build(recipient, text_content, html_content)
+                            
+                            # Send the email, reconnecting and resending right away if the connection was lost
+                            send_throttle.wait(keepalive=keep_lease)
+                            try:
+                                server.sendmail(message.envelope_from, [recipient['email']], msg)
+                            except Exception as e:
+                                if classify_send_error(e) != 'connection':
+                                    raise
+                                logger.warning("🔌 SMTP connection lost (%s), reconnecting", e)
+                                SMTP_RECONNECTS.inc()
+                                try:
+                                    server.close()
+                                    server = open_smtp_connection()
+                                except Exception as ex:
+                                    raise SMTPUnavailable(describe_send_error(ex)) from ex
+                                server.sendmail(message.envelope_from, [recipient['email']], msg)
+                            send_throttle.delivered(domain)
+                            success_count += 1
+                            EMAIL_SENT.inc()
+                            results.append((tracking_id, 'sent', datetime.now(timezone.utc), None, 0, None))
+                            
+                            # Log that message was sent
+                            logger.info("✅ Email sent to %s", recipient['email'],
+                                        extra={'event': 'email_sent', 'campaign_id': campaign_id,
+                                               'tracking_id': tracking_id})
+                        
+                        except SMTPUnavailable as e:
+                            # Nothing else can be sent either; this recipient goes back to the queue
+                            # and the rest of the batch with it
+                            if not test_mode:
+                                results.append((tracking_id, 'queued', None, None, 0, str(e)))
+                            raise
+                        except Exception as e:
+                            reason = describe_send_error(e)
+                            attempt = recipient.get('retry_count', 0) + 1
+                            if classify_send_error(e) != 'permanent' and attempt <= SEND_MAX_RETRIES and not test_mode:
+                                # Temporary refusal (rate limited, greylisted, mailbox busy) - retry later,
+                                # and back the whole domain off if the server said so
+                                delay = retry_delay(attempt)
+                                if smtp_reply_code(e) is not None:
+                                    delay = max(delay, send_throttle.deferred(domain))
+                                logger.warning("⏳ %s deferred (%s), retry %s/%s in %.0fs", recipient['email'], reason,
+                                               attempt, SEND_MAX_RETRIES, delay,
+                                               extra={'event': 'email_retry', 'campaign_id': campaign_id})
+                                EMAIL_RETRIED.inc()
+                                results.append((tracking_id, 'queued', None,
+                                                datetime.now(timezone.utc) + timedelta(seconds=delay), 1, reason))
+                                continue
+                            if classify_send_error(e) != 'permanent':
+                                reason = f"gave up after {attempt} attempts: {reason}"
+                            logger.error("❌ Error sending email to %s: %s", recipient['email'], reason,
+                                         extra={'event': 'email_failed', 'campaign_id': campaign_id})
+                            failure_count += 1
+                            EMAIL_FAILED.inc()
+                            results.append((tracking_id, 'failed', None, None, 0, reason))
+                        finally:
+                            EMAIL_MESSAGES_IN_FLIGHT.dec()
+                            EMAIL_MESSAGE_SECONDS.observe(time.perf_counter() - message_started)
+                finally:
+                    if not test_mode:
+                        # Recipients of this batch that were never attempted go back to the queue
+                        results.extend((str(recipient['tracking_id']), 'queued', None, None, 0, None)
+                                       for recipient in batch[len(results):])
+                        checkpoint_outbox_batch(cur, results)
+                        conn.commit()
             
             # Close the SMTP connection
             server.quit()
-            app.logger.info(f"✅ SMTP connection closed, sent {success_count} emails, {failure_count} failures")
+            logger.info("✅ SMTP connection closed, sent %s emails, %s failures", success_count, failure_count,
+                        extra={'event': 'smtp_closed', 'campaign_id': campaign_id})
             
             # Update campaign status
             if not test_mode:
                 cur.execute("""
                     UPDATE email_campaigns
-                    SET status = 'completed', sent_at = NOW()
+                    SET status = 'completed', sent_at = NOW(), send_heartbeat_at = NULL
                     WHERE campaign_id = %s
                 """, (campaign_id,))
                 conn.commit()
-                app.logger.info(f"✅ Campaign {campaign_id} marked as completed")
+                logger.info("✅ Campaign %s marked as completed", campaign_id,
+                            extra={'event': 'campaign_completed', 'campaign_id': campaign_id})
                 
+        except SMTPUnavailable as e:
+            # The campaign stays 'sending'; once its lease runs out recover_interrupted_sends() picks it up
+            logger.error("❌ SMTP server unavailable, campaign %s will be resumed later: %s", campaign_id, e,
+                         extra={'event': 'smtp_unavailable', 'campaign_id': campaign_id})
+            if conn:
+                conn.rollback()
         except Exception as e:
-            app.logger.error(f"❌ Error in send_email_async: {str(e)}")
+            logger.error("❌ Error in send_email_async: %s", e,
+                         extra={'event': 'campaign_send_failed', 'campaign_id': campaign_id})
             if conn:
                 conn.rollback()
+                if not test_mode:
+                    # Left for POST /api/campaigns/<id>/resume; the outbox keeps what was sent
+                    try:
+                        conn.cursor().execute("""
+                            UPDATE email_campaigns
+                            SET status = 'interrupted', send_heartbeat_at = NULL
+                            WHERE campaign_id = %s AND status = 'sending'
+                        """, (campaign_id,))
+                        conn.commit()
+                    except Exception as ex:
+                        logger.error("❌ Error marking campaign %s interrupted: %s", campaign_id, ex,
+                                     extra={'event': 'campaign_interrupt_failed', 'campaign_id': campaign_id})
+                        conn.rollback()
         finally:
+            EMAIL_CAMPAIGNS_SENDING.dec()
             if conn:
                 conn.close()
 
@@ -896,7 +2128,6 @@ def add_tracking_elements(html_content, tracking_pixel_id, tracking_id, base_url
     - Modified HTML content with tracking elements
     """
     from bs4 import BeautifulSoup
-    import logging
     
     # Parse HTML content
     soup = BeautifulSoup(html_content, 'html.parser')
@@ -937,21 +2168,21 @@ def add_tracking_elements(html_content, tracking_pixel_id, tracking_id, base_url
         try:
             # Add at beginning of body in a hidden div
             hidden_div = soup.new_tag('div', style="display:none !important; max-height:0px; overflow:hidden;")
-            hidden_div.append(tracking_pixel.copy())
+            hidden_div.append(copy.copy(tracking_pixel))
             soup.body.insert(0, hidden_div)
             
             # Add in the middle of content for better chance of loading
             if len(soup.body.contents) > 2:
                 middle_index = len(soup.body.contents) // 2
                 middle_div = soup.new_tag('div', style="display:none !important;")
-                middle_div.append(tracking_pixel.copy())
+                middle_div.append(copy.copy(tracking_pixel))
                 soup.body.insert(middle_index, middle_div)
                 
             # Add at end of body
-            soup.body.append(tracking_pixel.copy())
+            soup.body.append(copy.copy(tracking_pixel))
             soup.body.append(js_beacon)
         except Exception as e:
-            logging.error(f"Error adding tracking to body: {str(e)}")
+            logger.error("Error adding tracking to body: %s", e)
     
     # 2. Add to HTML head if it exists
     if soup.head:
@@ -973,17 +2204,17 @@ def add_tracking_elements(html_content, tracking_pixel_id, tracking_id, base_url
             """
             soup.head.append(style_tag)
         except Exception as e:
-            logging.error(f"Error adding tracking to head: {str(e)}")
+            logger.error("Error adding tracking to head: %s", e)
     
     # 3. If no body or head, add to the root
     if not soup.body and not soup.head:
         try:
             if len(soup.contents) > 0:
-                soup.contents[-1].append(tracking_pixel.copy())
+                soup.contents[-1].append(copy.copy(tracking_pixel))
             else:
-                soup.append(tracking_pixel.copy())
+                soup.append(copy.copy(tracking_pixel))
         except Exception as e:
-            logging.error(f"Error adding tracking to root: {str(e)}")
+            logger.error("Error adding tracking to root: %s", e)
     
     # 4. Also add tracking pixel at the very end of the HTML outside any tags
     # This ensures it's included even if email clients restructure the HTML
@@ -996,160 +2227,360 @@ def add_tracking_elements(html_content, tracking_pixel_id, tracking_id, base_url
 
 
 
-# Email Reply Checking Function
-def check_for_replies():
-    """Check for email replies and update tracking data"""
+# Bounce and complaint processing - delivery status notifications (RFC 3464) and abuse
+# feedback reports (RFC 5965) found by the mailbox scan
+MESSAGE_ID_TRACKING_RE = re.compile(r'<([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})@', re.I)
+
+def report_type(msg):
+    """report-type of a multipart/report message ('delivery-status', 'feedback-report'), else None"""
+    if msg.get_content_type() != 'multipart/report':
+        return None
+    return (msg.get_param('report-type') or '').lower()
+
+def returned_tracking_id(msg):
+    """Tracking id from the Message-ID of the original email attached to a report, or None"""
+    from email.parser import HeaderParser
+    for part in msg.walk():
+        if part.get_content_type() not in ('message/rfc822', 'text/rfc822-headers'):
+            continue
+        payload = part.get_payload()
+        original = payload[0] if isinstance(payload, list) else HeaderParser().parsestr(
+            part.get_payload(decode=True).decode('utf-8', 'replace'))
+        match = MESSAGE_ID_TRACKING_RE.search(original.get('Message-ID', ''))
+        if match:
+            return match.group(1).lower()
+    return None
+
+def parse_delivery_status(msg):
+    """Failed recipients from a DSN as (tracking_id, email, hard, status, diagnostic) tuples.
+
+    Returns None if `msg` isn't a delivery status report. tracking_id comes from the
+    Message-ID of the returned original (None if the server didn't include it); a 5.x.x
+    status is a hard bounce. 'delayed' and 'delivered' reports are ignored.
+    """
+    if report_type(msg) != 'delivery-status':
+        return None
+    tracking_id = returned_tracking_id(msg)
+    recipient_fields = []
+    for part in msg.walk():
+        if part.get_content_type() == 'message/delivery-status':
+            # The first block describes the reporting MTA, the rest one recipient each
+            recipient_fields.extend(block for block in part.get_payload() if block.get('Action'))
+    failures = []
+    for fields in recipient_fields:
+        if fields.get('Action', '').strip().lower() != 'failed':
+            continue
+        recipient = fields.get('Original-Recipient') or fields.get('Final-Recipient') or ''
+        email_address = recipient.partition(';')[2].strip().strip('<>').lower()
+        status = fields.get('Status', '').strip()
+        diagnostic = ' '.join((fields.get('Diagnostic-Code') or '').partition(';')[2].split())
+        failures.append((tracking_id, email_address, status.startswith('5'), status, diagnostic[:400]))
+    return failures
+
+def parse_feedback_report(msg):
+    """Tracking ids complained about in an abuse feedback report (RFC 5965), or None if `msg` isn't one"""
+    if report_type(msg) != 'feedback-report':
+        return None
+    tracking_id = returned_tracking_id(msg)
+    return [tracking_id] if tracking_id else []
+
+def suppress_tracked_recipients(cur, tracking_ids, reason):
+    """Suppress the addresses these emails went to, for the campaign owner; returns how many were new"""
+    if not tracking_ids:
+        return 0
+    cur.execute("""
+        INSERT INTO suppressions (user_id, email, reason, tracking_id)
+        SELECT DISTINCT ON (c.user_id, lower(r.email)) c.user_id, lower(r.email), %s, et.tracking_id
+        FROM email_tracking et
+        JOIN email_campaigns c ON c.campaign_id = et.campaign_id
+        JOIN recipients r ON r.recipient_id = et.recipient_id
+        WHERE et.tracking_id = ANY(%s::uuid[])
+        ON CONFLICT (user_id, email) DO NOTHING
+    """, (reason, list(tracking_ids)))
+    SUPPRESSIONS_ADDED.labels(reason).inc(cur.rowcount)
+    return cur.rowcount
+
+def record_bounces(cur, bounces):
+    """Mark bounced emails and suppress hard-bounced addresses in one statement.
+
+    Each bounce carries the user_id of the mailbox it was found in (None for the SMTP
+    account's INBOX), and a registered mailbox only affects its owner's emails. Bounces
+    without a tracking id fall back to the latest email the owner sent to that address,
+    so they are dropped in the shared INBOX where the owner isn't known.
+    Returns (emails marked bounced, addresses newly suppressed); reports seen again
+    on a later scan match nothing.
+    """
+    if not bounces:
+        return 0, 0
+    row = psycopg2.extras.execute_values(cur, """
+        WITH bounce (tracking_id, email, hard, status, diagnostic, user_id) AS (VALUES %s),
+        matched AS (
+            SELECT DISTINCT ON (tracking_id, user_id) * FROM (
+                SELECT COALESCE(b.tracking_id, (
+                    SELECT et.tracking_id FROM recipients r
+                    JOIN email_tracking et ON et.recipient_id = r.recipient_id
+                    JOIN email_campaigns c ON c.campaign_id = et.campaign_id
+                    WHERE r.user_id = b.user_id AND lower(r.email) = b.email
+                    AND c.user_id = b.user_id AND et.sent_at IS NOT NULL
+                    ORDER BY et.sent_at DESC
+                    LIMIT 1
+                )) AS tracking_id, b.user_id, b.hard, b.status, b.diagnostic
+                FROM bounce b
+            ) candidates
+            WHERE tracking_id IS NOT NULL
+            ORDER BY tracking_id, user_id, hard DESC
+        ),
+        bounced AS (
+            UPDATE email_tracking et
+            SET bounced_at = NOW(),
+                email_status = 'bounced',
+                last_error = trim(m.status || ' ' || m.diagnostic),
+                updated_at = NOW()
+            FROM matched m, email_campaigns c
+            WHERE et.tracking_id = m.tracking_id AND et.bounced_at IS NULL
+            AND c.campaign_id = et.campaign_id AND (m.user_id IS NULL OR c.user_id = m.user_id)
+            RETURNING et.tracking_id, et.campaign_id, et.recipient_id, m.hard
+        ),
+        suppressed AS (
+            INSERT INTO suppressions (user_id, email, reason, tracking_id)
+            SELECT DISTINCT ON (c.user_id, lower(r.email)) c.user_id, lower(r.email), 'hard_bounce', b.tracking_id
+            FROM bounced b
+            JOIN email_campaigns c ON c.campaign_id = b.campaign_id
+            JOIN recipients r ON r.recipient_id = b.recipient_id
+            WHERE b.hard
+            ON CONFLICT (user_id, email) DO NOTHING
+            RETURNING email
+        )
+        SELECT (SELECT COUNT(*) FROM bounced) AS bounced, (SELECT COUNT(*) FROM suppressed) AS suppressed
+    """, bounces, template="(%s::uuid, %s, %s::boolean, %s, %s, %s::uuid)", page_size=len(bounces), fetch=True)[0]
+    SUPPRESSIONS_ADDED.labels('hard_bounce').inc(row['suppressed'])
+    return row['bounced'], row['suppressed']
+
+# Reply mailboxes - the SMTP account's INBOX sees replies to every campaign; users can register
+# more for their campaigns' reply-to addresses. A registered mailbox names an IMAP_CREDENTIALS
+# entry instead of storing a login, so credentials only ever go to the server configured with them.
+_default_mailbox_state = {'uid_validity': None, 'last_uid': None}
+
+def default_reply_mailbox():
+    """The SMTP account's INBOX; its UID state lives in memory, so a restart rescans the last day"""
+    return {'mailbox_id': None, 'user_id': None, 'address': SMTP_USERNAME.lower(), 'server': IMAP_SERVER,
+            'port': IMAP_PORT, 'username': SMTP_USERNAME, 'password': SMTP_PASSWORD, **_default_mailbox_state}
+
+def load_reply_mailboxes(cur):
+    """Active registered mailboxes with their IMAP_CREDENTIALS entry and UID state"""
+    cur.execute("""
+        SELECT mailbox_id, user_id, address, credential_ref, uid_validity, last_uid
+        FROM reply_mailboxes
+        WHERE is_active = TRUE
+    """)
+    mailboxes = []
+    for row in cur.fetchall():
+        credentials = IMAP_CREDENTIALS.get(row['credential_ref']) or {}
+        mailboxes.append({**row, 'server': credentials.get('server'), 'port': int(credentials.get('port', IMAP_PORT)),
+                          'username': credentials.get('username'), 'password': credentials.get('password')})
+    return mailboxes
+
+def load_reply_campaigns(cur):
+    """Completed campaigns with the address their replies go to"""
+    cur.execute("""
+        SELECT campaign_id, user_id, subject_line,
+               lower(COALESCE(NULLIF(reply_to_email, ''), from_email)) AS reply_to
+        FROM email_campaigns
+        WHERE status = 'completed'
+    """)
+    return cur.fetchall()
+
+def campaign_subjects_for(mailbox, campaigns):
+    """Lowercased subject -> campaign_id for the campaigns whose replies land in this mailbox"""
+    return {c['subject_line'].lower(): c['campaign_id'] for c in campaigns
+            if c['subject_line'] and (mailbox['user_id'] is None or
+                                      (c['user_id'] == mailbox['user_id'] and c['reply_to'] == mailbox['address']))}
+
+def open_reply_mailbox(mailbox=None, timeout=None):
+    """Log in to a reply mailbox (the SMTP account's by default) and select INBOX"""
     import imaplib
+    mailbox = mailbox or default_reply_mailbox()
+    if not mailbox['server'] or not mailbox['username']:
+        raise ValueError(f"No IMAP credentials configured for {mailbox['address']}")
+    logger.info(f"Connecting to IMAP server: {mailbox['server']}")
+    mail = imaplib.IMAP4_SSL(mailbox['server'], mailbox['port'], timeout=timeout)
+    mail.login(mailbox['username'], mailbox['password'])
+    mail.select("INBOX")
+    logger.info("Successfully connected to IMAP server")
+    return mail
+
+def selected_uid_state(mail):
+    """(UIDVALIDITY, UIDNEXT) reported by the last SELECT, None where the server left one out"""
+    uid_validity = mail.response('UIDVALIDITY')[1][0]
+    uid_next = mail.response('UIDNEXT')[1][0]
+    return (int(uid_validity) if uid_validity else None), (int(uid_next) if uid_next else None)
+
+def new_message_uids(mail, last_uid):
+    """UIDs above last_uid, or of the last day's messages when there is no UID state yet"""
+    if last_uid is None:
+        date = (datetime.now() - timedelta(days=1)).strftime("%d-%b-%Y")
+        status, data = mail.uid('SEARCH', None, f'(SINCE {date})')
+    else:
+        status, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+    # `n:*` always matches the newest message, even when its UID is below n
+    return [int(uid) for uid in data[0].split() if last_uid is None or int(uid) > last_uid]
+
+def collect_mailbox_messages(mail, message_ids, campaign_subjects, uid=False, user_id=None):
+    """Fetch these messages (UIDs if `uid`) and sort out the campaign replies, bounces and complaints.
+
+    Returns (replies, bounces, complaints); replies are (campaign_id, sender_email) pairs,
+    bounces are parse_delivery_status() tuples plus `user_id`, the mailbox owner.
+    Nothing is written here, so scans can run on the pool without a database connection.
+    """
     import email
+    import imaplib
     from email.header import decode_header
-    import time
-    
-    app.logger.info("Starting scheduled email reply check")
     
-    # Email configuration
-    username = SMTP_USERNAME
-    password = SMTP_PASSWORD
-    imap_server = "imap.gmail.com"  # Use your IMAP server
-    
-    conn = None
-    mail = None
-    try:
-        # Connect to IMAP server
-        app.logger.info(f"Connecting to IMAP server: {imap_server}")
-        mail = imaplib.IMAP4_SSL(imap_server)
-        mail.login(username, password)
-        mail.select("INBOX")
-        app.logger.info("Successfully connected to IMAP server")
-        
-        # Search for recent emails (last 24 hours)
-        date = (datetime.now() - timedelta(days=1)).strftime("%d-%b-%Y")
-        status, messages = mail.search(None, f'(SINCE {date})')
-        message_ids = messages[0].split(b' ')
-        app.logger.info(f"Found {len(message_ids)} messages in the last 24 hours")
-        
-        if not message_ids or message_ids[0] == b'':
-            app.logger.info("No messages found to check")
-            return
-        
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Get all campaign subjects for matching
-        cur.execute("""
-            SELECT campaign_id, subject_line FROM email_campaigns
-            WHERE status = 'completed'
-        """)
-        campaigns = cur.fetchall()
-        campaign_subjects = {c['subject_line']: c['campaign_id'] for c in campaigns}
-        app.logger.info(f"Loaded {len(campaign_subjects)} campaign subjects for matching")
-        
-        replies_found = 0
-        for mail_id in message_ids:
-            try:
-                app.logger.debug(f"Checking message ID: {mail_id}")
+    replies = []
+    bounces = []
+    complaints = []
+    for mail_id in message_ids:
+        try:
+            logger.debug("Checking message ID: %s", mail_id, extra={'event': 'imap_message'})
+            if uid:
+                status, msg_data = mail.uid('FETCH', mail_id, "(RFC822)")
+            else:
                 status, msg_data = mail.fetch(mail_id, "(RFC822)")
-                
-                for response in msg_data:
-                    if isinstance(response, tuple):
-                        msg = email.message_from_bytes(response[1])
-                        subject = decode_header(msg["Subject"])[0][0]
-                        sender = msg.get("From", "")
-                        
-                        # Check if it's a reply (subject starts with Re:)
-                        if isinstance(subject, bytes):
-                            subject = subject.decode()
+            IMAP_MESSAGES_SCANNED.inc()
+            
+            for response in msg_data:
+                if isinstance(response, tuple):
+                    msg = email.message_from_bytes(response[1])
+                    
+                    # Delivery failure reports are collected and recorded together after the scan
+                    failures = parse_delivery_status(msg)
+                    if failures is not None:
+                        bounces.extend((*failure, user_id) for failure in failures)
+                        continue
+                    complained = parse_feedback_report(msg)
+                    if complained is not None:
+                        complaints.extend(complained)
+                        continue
+                    
+                    subject = decode_header(msg["Subject"])[0][0]
+                    sender = msg.get("From", "")
+                    
+                    # Check if it's a reply (subject starts with Re:)
+                    if isinstance(subject, bytes):
+                        subject = subject.decode()
+                    
+                    logger.debug("Processing email - Subject: %s, From: %s", subject, sender,
+                                 extra={'event': 'imap_message'})
+                    
+                    if subject and subject.lower().startswith("re:"):
+                        # Extract original subject by removing "Re: "
+                        original_subject = subject[4:].strip()
+                        logger.info("Found reply email - Original subject: %s", original_subject,
+                                    extra={'event': 'reply_found'})
                         
-                        app.logger.debug(f"Processing email - Subject: {subject}, From: {sender}")
+                        # Check if this matches any of our campaigns
+                        campaign_id = campaign_subjects.get(original_subject.lower())
                         
-                        if subject and subject.lower().startswith("re:"):
-                            # Extract original subject by removing "Re: "
-                            original_subject = subject[4:].strip()
-                            app.logger.info(f"Found reply email - Original subject: {original_subject}")
+                        if campaign_id:
+                            logger.info("Matched reply to campaign ID: %s", campaign_id,
+                                        extra={'event': 'reply_matched', 'campaign_id': campaign_id})
                             
-                            # Check if this matches any of our campaigns
-                            campaign_id = None
-                            for camp_subject, camp_id in campaign_subjects.items():
-                                if original_subject.lower() == camp_subject.lower():
-                                    campaign_id = camp_id
-                                    break
-                            
-                            if campaign_id:
-                                app.logger.info(f"Matched reply to campaign ID: {campaign_id}")
-                                
-                                # Find the recipient email from the sender
-                                sender_email = None
-                                if '<' in sender and '>' in sender:
-                                    # Extract email from format "Name <email@example.com>"
-                                    sender_email = sender.split('<')[1].split('>')[0].strip()
-                                else:
-                                    # Just use the whole sender field
-                                    sender_email = sender.strip()
-                                
-                                app.logger.info(f"Extracted sender email: {sender_email}")
-                                
-                                # Find the recipient in our database
-                                cur.execute("""
-                                    SELECT r.recipient_id, r.email
-                                    FROM recipients r
-                                    JOIN campaign_recipients cr ON r.recipient_id = cr.recipient_id
-                                    WHERE cr.campaign_id = %s AND r.email = %s
-                                """, (campaign_id, sender_email))
-                                
-                                recipient = cur.fetchone()
-                                
-                                if recipient:
-                                    app.logger.info(f"Found matching recipient: {recipient['email']}")
-                                    
-                                    # Check if already replied
-                                    cur.execute("""
-                                        SELECT tracking_id FROM email_tracking
-                                        WHERE campaign_id = %s AND recipient_id = %s AND replied_at IS NOT NULL
-                                    """, (campaign_id, recipient['recipient_id']))
-                                    
-                                    already_replied = cur.fetchone()
-                                    
-                                    if already_replied:
-                                        app.logger.info(f"Recipient {recipient['email']} already marked as replied")
-                                    else:
-                                        # Update tracking status
-                                        cur.execute("""
-                                            UPDATE email_tracking
-                                            SET 
-                                                email_status = 'replied',
-                                                replied_at = NOW(),
-                                                updated_at = NOW()
-                                            WHERE campaign_id = %s AND recipient_id = %s
-                                            RETURNING tracking_id
-                                        """, (campaign_id, recipient['recipient_id']))
-                                        
-                                        updated = cur.fetchone()
-                                        
-                                        if updated:
-                                            conn.commit()
-                                            app.logger.info(f"Successfully marked {recipient['email']} as replied, tracking_id: {updated['tracking_id']}")
-                                            replies_found += 1
-                                        else:
-                                            app.logger.warning(f"No tracking entry found for {recipient['email']} in campaign {campaign_id}")
-                                else:
-                                    app.logger.warning(f"No matching recipient found for email: {sender_email}")
+                            # Find the recipient email from the sender
+                            sender_email = None
+                            if '<' in sender and '>' in sender:
+                                # Extract email from format "Name <email@example.com>"
+                                sender_email = sender.split('<')[1].split('>')[0].strip()
                             else:
-                                app.logger.debug(f"No matching campaign found for subject: {original_subject}")
-            except Exception as e:
-                app.logger.error(f"Error processing email {mail_id}: {str(e)}")
-                # Continue to next email
-        
-        app.logger.info(f"Reply check complete. Found and processed {replies_found} new replies.")
+                                # Just use the whole sender field
+                                sender_email = sender.strip()
+                            
+                            logger.info("Extracted sender email: %s", sender_email,
+                                        extra={'event': 'reply_matched', 'campaign_id': campaign_id})
+                            replies.append((campaign_id, sender_email))
+                        else:
+                            logger.debug("No matching campaign found for subject: %s", original_subject,
+                                         extra={'event': 'reply_unmatched'})
+        except (imaplib.IMAP4.abort, OSError):
+            # The connection is gone - fail the whole scan so its UID state isn't advanced
+            raise
+        except Exception as e:
+            logger.error("Error processing email %s: %s", mail_id, e, extra={'event': 'imap_message_failed'})
+            # Continue to next email
     
+    return replies, bounces, complaints
+
+def record_mailbox_results(cur, replies, bounces, complaints):
+    """Write what mailbox scans found; returns (replied tracking ids, bounced, suppressed). Doesn't commit."""
+    replied_ids = []
+    if replies:
+        # One statement for the whole cycle; replied_at IS NULL makes repeats of an already
+        # recorded reply (rescans, several mailboxes) no-ops without a check beforehand
+        replies = sorted(set(replies))
+        updated = psycopg2.extras.execute_values(cur, """
+            UPDATE email_tracking et
+            SET email_status = 'replied', replied_at = NOW(), updated_at = NOW()
+            FROM (VALUES %s) AS v (campaign_id, email), recipients r
+            WHERE et.campaign_id = v.campaign_id
+            AND r.recipient_id = et.recipient_id
+            AND lower(r.email) = lower(v.email)
+            AND et.replied_at IS NULL
+            RETURNING et.tracking_id
+        """, replies, template="(%s::uuid, %s)", page_size=len(replies), fetch=True)
+        replied_ids = [str(row['tracking_id']) for row in updated]
+        logger.info(f"Matched {len(replies)} replies to campaigns, {len(replied_ids)} newly replied")
+    
+    bounced, suppressed = record_bounces(cur, bounces)
+    suppressed += suppress_tracked_recipients(cur, complaints, 'complained')
+    return replied_ids, bounced, suppressed
+
+def report_mailbox_results(replied_ids, bounced, complaints, suppressed):
+    """Tracking events, metrics and logs for results that have been committed"""
+    for tracking_id in replied_ids:
+        tracking_event_buffer.record('reply', tracking_id=tracking_id, source='imap')
+    IMAP_BOUNCES_MATCHED.inc(bounced)
+    if bounced or suppressed:
+        logger.info(f"Recorded {bounced} new bounces, {complaints} complaints, {suppressed} addresses suppressed")
+    IMAP_REPLIES_MATCHED.inc(len(replied_ids))
+    logger.info(f"Reply check complete. Found and processed {len(replied_ids)} new replies.")
+
+def process_mailbox_messages(mail, message_ids, uid=False):
+    """Record the campaign replies, bounces and complaints among these messages of the SMTP account's INBOX"""
+    conn, cur = get_direct_db_connection()
+    try:
+        campaign_subjects = campaign_subjects_for(default_reply_mailbox(), load_reply_campaigns(cur))
+        replies, bounces, complaints = collect_mailbox_messages(mail, message_ids, campaign_subjects, uid)
+        replied_ids, bounced, suppressed = record_mailbox_results(cur, replies, bounces, complaints)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    report_mailbox_results(replied_ids, bounced, len(complaints), suppressed)
+    return len(replied_ids)
+
+def scan_mailbox(mailbox, campaign_subjects):
+    """Collect a mailbox's messages since its last scan; runs on the scan pool, never raises"""
+    scan = {'mailbox': mailbox, 'uid_validity': mailbox['uid_validity'], 'last_uid': mailbox['last_uid'],
+            'replies': [], 'bounces': [], 'complaints': [], 'error': None}
+    mail = None
+    try:
+        mail = open_reply_mailbox(mailbox, timeout=IMAP_TIMEOUT_SECONDS)
+        uid_validity, uid_next = selected_uid_state(mail)
+        # A new UIDVALIDITY means the old UIDs are meaningless - start over from the last day
+        last_uid = mailbox['last_uid'] if uid_validity == mailbox['uid_validity'] else None
+        uids = new_message_uids(mail, last_uid)
+        if uids:
+            scan['replies'], scan['bounces'], scan['complaints'] = collect_mailbox_messages(
+                mail, [str(uid).encode('ascii') for uid in uids], campaign_subjects, uid=True,
+                user_id=mailbox['user_id'])
+        scan['uid_validity'] = uid_validity
+        scan['last_uid'] = max(uids, default=last_uid if last_uid is not None else (uid_next - 1 if uid_next else None))
+        IMAP_MAILBOX_SCANS.labels('ok').inc()
     except Exception as e:
-        app.logger.error(f"Error in check_for_replies: {str(e)}")
-        if conn:
-            conn.rollback()
+        IMAP_MAILBOX_SCANS.labels('error').inc()
+        logger.error(f"Error scanning reply mailbox {mailbox['address']}: {str(e)}")
+        scan['error'] = str(e)[:400]
     finally:
         if mail:
             try:
@@ -1157,27 +2588,283 @@ def check_for_replies():
                 mail.logout()
             except:
                 pass
-        if conn:
-            conn.close()
+    return scan
+
+def save_mailbox_state(cur, scans):
+    """Store the UID state and last error of the registered mailboxes scanned, in one statement"""
+    rows = [(scan['mailbox']['mailbox_id'], scan['uid_validity'], scan['last_uid'], scan['error'])
+            for scan in scans if scan['mailbox']['mailbox_id']]
+    if not rows:
+        return
+    psycopg2.extras.execute_values(cur, """
+        UPDATE reply_mailboxes m
+        SET uid_validity = v.uid_validity, last_uid = v.last_uid, last_error = v.last_error, last_checked_at = NOW()
+        FROM (VALUES %s) AS v (mailbox_id, uid_validity, last_uid, last_error)
+        WHERE m.mailbox_id = v.mailbox_id
+    """, rows, template="(%s::uuid, %s::bigint, %s::bigint, %s)", page_size=len(rows))
+
+# Email Reply Checking Function
+@instrumented_job('check_for_replies')
+def check_for_replies(include_default=True):
+    """Scan every reply mailbox on a bounded thread pool and record what they found in one transaction.
+
+    `include_default` is False when the SMTP account's INBOX is watched with IDLE instead.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    logger.info("Starting scheduled email reply check")
+    
+    conn, cur = get_direct_db_connection()
+    try:
+        mailboxes = load_reply_mailboxes(cur)
+        if include_default:
+            mailboxes.insert(0, default_reply_mailbox())
+        campaigns = load_reply_campaigns(cur)
+        # Don't sit idle in a transaction while the mailboxes are scanned
+        conn.rollback()
+        if not mailboxes:
+            logger.info("No reply mailboxes to check")
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(IMAP_SCAN_WORKERS, len(mailboxes)),
+                                thread_name_prefix='imap-scan') as pool:
+            scans = list(pool.map(lambda mailbox: scan_mailbox(mailbox, campaign_subjects_for(mailbox, campaigns)),
+                                  mailboxes))
+        
+        complaints = [tracking_id for scan in scans for tracking_id in scan['complaints']]
+        replied_ids, bounced, suppressed = record_mailbox_results(
+            cur,
+            [reply for scan in scans for reply in scan['replies']],
+            [bounce for scan in scans for bounce in scan['bounces']],
+            complaints)
+        save_mailbox_state(cur, scans)
+        conn.commit()
+    
+    except Exception as e:
+        IMAP_SCAN_ERRORS.inc()
+        logger.error(f"Error in check_for_replies: {str(e)}")
+        conn.rollback()
+        return
+    finally:
+        conn.close()
+    
+    # UID state only moves forward once what it covers has been committed
+    for scan in scans:
+        if scan['mailbox']['mailbox_id'] is None:
+            _default_mailbox_state.update(uid_validity=scan['uid_validity'], last_uid=scan['last_uid'])
+    if any(scan['error'] for scan in scans):
+        IMAP_SCAN_ERRORS.inc()
+    report_mailbox_results(replied_ids, bounced, len(complaints), suppressed)
 
 # Safe wrapper for check_for_replies to use with scheduler
-def safe_check_for_replies():
+def safe_check_for_replies(include_default=True):
     """Safely run the reply check with error handling for the scheduler"""
+    started = time.perf_counter()
     try:
-        check_for_replies()
+        check_for_replies(include_default)
     except Exception as e:
-        app.logger.error(f"Error in scheduled reply check: {str(e)}")
+        IMAP_SCAN_ERRORS.inc()
+        logger.error(f"Error in scheduled reply check: {str(e)}")
+    finally:
+        IMAP_SCAN_SECONDS.observe(time.perf_counter() - started)
+
+# IMAP IDLE - with IMAP_IDLE=true the scheduler process is told about new mail instead of polling
+class ReplyMailboxWatcher:
+    """Long-lived IMAP connection that processes new messages as soon as the server reports them.
+
+    The first connection scans the last day of mail. After that only
+    UIDs above the highest one processed are fetched - also after a reconnect, so mail
+    that arrived while disconnected isn't missed - unless UIDVALIDITY changed. Each
+    IDLE ends after IMAP_IDLE_SECONDS with a NOOP before the next one.
+    """
+
+    def __init__(self, idle_seconds=IMAP_IDLE_SECONDS, reconnect_max_seconds=IMAP_RECONNECT_MAX_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.reconnect_max_seconds = reconnect_max_seconds
+        self.last_uid = None
+        self.uid_validity = None
+        self._uid_next = None
+        self._mail = None
+        self._idling = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name='imap-idle', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._done()
+
+    def run(self):
+        """Connect, catch up, IDLE; reconnect with exponential backoff on any error"""
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                # A read timeout a little over the IDLE period means the connection is dead
+                self._mail = open_reply_mailbox(timeout=self.idle_seconds + 60)
+                self._select_state()
+                logger.info(f"📬 Watching reply mailbox with IDLE (last UID {self.last_uid})")
+                delay = 1
+                self.catch_up()
+                while not self._stop.is_set():
+                    if not self.idle():
+                        self._mail.noop()
+                    # imaplib keeps unsolicited EXISTS/RECENT/FETCH responses until asked for them
+                    self._mail.untagged_responses.clear()
+                    self.catch_up()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                IMAP_IDLE_RECONNECTS.inc()
+                logger.warning(f"⚠️ Reply mailbox connection lost ({e}), reconnecting in {delay}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.reconnect_max_seconds)
+            finally:
+                mail, self._mail = self._mail, None
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
 
-# Initialize scheduler for checking replies - runs every 10 minutes
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=safe_check_for_replies, trigger="interval", minutes=1)
-scheduler.start()
+    def _select_state(self):
+        # A new UIDVALIDITY means the old UIDs are meaningless
+        uid_validity, self._uid_next = selected_uid_state(self._mail)
+        if uid_validity != self.uid_validity:
+            self.uid_validity = uid_validity
+            self.last_uid = None
+
+    def catch_up(self):
+        """Process messages with UIDs above the last one processed; returns how many there were"""
+        started = time.perf_counter()
+        try:
+            uids = new_message_uids(self._mail, self.last_uid)
+            if uids:
+                process_mailbox_messages(self._mail, [str(uid).encode('ascii') for uid in uids], uid=True)
+            if uids or self.last_uid is None:
+                self.last_uid = max(uids, default=self._uid_next - 1 if self._uid_next else None)
+            return len(uids)
+        except Exception:
+            IMAP_SCAN_ERRORS.inc()
+            raise
+        finally:
+            IMAP_SCAN_SECONDS.observe(time.perf_counter() - started)
+
+    def idle(self):
+        """IDLE until the server reports new mail (True) or idle_seconds pass (False)"""
+        mail = self._mail
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+        if not response.startswith(b'+'):
+            raise mail.error(f"IDLE rejected: {response!r}")
+        with self._lock:
+            self._idling = True
+        timer = threading.Timer(self.idle_seconds, self._done)
+        timer.daemon = True
+        timer.start()
+        notified = False
+        try:
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise mail.abort("connection closed during IDLE")
+                if line.startswith(tag + b' '):
+                    if not line[len(tag) + 1:].startswith(b'OK'):
+                        raise mail.error(f"IDLE failed: {line!r}")
+                    return notified
+                if line.startswith(b'* ') and line.rstrip().upper().endswith(b' EXISTS'):
+                    notified = True
+                    self._done()
+        finally:
+            timer.cancel()
+
+    def _done(self):
+        # The reader and the timer can both end an IDLE; DONE must only be sent once
+        with self._lock:
+            if not self._idling:
+                return
+            self._idling = False
+            try:
+                self._mail.send(b'DONE\r\n')
+            except Exception:
+                pass
+
+reply_watcher = ReplyMailboxWatcher()
+
+# Scheduler for reply checks and partition maintenance - started by the `scheduler` entry
+# point (or `all`), never on import, so pre-fork servers don't run one per worker
+scheduler = None
+
+def start_scheduler(blocking=False):
+    """Start the reply check (or IDLE watcher), partition maintenance and send recovery jobs in this process"""
+    global scheduler
+    if blocking:
+        from apscheduler.schedulers.blocking import BlockingScheduler as Scheduler
+    else:
+        from apscheduler.schedulers.background import BackgroundScheduler as Scheduler
+    scheduler = Scheduler()
+    if IMAP_IDLE:
+        # The SMTP account's INBOX is watched; registered mailboxes are still polled
+        reply_watcher.start()
+        atexit.register(reply_watcher.stop)
+    scheduler.add_job(func=safe_check_for_replies, trigger="interval", minutes=1,
+                      kwargs={'include_default': not IMAP_IDLE})
+    scheduler.add_job(func=maintain_tracking_event_partitions, trigger="interval", hours=24,
+                      next_run_time=datetime.now())
+    scheduler.add_job(func=recover_interrupted_sends, trigger="interval", seconds=SEND_LEASE_SECONDS)
+    if not blocking:
+        # Shut down the scheduler when exiting the app
+        atexit.register(lambda: scheduler.shutdown())
+    logger.info("⏰ Scheduler started")
+    scheduler.start()
+    return scheduler
+
+# Send worker - claims campaigns queued by the send endpoint when SEND_MODE=queue
+def claim_queued_campaign():
+    """Move the oldest queued campaign to 'sending' and return its id, or None"""
+    conn, cur = get_direct_db_connection()
+    try:
+        cur.execute("""
+            UPDATE email_campaigns
+            SET status = 'sending', send_heartbeat_at = NOW()
+            WHERE campaign_id = (
+                SELECT campaign_id FROM email_campaigns
+                WHERE status = 'queued'
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING campaign_id
+        """)
+        row = cur.fetchone()
+        conn.commit()
+        return str(row['campaign_id']) if row else None
+    finally:
+        conn.close()
 
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+def run_send_worker(poll_interval=WORKER_POLL_INTERVAL):
+    """Send queued campaigns one at a time until the process is stopped"""
+    logger.info(f"📮 Send worker started (pid {os.getpid()}), polling every {poll_interval}s")
+    while True:
+        try:
+            campaign_id = claim_queued_campaign()
+        except Exception as e:
+            logger.error(f"❌ Error claiming queued campaign: {str(e)}")
+            campaign_id = None
+        if campaign_id:
+            logger.info(f"📮 Claimed campaign {campaign_id}")
+            send_email_async(campaign_id)
+        else:
+            time.sleep(poll_interval)
 
 # API Routes - Authentication
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 @handle_transaction
 def register():
     """Register a new user"""
@@ -1218,7 +2905,7 @@ def register():
         }
     }), 201
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 @handle_transaction
 def login():
     """Login user and return JWT token"""
@@ -1254,7 +2941,7 @@ def login():
     }), 200
 
 # API Routes - Groups (NEW)
-@app.route('/api/groups', methods=['GET'])
+@api.route('/api/groups', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_groups():
@@ -1291,7 +2978,7 @@ def get_groups():
     
     return jsonify(result), 200
 
-@app.route('/api/groups', methods=['POST'])
+@api.route('/api/groups', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def create_group():
@@ -1332,7 +3019,7 @@ def create_group():
         'group_id': str(group['group_id'])
     }), 201
 
-@app.route('/api/groups/<group_id>', methods=['GET'])
+@api.route('/api/groups/<group_id>', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_group(group_id):
@@ -1394,7 +3081,7 @@ def get_group(group_id):
     
     return jsonify(group_data), 200
 
-@app.route('/api/groups/<group_id>/update', methods=['POST'])
+@api.route('/api/groups/<group_id>/update', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def update_group(group_id):
@@ -1450,7 +3137,7 @@ def update_group(group_id):
         'group_id': str(updated['group_id'])
     }), 200
 
-@app.route('/api/groups/<group_id>/delete', methods=['POST'])
+@api.route('/api/groups/<group_id>/delete', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def delete_group(group_id):
@@ -1488,7 +3175,7 @@ def delete_group(group_id):
         'group_id': str(group_id)
     }), 200
 
-@app.route('/api/groups/<group_id>/recipients', methods=['POST'])
+@api.route('/api/groups/<group_id>/recipients', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def add_recipients_to_group(group_id):
@@ -1543,7 +3230,7 @@ def add_recipients_to_group(group_id):
         'updated_count': updated_count
     }), 200
 
-@app.route('/api/groups/<group_id>/recipients/remove', methods=['POST'])
+@api.route('/api/groups/<group_id>/recipients/remove', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def remove_recipients_from_group(group_id):
@@ -1594,7 +3281,7 @@ def remove_recipients_from_group(group_id):
     }), 200
 
 # API Routes - Campaigns
-@app.route('/api/campaigns', methods=['GET'])
+@api.route('/api/campaigns', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_campaigns():
@@ -1678,8 +3365,30 @@ def get_campaigns():
     return jsonify(result), 200
 
 
+def find_library_template(cur, user_id, template_id):
+    """The user's active library template with this id, or None"""
+    cur.execute("""
+        SELECT template_id FROM email_templates
+        WHERE template_id = %s AND user_id = %s AND campaign_id IS NULL AND is_active = TRUE
+    """, (template_id, user_id))
+    return cur.fetchone()
+
+def copy_template_to_campaign(cur, campaign_id, template_id):
+    """Give a campaign its own copy of a library or campaign template, compiled form included,
+    remembering the library template it came from"""
+    cur.execute("""
+        INSERT INTO email_templates
+        (user_id, campaign_id, template_name, html_content, text_content, compiled, source_template_id)
+        SELECT user_id, %s, template_name, html_content, text_content, compiled,
+               CASE WHEN campaign_id IS NULL THEN template_id ELSE source_template_id END
+        FROM email_templates
+        WHERE template_id = %s
+        RETURNING template_id
+    """, (campaign_id, template_id))
+    return cur.fetchone()['template_id']
+
 #changed now
-@app.route('/api/campaigns', methods=['POST'])
+@api.route('/api/campaigns', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def create_campaign():
@@ -1695,6 +3404,12 @@ def create_campaign():
     
     conn, cur = get_db_connection()
     
+    # A library template can be used instead of posting the HTML again
+    if data.get('template_id'):
+        library_template = find_library_template(cur, user_id, data['template_id'])
+        if not library_template:
+            return jsonify({'message': 'Template not found or access denied'}), 404
+    
     # Create campaign
     cur.execute("""
         INSERT INTO email_campaigns 
@@ -1714,17 +3429,19 @@ def create_campaign():
     campaign_id = campaign['campaign_id']
     
     # Create template if provided
-    if 'template' in data:
+    if data.get('template_id'):
+        copy_template_to_campaign(cur, campaign_id, library_template['template_id'])
+    elif 'template' in data:
         template_name = data['template'].get('name', 'Default Template')
         html_content = data['template']['html_content']
         text_content = data['template'].get('text_content', '')
         
         cur.execute("""
             INSERT INTO email_templates
-            (user_id, campaign_id, template_name, html_content, text_content)
-            VALUES (%s, %s, %s, %s, %s)
+            (user_id, campaign_id, template_name, html_content, text_content, compiled)
+            VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING template_id
-        """, (user_id, campaign_id, template_name, html_content, text_content))
+        """, (user_id, campaign_id, template_name, html_content, text_content, compiled_template_json(html_content)))
     
     # Add individual recipients if provided
     if 'recipients' in data and data['recipients']:
@@ -1758,7 +3475,7 @@ def create_campaign():
                 group_id = group_item
                 
             # Debug logging to identify the issue
-            app.logger.info(f"Processing group: {group_item}, extracted ID: {group_id}")
+            logger.info(f"Processing group: {group_item}, extracted ID: {group_id}")
             
             # Verify group belongs to user
             cur.execute("""
@@ -1958,7 +3675,7 @@ def create_campaign():
     
 #     return jsonify(result), 200
 
-@app.route('/api/campaigns/<campaign_id>', methods=['GET'])
+@api.route('/api/campaigns/<campaign_id>', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_campaign(campaign_id):
@@ -2045,7 +3762,8 @@ def get_campaign(campaign_id):
                 COUNT(*) FILTER (WHERE sent_at IS NOT NULL) as sent_count,
                 COUNT(*) FILTER (WHERE opened_at IS NOT NULL) as opened_count,
                 COUNT(*) FILTER (WHERE clicked_at IS NOT NULL) as clicked_count,
-                COUNT(*) FILTER (WHERE replied_at IS NOT NULL) as replied_count
+                COUNT(*) FILTER (WHERE replied_at IS NOT NULL) as replied_count,
+                COUNT(*) FILTER (WHERE opened_at IS NULL AND automated_open_count > 0) as automated_only_count
             FROM email_tracking
             WHERE campaign_id = %s
         """, (campaign_id,))
@@ -2091,6 +3809,8 @@ def get_campaign(campaign_id):
                 'opened_count': opened_count,
                 'clicked_count': clicked_count,
                 'replied_count': replied_count,
+                # Recipients whose only "opens" came from mail proxies, prefetchers or scanners
+                'automated_only_count': overall_stats['automated_only_count'],
                 'open_rate': open_rate,
                 'click_rate': click_rate,
                 'reply_rate': reply_rate
@@ -2099,17 +3819,7 @@ def get_campaign(campaign_id):
         }
     
     # Prepare template data
-    template_data = None
-    if template:
-        template_data = dict(template)
-        template_data['template_id'] = str(template_data['template_id'])
-        template_data['user_id'] = str(template_data['user_id'])
-        template_data['campaign_id'] = str(template_data['campaign_id'])
-        
-        # Format dates
-        for key in ['created_at', 'updated_at']:
-            if key in template_data and template_data[key]:
-                template_data[key] = template_data[key].isoformat()
+    template_data = serialize_email_template(template) if template else None
     
     # Prepare campaign data
     campaign_data = dict(campaign)
@@ -2158,7 +3868,200 @@ def get_campaign(campaign_id):
     
     return jsonify(result), 200
 
-@app.route('/api/campaigns/<campaign_id>/send', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/timeseries', methods=['GET'])
+@jwt_required()
+@handle_transaction
+def get_campaign_timeseries(campaign_id):
+    """Get engagement over time for a campaign from the pre-aggregated rollups"""
+    user_id = get_jwt_identity()
+    bucket = request.args.get('bucket', '1h')
+    metric = request.args.get('metric', 'opens')
+    
+    if bucket not in TIMESERIES_BUCKETS:
+        return jsonify({'message': f'Invalid bucket: {bucket} (use 5m, 1h or 1d)'}), 422
+    if metric not in ('opens', 'clicks', 'replies'):
+        return jsonify({'message': f'Invalid metric: {metric} (use opens, clicks or replies)'}), 422
+    
+    conn, cur = get_db_connection()
+    
+    # Verify campaign belongs to user
+    cur.execute("""
+        SELECT campaign_id, sent_at FROM email_campaigns
+        WHERE campaign_id = %s AND user_id = %s
+    """, (campaign_id, user_id))
+    
+    campaign = cur.fetchone()
+    
+    if not campaign:
+        return jsonify({'message': 'Campaign not found'}), 404
+    
+    # Sum the 5 minute rollup rows into the requested bucket size
+    bucket_seconds = TIMESERIES_BUCKETS[bucket]
+    cur.execute("""
+        SELECT
+            to_timestamp(floor(extract(epoch FROM bucket_start) / %s) * %s) AS bucket_start,
+            SUM(event_count) AS count,
+            SUM(unique_count) AS unique_count
+        FROM campaign_engagement_rollups
+        WHERE campaign_id = %s AND metric = %s
+        GROUP BY 1
+        ORDER BY 1
+    """, (bucket_seconds, bucket_seconds, campaign_id, metric))
+    
+    points = []
+    total = 0
+    unique_total = 0
+    for row in cur.fetchall():
+        total += row['count']
+        unique_total += row['unique_count']
+        points.append({
+            'bucket_start': row['bucket_start'].isoformat(),
+            'count': row['count'],
+            'unique_count': row['unique_count']
+        })
+    
+    return jsonify({
+        'campaign_id': str(campaign['campaign_id']),
+        'metric': metric,
+        'bucket': bucket,
+        'sent_at': campaign['sent_at'].isoformat() if campaign['sent_at'] else None,
+        'total': total,
+        'unique_total': unique_total,
+        'points': points
+    }), 200
+
+@api.route('/api/campaigns/<campaign_id>/links', methods=['GET'])
+@jwt_required()
+@handle_transaction
+def get_campaign_links(campaign_id):
+    """Get the campaign's links ranked by clicks"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    
+    # Verify campaign belongs to user
+    cur.execute("""
+        SELECT campaign_id FROM email_campaigns
+        WHERE campaign_id = %s AND user_id = %s
+    """, (campaign_id, user_id))
+    
+    if not cur.fetchone():
+        return jsonify({'message': 'Campaign not found'}), 404
+    
+    # campaign_links counters are maintained by the tracking event rollup
+    cur.execute("""
+        SELECT link_id, original_url, total_clicks, unique_clicks, first_clicked_at, last_clicked_at
+        FROM campaign_links
+        WHERE campaign_id = %s
+        ORDER BY total_clicks DESC, unique_clicks DESC, created_at
+    """, (campaign_id,))
+    rows = cur.fetchall()
+    
+    if not rows:
+        # Campaigns sent before campaign_links existed only have per-recipient url_tracking rows
+        cur.execute("""
+            SELECT
+                NULL AS link_id,
+                ut.original_url,
+                SUM(ut.click_count) AS total_clicks,
+                COUNT(*) FILTER (WHERE ut.click_count > 0) AS unique_clicks,
+                MIN(ut.first_clicked_at) AS first_clicked_at,
+                MAX(ut.last_clicked_at) AS last_clicked_at
+            FROM url_tracking ut
+            JOIN email_tracking et ON ut.tracking_id = et.tracking_id
+            WHERE et.campaign_id = %s AND ut.original_url IS NOT NULL
+            GROUP BY ut.original_url
+            ORDER BY total_clicks DESC, unique_clicks DESC
+        """, (campaign_id,))
+        rows = cur.fetchall()
+    
+    links = []
+    for rank, row in enumerate(rows, start=1):
+        link_data = dict(row)
+        link_data['rank'] = rank
+        if link_data['link_id']:
+            link_data['link_id'] = str(link_data['link_id'])
+        
+        # Format dates
+        for key in ['first_clicked_at', 'last_clicked_at']:
+            if link_data[key]:
+                link_data[key] = link_data[key].isoformat()
+        
+        links.append(link_data)
+    
+    return jsonify({
+        'campaign_id': campaign_id,
+        'links': links
+    }), 200
+
+@api.route('/api/campaigns/<campaign_id>/clone', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def clone_campaign(campaign_id):
+    """Copy a campaign's settings, recipients, groups and template into a new draft.
+    
+    With template_id the clone uses that library template instead. The compiled form
+    comes along with the HTML, so sending the clone doesn't parse the template again.
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    conn, cur = get_db_connection()
+    
+    cur.execute("""
+        SELECT * FROM email_campaigns
+        WHERE campaign_id = %s AND user_id = %s
+    """, (campaign_id, user_id))
+    campaign = cur.fetchone()
+    
+    if not campaign:
+        return jsonify({'message': 'Campaign not found or access denied'}), 404
+    
+    if data.get('template_id'):
+        template = find_library_template(cur, user_id, data['template_id'])
+        if not template:
+            return jsonify({'message': 'Template not found or access denied'}), 404
+    else:
+        cur.execute("""
+            SELECT template_id FROM email_templates
+            WHERE campaign_id = %s AND is_active = TRUE
+            LIMIT 1
+        """, (campaign_id,))
+        template = cur.fetchone()
+    
+    cur.execute("""
+        INSERT INTO email_campaigns 
+        (user_id, campaign_name, subject_line, from_name, from_email, reply_to_email)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING campaign_id
+    """, (
+        user_id,
+        data.get('campaign_name') or f"{campaign['campaign_name']} (copy)",
+        data.get('subject_line') or campaign['subject_line'],
+        campaign['from_name'],
+        campaign['from_email'],
+        campaign['reply_to_email']
+    ))
+    clone_id = cur.fetchone()['campaign_id']
+    
+    template_id = copy_template_to_campaign(cur, clone_id, template['template_id']) if template else None
+    
+    cur.execute("""
+        INSERT INTO campaign_recipients (campaign_id, recipient_id)
+        SELECT %s, recipient_id FROM campaign_recipients
+        WHERE campaign_id = %s AND is_active = TRUE
+    """, (clone_id, campaign_id))
+    cur.execute("""
+        INSERT INTO campaign_groups (campaign_id, group_id)
+        SELECT %s, group_id FROM campaign_groups
+        WHERE campaign_id = %s AND is_active = TRUE
+    """, (clone_id, campaign_id))
+    
+    return jsonify({
+        'message': 'Campaign cloned successfully',
+        'campaign_id': str(clone_id),
+        'template_id': str(template_id) if template_id else None
+    }), 201
+
+@api.route('/api/campaigns/<campaign_id>/send', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def send_campaign(campaign_id):
@@ -2191,7 +4094,7 @@ def send_campaign(campaign_id):
     
     # Get base URL from current request
     base_url = request.host_url
-    app.logger.info(f"Sending campaign {campaign_id} with base_url: {base_url}, test_mode: {test_mode}")
+    logger.info(f"Sending campaign {campaign_id} with base_url: {base_url}, test_mode: {test_mode}")
     
     if test_mode:
         # Send test email without updating campaign status
@@ -2201,22 +4104,67 @@ def send_campaign(campaign_id):
             'message': 'Test email sending in progress'
         }), 200
     else:
-        # Update campaign status
-        cur.execute("""
-            UPDATE email_campaigns
-            SET status = 'sending'
-            WHERE campaign_id = %s
-        """, (campaign_id,))
-        
-        # Send emails in background
-        Thread(target=send_email_async, args=(campaign_id, False, base_url)).start()
+        # Send emails in background, or queue them for a send worker
+        if start_campaign_send(cur, campaign_id, base_url):
+            return jsonify({
+                'message': 'Campaign queued for sending'
+            }), 200
         
         return jsonify({
             'message': 'Campaign sending in progress'
         }), 200
 
+@api.route('/api/campaigns/<campaign_id>/resume', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def resume_campaign(campaign_id):
+    """Continue an interrupted send with the recipients that haven't been sent yet"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    
+    # Verify campaign exists and belongs to user
+    cur.execute("""
+        SELECT status,
+               send_heartbeat_at IS NULL
+               OR send_heartbeat_at < NOW() - make_interval(secs => %s) AS lease_expired
+        FROM email_campaigns
+        WHERE campaign_id = %s AND user_id = %s
+        FOR UPDATE
+    """, (SEND_LEASE_SECONDS, campaign_id, user_id))
+    
+    campaign = cur.fetchone()
+    
+    if not campaign:
+        return jsonify({'message': 'Campaign not found'}), 404
+    
+    # A 'sending' campaign is only resumable once its sender has stopped checkpointing
+    if campaign['status'] == 'sending' and not campaign['lease_expired']:
+        return jsonify({'message': 'Campaign is still sending'}), 409
+    if campaign['status'] not in ('interrupted', 'sending'):
+        return jsonify({'message': f'Campaign cannot be resumed (status: {campaign["status"]})'}), 400
+    
+    cur.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE email_status = 'queued') AS queued,
+            COUNT(*) FILTER (WHERE email_status = 'sending') AS unconfirmed,
+            COUNT(*) FILTER (WHERE sent_at IS NOT NULL) AS sent
+        FROM email_tracking
+        WHERE campaign_id = %s
+    """, (campaign_id,))
+    progress = cur.fetchone()
+    
+    logger.info(f"♻️ Resuming campaign {campaign_id}: {progress['sent']} sent, {progress['queued']} queued")
+    queued = start_campaign_send(cur, campaign_id, request.host_url)
+    
+    return jsonify({
+        'message': 'Campaign queued for sending' if queued else 'Campaign sending resumed',
+        'sent': progress['sent'],
+        'remaining': progress['queued'],
+        'unconfirmed': progress['unconfirmed']
+    }), 200
+
 # API Routes - Recipients (UPDATED)
-@app.route('/api/recipients', methods=['GET'])
+@api.route('/api/recipients', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_recipients():
@@ -2251,7 +4199,7 @@ def get_recipients():
     
     return jsonify(result), 200
 
-@app.route('/api/recipients', methods=['POST'])
+@api.route('/api/recipients', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def create_recipient():
@@ -2311,7 +4259,7 @@ def create_recipient():
         'recipient_id': str(recipient['recipient_id'])
     }), 201
 
-@app.route('/api/recipients/bulk', methods=['POST'])
+@api.route('/api/recipients/bulk', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def create_recipients_bulk():
@@ -2369,7 +4317,7 @@ def create_recipients_bulk():
         'skipped_count': skipped_count
     }), 201
 
-@app.route('/api/recipients/<recipient_id>', methods=['GET'])
+@api.route('/api/recipients/<recipient_id>', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_recipient(recipient_id):
@@ -2402,7 +4350,7 @@ def get_recipient(recipient_id):
     
     return jsonify(result), 200
 
-@app.route('/api/recipients/<recipient_id>/update', methods=['POST'])
+@api.route('/api/recipients/<recipient_id>/update', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def update_recipient(recipient_id):
@@ -2486,7 +4434,7 @@ def update_recipient(recipient_id):
         'recipient_id': str(updated['recipient_id'])
     }), 200
 
-@app.route('/api/recipients/<recipient_id>/delete', methods=['POST'])
+@api.route('/api/recipients/<recipient_id>/delete', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def delete_recipient_post(recipient_id):
@@ -2524,95 +4472,331 @@ def delete_recipient_post(recipient_id):
         'recipient_id': recipient_id
     }), 200
 
-@app.route('/api/recipients/bulk-delete', methods=['POST'])
+@api.route('/api/recipients/bulk-delete', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def bulk_delete_recipients():
+    """Delete multiple recipients at once"""
+    user_id = get_jwt_identity()
+    data = request.get_json()
+    
+    # Validate data
+    if not data or 'recipient_ids' not in data or not data['recipient_ids']:
+        return jsonify({'message': 'No recipient IDs provided'}), 400
+    
+    conn, cur = get_db_connection()
+    
+    # Convert recipient_ids to a list if it's a single value
+    recipient_ids = data['recipient_ids']
+    if not isinstance(recipient_ids, list):
+        recipient_ids = [recipient_ids]
+    
+    # Get recipients that belong to the user
+    placeholders = ','.join(['%s'] * len(recipient_ids))
+    query_params = recipient_ids + [user_id]
+    
+    cur.execute(f"""
+        SELECT recipient_id FROM recipients
+        WHERE recipient_id IN ({placeholders})
+        AND user_id = %s
+    """, query_params)
+    
+    valid_recipient_ids = [str(row['recipient_id']) for row in cur.fetchall()]
+    
+    if not valid_recipient_ids:
+        return jsonify({'message': 'No valid recipients found'}), 404
+    
+    # Soft delete the recipients
+    placeholders = ','.join(['%s'] * len(valid_recipient_ids))
+    
+    cur.execute(f"""
+        UPDATE recipients
+        SET is_active = FALSE, updated_at = NOW()
+        WHERE recipient_id IN ({placeholders})
+    """, valid_recipient_ids)
+    
+    # Remove recipients from any campaign_recipients
+    cur.execute(f"""
+        UPDATE campaign_recipients
+        SET is_active = FALSE
+        WHERE recipient_id IN ({placeholders})
+    """, valid_recipient_ids)
+    
+    return jsonify({
+        'message': f'Successfully deleted {len(valid_recipient_ids)} recipients',
+        'deleted_count': len(valid_recipient_ids),
+        'recipient_ids': valid_recipient_ids
+    }), 200
+
+# API Routes - Suppressions
+@api.route('/api/suppressions', methods=['GET'])
+@jwt_required()
+@handle_transaction
+def get_suppressions():
+    """List the current user's suppressed addresses, newest first"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    reason = request.args.get('reason')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    offset = request.args.get('offset', 0, type=int)
+    
+    cur.execute("""
+        SELECT email, reason, tracking_id, created_at FROM suppressions
+        WHERE user_id = %s AND (%s::text IS NULL OR reason = %s)
+        ORDER BY created_at DESC
+        LIMIT %s OFFSET %s
+    """, (user_id, reason, reason, limit, offset))
+    
+    result = []
+    for row in cur.fetchall():
+        row = dict(row)
+        row['tracking_id'] = str(row['tracking_id']) if row['tracking_id'] else None
+        row['created_at'] = row['created_at'].isoformat() if row['created_at'] else None
+        result.append(row)
+    
+    return jsonify(result), 200
+
+@api.route('/api/suppressions', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def add_suppressions():
+    """Suppress addresses for all of the current user's campaigns"""
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
+    emails = data.get('emails') or []
+    if not isinstance(emails, list):
+        emails = [emails]
+    reason = data.get('reason', 'manual')
+    
+    if not emails:
+        return jsonify({'message': 'No emails provided'}), 400
+    if reason not in SUPPRESSION_REASONS:
+        return jsonify({'message': f'Invalid reason, expected one of {", ".join(SUPPRESSION_REASONS)}'}), 400
+    
+    conn, cur = get_db_connection()
+    addresses = sorted({str(email_address).strip().lower() for email_address in emails if str(email_address).strip()})
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO suppressions (user_id, email, reason) VALUES %s
+        ON CONFLICT (user_id, email) DO NOTHING
+    """, [(user_id, address, reason) for address in addresses])
+    SUPPRESSIONS_ADDED.labels(reason).inc(cur.rowcount)
+    
+    return jsonify({
+        'message': f'Suppressed {cur.rowcount} new addresses',
+        'added_count': cur.rowcount
+    }), 201
+
+@api.route('/api/suppressions/<path:email_address>', methods=['DELETE'])
+@jwt_required()
+@handle_transaction
+def delete_suppression(email_address):
+    """Remove an address from the current user's suppression list"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    
+    cur.execute("""
+        DELETE FROM suppressions WHERE user_id = %s AND email = %s
+    """, (user_id, email_address.strip().lower()))
+    
+    if cur.rowcount == 0:
+        return jsonify({'message': 'Address is not suppressed'}), 404
+    
+    return jsonify({'message': 'Suppression removed'}), 200
+
+# API Routes - Reply Mailboxes
+def serialize_reply_mailbox(row):
+    row = dict(row)
+    row['mailbox_id'] = str(row['mailbox_id'])
+    for key in ('last_checked_at', 'created_at'):
+        row[key] = row[key].isoformat() if row[key] else None
+    return row
+
+@api.route('/api/mailboxes', methods=['GET'])
+@jwt_required()
+@handle_transaction
+def get_reply_mailboxes():
+    """List the current user's registered reply mailboxes and how their last scan went"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    
+    cur.execute("""
+        SELECT mailbox_id, address, credential_ref, last_uid, last_checked_at, last_error, is_active, created_at
+        FROM reply_mailboxes
+        WHERE user_id = %s
+        ORDER BY created_at
+    """, (user_id,))
+    
+    return jsonify([serialize_reply_mailbox(row) for row in cur.fetchall()]), 200
+
+@api.route('/api/mailboxes', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def add_reply_mailbox():
+    """Register the mailbox replies to `address` arrive in, logging in with a configured credential"""
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
+    address = (data.get('address') or '').strip().lower()
+    credential_ref = data.get('credential_ref') or ''
+    
+    if not address or not credential_ref:
+        return jsonify({'message': 'address and credential_ref are required'}), 400
+    if credential_ref not in IMAP_CREDENTIALS:
+        return jsonify({'message': f'Unknown credential_ref {credential_ref}'}), 400
+    
+    conn, cur = get_db_connection()
+    cur.execute("""
+        INSERT INTO reply_mailboxes (user_id, address, credential_ref)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (user_id, address) DO UPDATE
+        SET credential_ref = EXCLUDED.credential_ref, is_active = TRUE, last_error = NULL
+        RETURNING mailbox_id, address, credential_ref, last_uid, last_checked_at, last_error, is_active, created_at
+    """, (user_id, address, credential_ref))
+    
+    return jsonify(serialize_reply_mailbox(cur.fetchone())), 201
+
+@api.route('/api/mailboxes/<mailbox_id>', methods=['DELETE'])
+@jwt_required()
+@handle_transaction
+def delete_reply_mailbox(mailbox_id):
+    """Stop scanning a reply mailbox"""
+    user_id = get_jwt_identity()
+    conn, cur = get_db_connection()
+    
+    cur.execute("""
+        DELETE FROM reply_mailboxes WHERE mailbox_id = %s AND user_id = %s
+    """, (mailbox_id, user_id))
+    
+    if cur.rowcount == 0:
+        return jsonify({'message': 'Mailbox not found or access denied'}), 404
+    
+    return jsonify({'message': 'Mailbox removed'}), 200
+
+# API Routes - Templates
+def serialize_email_template(row):
+    """Template row as JSON, with a summary of its compiled form in place of the segments"""
+    template_data = dict(row)
+    for key in ('template_id', 'user_id', 'campaign_id', 'source_template_id'):
+        if template_data.get(key):
+            template_data[key] = str(template_data[key])
+    compiled = template_data.pop('compiled', None)
+    template_data['compiled'] = {
+        'size': compiled['size'],
+        'fields': compiled['fields'],
+        'links': compiled['links'],
+        'precompiled': compiled['segments'] is not None,
+    } if compiled else None
+    
+    # Format dates
+    for key in ['created_at', 'updated_at']:
+        if key in template_data and template_data[key]:
+            template_data[key] = template_data[key].isoformat()
+    return template_data
+
+@api.route('/api/templates', methods=['GET'])
 @jwt_required()
 @handle_transaction
-def bulk_delete_recipients():
-    """Delete multiple recipients at once"""
+def get_templates():
+    """Get all templates for current user, or only the library ones with ?library=true"""
     user_id = get_jwt_identity()
-    data = request.get_json()
+    conn, cur = get_db_connection()
+    library_only = request.args.get('library', '').lower() in ('1', 'true', 'yes')
     
-    # Validate data
-    if not data or 'recipient_ids' not in data or not data['recipient_ids']:
-        return jsonify({'message': 'No recipient IDs provided'}), 400
+    cur.execute("""
+        SELECT * FROM email_templates
+        WHERE user_id = %s AND is_active = TRUE
+        AND (campaign_id IS NULL OR NOT %s)
+        ORDER BY created_at DESC
+    """, (user_id, library_only))
     
-    conn, cur = get_db_connection()
+    templates = cur.fetchall()
     
-    # Convert recipient_ids to a list if it's a single value
-    recipient_ids = data['recipient_ids']
-    if not isinstance(recipient_ids, list):
-        recipient_ids = [recipient_ids]
+    return jsonify([serialize_email_template(template) for template in templates]), 200
+
+@api.route('/api/templates', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def create_template():
+    """Save a reusable library template, compiled and validated once here"""
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
     
-    # Get recipients that belong to the user
-    placeholders = ','.join(['%s'] * len(recipient_ids))
-    query_params = recipient_ids + [user_id]
+    if not data.get('name') or not data.get('html_content'):
+        return jsonify({'message': 'name and html_content are required'}), 422
+    try:
+        compiled = compile_email_template(data['html_content'])
+    except TemplateError as e:
+        return jsonify({'message': str(e)}), 400
     
-    cur.execute(f"""
-        SELECT recipient_id FROM recipients
-        WHERE recipient_id IN ({placeholders})
-        AND user_id = %s
-    """, query_params)
+    conn, cur = get_db_connection()
+    cur.execute("""
+        INSERT INTO email_templates
+        (user_id, template_name, html_content, text_content, compiled)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING *
+    """, (user_id, data['name'], data['html_content'], data.get('text_content', ''), json.dumps(compiled)))
     
-    valid_recipient_ids = [str(row['recipient_id']) for row in cur.fetchall()]
+    return jsonify(serialize_email_template(cur.fetchone())), 201
+
+@api.route('/api/templates/<template_id>/update', methods=['POST'])
+@jwt_required()
+@handle_transaction
+def update_template(template_id):
+    """Update a library template. Campaigns already made from it keep their own copy"""
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
+    conn, cur = get_db_connection()
     
-    if not valid_recipient_ids:
-        return jsonify({'message': 'No valid recipients found'}), 404
+    cur.execute("""
+        SELECT * FROM email_templates
+        WHERE template_id = %s AND user_id = %s AND campaign_id IS NULL AND is_active = TRUE
+    """, (template_id, user_id))
+    template = cur.fetchone()
     
-    # Soft delete the recipients
-    placeholders = ','.join(['%s'] * len(valid_recipient_ids))
+    if not template:
+        return jsonify({'message': 'Template not found or access denied'}), 404
     
-    cur.execute(f"""
-        UPDATE recipients
-        SET is_active = FALSE, updated_at = NOW()
-        WHERE recipient_id IN ({placeholders})
-    """, valid_recipient_ids)
+    html_content = data.get('html_content') or template['html_content']
+    try:
+        compiled = compile_email_template(html_content)
+    except TemplateError as e:
+        return jsonify({'message': str(e)}), 400
     
-    # Remove recipients from any campaign_recipients
-    cur.execute(f"""
-        UPDATE campaign_recipients
-        SET is_active = FALSE
-        WHERE recipient_id IN ({placeholders})
-    """, valid_recipient_ids)
+    cur.execute("""
+        UPDATE email_templates
+        SET 
+            template_name = %s,
+            html_content = %s,
+            text_content = %s,
+            compiled = %s,
+            updated_at = NOW()
+        WHERE template_id = %s
+        RETURNING *
+    """, (data.get('name') or template['template_name'], html_content,
+          data.get('text_content', template['text_content']), json.dumps(compiled), template_id))
     
-    return jsonify({
-        'message': f'Successfully deleted {len(valid_recipient_ids)} recipients',
-        'deleted_count': len(valid_recipient_ids),
-        'recipient_ids': valid_recipient_ids
-    }), 200
+    return jsonify(serialize_email_template(cur.fetchone())), 200
 
-# API Routes - Templates
-@app.route('/api/templates', methods=['GET'])
+@api.route('/api/templates/<template_id>/delete', methods=['POST'])
 @jwt_required()
 @handle_transaction
-def get_templates():
-    """Get all templates for current user"""
+def delete_template(template_id):
+    """Remove a library template. Campaigns already made from it keep their own copy"""
     user_id = get_jwt_identity()
     conn, cur = get_db_connection()
     
     cur.execute("""
-        SELECT * FROM email_templates
-        WHERE user_id = %s AND is_active = TRUE
-        ORDER BY created_at DESC
-    """, (user_id,))
-    
-    templates = cur.fetchall()
+        UPDATE email_templates
+        SET is_active = FALSE, updated_at = NOW()
+        WHERE template_id = %s AND user_id = %s AND campaign_id IS NULL AND is_active = TRUE
+    """, (template_id, user_id))
     
-    result = []
-    for template in templates:
-        template_data = dict(template)
-        template_data['template_id'] = str(template_data['template_id'])
-        template_data['user_id'] = str(template_data['user_id'])
-        if template_data['campaign_id']:
-            template_data['campaign_id'] = str(template_data['campaign_id'])
-        
-        # Format dates
-        for key in ['created_at', 'updated_at']:
-            if key in template_data and template_data[key]:
-                template_data[key] = template_data[key].isoformat()
-        
-        result.append(template_data)
+    if cur.rowcount == 0:
+        return jsonify({'message': 'Template not found or access denied'}), 404
     
-    return jsonify(result), 200
+    return jsonify({
+        'message': 'Template deleted successfully',
+        'template_id': str(template_id)
+    }), 200
 
 # Tracking routes with enhanced logging and direct database connections
 # @app.route('/track/open/<tracking_pixel_id>', methods=['GET'])
@@ -2701,291 +4885,158 @@ def get_templates():
 #         if conn:
 #             conn.close()
 
-@app.route('/track/open/<tracking_pixel_id>', methods=['GET'])
+@api.route('/track/open/<tracking_pixel_id>', methods=['GET'])
 def track_open(tracking_pixel_id):
     """Track email opens via tracking pixel with enhanced reliability"""
-    conn = None
     try:
         # Extract source info if available (for debugging)
         source = request.args.get('s', 'img')
         position = request.args.get('pos', 'unknown')
         user_agent = request.headers.get('User-Agent', 'Unknown')
         
-        app.logger.info(f"🔍 Tracking pixel accessed: {tracking_pixel_id} (source: {source}, pos: {position}, UA: {user_agent})")
-        
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Find tracking entry
-        cur.execute("""
-            SELECT tracking_id, campaign_id, recipient_id, email_status, opened_at, open_count 
-            FROM email_tracking
-            WHERE tracking_pixel_id = %s
-        """, (tracking_pixel_id,))
-        
-        tracking = cur.fetchone()
-        
-        if tracking:
-            app.logger.info(f"✅ Found tracking entry: {tracking['tracking_id']} for campaign {tracking['campaign_id']}")
-            app.logger.debug(f"Current values: status={tracking['email_status']}, opened_at={tracking['opened_at']}, count={tracking['open_count']}")
-            
-            # Update tracking data - don't downgrade from 'clicked' or 'replied' to 'opened'
-            cur.execute("""
-                UPDATE email_tracking
-                SET 
-                    email_status = CASE
-                        WHEN email_status IN ('sending', 'sent', 'pending', 'failed') THEN 'opened'
-                        ELSE email_status -- Keep existing status if it's 'clicked' or 'replied'
-                    END,
-                    opened_at = COALESCE(opened_at, NOW()),
-                    open_count = open_count + 1,
-                    updated_at = NOW()
-                WHERE tracking_id = %s
-                RETURNING tracking_id, email_status, opened_at, open_count, updated_at
-            """, (tracking['tracking_id'],))
-            
-            updated = cur.fetchone()
-            
-            # Explicitly commit and confirm
-            conn.commit()
-            app.logger.info(f"✅ UPDATE COMMITTED: status={updated['email_status']}, opened_at={updated['opened_at']}, count={updated['open_count']}")
-            
-            # Double-check the update (extra validation)
-            cur.execute("""
-                SELECT tracking_id, email_status, opened_at, open_count 
-                FROM email_tracking
-                WHERE tracking_id = %s
-            """, (tracking['tracking_id'],))
-            
-            verification = cur.fetchone()
-            app.logger.debug(f"✅ VERIFIED VALUES: status={verification['email_status']}, opened_at={verification['opened_at']}, count={verification['open_count']}")
-            
-        else:
-            app.logger.warning(f"⚠️ No tracking entry found for pixel ID: {tracking_pixel_id}")
+        tracking_access_log.log("🔍 Tracking pixel accessed: %s (source: %s, pos: %s, UA: %s)",
+                                tracking_pixel_id, source, position, user_agent, event='open',
+                                tracking_pixel_id=tracking_pixel_id, source=source, user_agent=user_agent)
+        
+        agent_class = classify_user_agent(user_agent, request.headers.get('Sec-Purpose') or request.headers.get('Purpose'))
+        
+        # The email embeds several pixels plus a beacon, so one open arrives as a burst of
+        # requests - only the first hit per pixel inside the dedup window is recorded
+        if not open_dedup_cache.is_duplicate((tracking_pixel_id, agent_class)):
+            # Queue the open - the event buffer writes it to tracking_events and
+            # rolls it up into email_tracking in the next batch
+            tracking_event_buffer.record(
+                'open',
+                tracking_pixel_id=tracking_pixel_id,
+                source=source,
+                user_agent=user_agent,
+                ip_address=request.remote_addr,
+                agent_class=agent_class
+            )
         
         # Return a 1x1 transparent pixel
-        pixel = base64.b64decode('R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==')
-        
-        return pixel, 200, {
-            'Content-Type': 'image/gif', 
-            'Cache-Control': 'no-cache, no-store, must-revalidate, private',
-            'Pragma': 'no-cache',
-            'Expires': '0',
-            'Access-Control-Allow-Origin': '*'
-        }
+        return tracking_pixel_response()
     
     except Exception as e:
-        app.logger.error(f"❌ Error tracking open: {str(e)}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
+        logger.error("❌ Error tracking open: %s", e)
         # Still return a pixel to avoid broken images
-        pixel = base64.b64decode('R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==')
-        return pixel, 200, {'Content-Type': 'image/gif'}
-    finally:
-        if conn:
-            conn.close()
+        return tracking_pixel_response()
 
 
-@app.route('/track/click/<tracking_id>/<url_tracking_id>', methods=['GET'])
+@api.route('/track/click/<tracking_id>/<url_tracking_id>', methods=['GET'])
 def track_click(tracking_id, url_tracking_id):
     """Track email link clicks and also ensure opens are recorded"""
-    conn = None
+    started = time.perf_counter()
     try:
-        app.logger.info(f"🔍 Click tracking: tracking_id={tracking_id}, url_tracking_id={url_tracking_id}")
-        
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Find url tracking entry
-        cur.execute("""
-            SELECT * FROM url_tracking
-            WHERE url_tracking_id = %s
-        """, (url_tracking_id,))
+        url_tracking_id = parse_uuid(url_tracking_id)
+        if not url_tracking_id:
+            logger.warning("⚠️ Invalid URL tracking id in click: %s", request.view_args['url_tracking_id'])
+            return redirect(FALLBACK_REDIRECT_URL, code=302)
         
-        url_tracking = cur.fetchone()
+        # Find url tracking entry - served from the redirect cache after the first click
+        destination = resolve_click_destination(url_tracking_id)
         
-        if not url_tracking:
-            app.logger.warning(f"⚠️ No URL tracking entry found for {url_tracking_id}")
+        if not destination:
+            logger.warning("⚠️ No URL tracking entry found for %s", url_tracking_id)
             # Fallback to a safe URL if the tracking entry isn't found
-            return redirect("https://www.google.com", code=302)
-            
-        original_url = url_tracking['original_url']
-        app.logger.info(f"✅ Found original URL: {original_url}")
-        
-        # Update url tracking data
-        cur.execute("""
-            UPDATE url_tracking
-            SET 
-                click_count = click_count + 1,
-                first_clicked_at = COALESCE(first_clicked_at, NOW()),
-                last_clicked_at = NOW()
-            WHERE url_tracking_id = %s
-            RETURNING url_tracking_id, click_count
-        """, (url_tracking_id,))
-        
-        url_update = cur.fetchone()
-        app.logger.info(f"✅ Updated URL tracking: url_id={url_update['url_tracking_id']}, clicks={url_update['click_count']}")
-        
-        # First check if this tracking ID exists and get its current values
-        cur.execute("""
-            SELECT tracking_id, email_status, opened_at, open_count, clicked_at, click_count, replied_at
-            FROM email_tracking
-            WHERE tracking_id = %s
-        """, (tracking_id,))
-        
-        tracking = cur.fetchone()
-        
-        if tracking:
-            app.logger.info(f"✅ Found tracking entry: {tracking['tracking_id']}")
-            app.logger.info(f"Current values: status={tracking['email_status']}, opened_at={tracking['opened_at']}, open_count={tracking['open_count']}, clicked_at={tracking['clicked_at']}, click_count={tracking['click_count']}")
-            
-            # Update email tracking - ensure opened is also recorded
-            cur.execute("""
-                UPDATE email_tracking
-                SET 
-                    -- Set status to 'clicked' unless it's already 'replied'
-                    email_status = CASE
-                        WHEN email_status = 'replied' THEN 'replied'
-                        ELSE 'clicked'
-                    END,
-                    -- Always ensure opened_at is set - clicking means they opened it
-                    opened_at = COALESCE(opened_at, NOW()),
-                    -- Make sure open_count is at least 1
-                    open_count = CASE WHEN open_count = 0 THEN 1 ELSE open_count END,
-                    -- Update clicked data
-                    clicked_at = COALESCE(clicked_at, NOW()),
-                    click_count = click_count + 1,
-                    updated_at = NOW()
-                WHERE tracking_id = %s
-                RETURNING tracking_id, email_status, opened_at, open_count, clicked_at, click_count
-            """, (tracking_id,))
-            
-            tracking_update = cur.fetchone()
-            
-            conn.commit()
-            app.logger.info(f"✅ UPDATE COMMITTED: status={tracking_update['email_status']}, opened_at={tracking_update['opened_at']}, open_count={tracking_update['open_count']}, clicked_at={tracking_update['clicked_at']}, click_count={tracking_update['click_count']}")
-            
-            # Double-check the update
-            cur.execute("""
-                SELECT tracking_id, email_status, opened_at, open_count, clicked_at, click_count
-                FROM email_tracking
-                WHERE tracking_id = %s
-            """, (tracking_id,))
+            return redirect(FALLBACK_REDIRECT_URL, code=302)
             
-            verification = cur.fetchone()
-            app.logger.info(f"✅ VERIFIED VALUES: status={verification['email_status']}, opens={verification['open_count']}, clicks={verification['click_count']}")
-        else:
-            app.logger.warning(f"⚠️ No email tracking record found for {tracking_id}")
-            conn.commit()
+        original_url, url_tracking_tracking_id = destination
+        
+        # Queue the click - url_tracking and email_tracking counters (including
+        # making sure the open is recorded) are rolled up from the event batch
+        user_agent = request.headers.get('User-Agent')
+        tracking_event_buffer.record(
+            'click',
+            tracking_id=url_tracking_tracking_id,
+            url_tracking_id=url_tracking_id,
+            user_agent=user_agent,
+            ip_address=request.remote_addr,
+            agent_class=classify_user_agent(user_agent, request.headers.get('Sec-Purpose') or request.headers.get('Purpose'))
+        )
         
-        app.logger.info(f"🔄 Redirecting to: {original_url}")
+        tracking_access_log.log("🔄 Click %s/%s redirecting to %s", tracking_id, url_tracking_id, original_url,
+                                event='click', tracking_id=url_tracking_tracking_id, url_tracking_id=url_tracking_id,
+                                destination=original_url, user_agent=user_agent)
         
         # Redirect to the original URL
-        return redirect(original_url, code=302)
+        response = redirect(original_url, code=302)
+        redirect_cache.record_redirect(time.perf_counter() - started)
+        return response
         
     except Exception as e:
-        app.logger.error(f"❌ Error tracking click: {str(e)}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
+        logger.error("❌ Error tracking click: %s", e)
         # Provide a fallback in case of error
-        return redirect("https://www.google.com", code=302)
-    finally:
-        if conn:
-            conn.close()
+        return redirect(FALLBACK_REDIRECT_URL, code=302)
 
 # Add this new beacon tracking endpoint for JavaScript-based tracking
-@app.route('/track/beacon/<tracking_pixel_id>', methods=['GET'])
+@api.route('/track/beacon/<tracking_pixel_id>', methods=['GET'])
 def track_beacon(tracking_pixel_id):
     """JavaScript-based tracking endpoint as backup for image tracking"""
-    conn = None
     try:
         # Get delay flag if this is a delayed beacon
         delayed = request.args.get('d', '0') == '1'
         user_agent = request.headers.get('User-Agent', 'Unknown')
         
-        app.logger.info(f"🔍 Beacon tracking accessed: {tracking_pixel_id} (delayed: {delayed}, UA: {user_agent})")
-        
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Find tracking entry
-        cur.execute("""
-            SELECT tracking_id, campaign_id, recipient_id, email_status, opened_at, open_count 
-            FROM email_tracking
-            WHERE tracking_pixel_id = %s
-        """, (tracking_pixel_id,))
-        
-        tracking = cur.fetchone()
-        
-        if tracking:
-            app.logger.info(f"✅ Found tracking entry for beacon: {tracking['tracking_id']} (campaign: {tracking['campaign_id']})")
-            
-            # Update tracking data - similar to track_open
-            cur.execute("""
-                UPDATE email_tracking
-                SET 
-                    email_status = CASE
-                        WHEN email_status IN ('sending', 'sent', 'pending', 'failed') THEN 'opened'
-                        ELSE email_status
-                    END,
-                    opened_at = COALESCE(opened_at, NOW()),
-                    open_count = open_count + 1,
-                    updated_at = NOW()
-                WHERE tracking_id = %s
-                RETURNING tracking_id, email_status, opened_at, open_count
-            """, (tracking['tracking_id'],))
-            
-            updated = cur.fetchone()
-            conn.commit()
-            app.logger.info(f"✅ Beacon tracking updated: status={updated['email_status']}, opens={updated['open_count']}")
-        else:
-            app.logger.warning(f"⚠️ No tracking entry found for beacon ID: {tracking_pixel_id}")
+        tracking_access_log.log("🔍 Beacon tracking accessed: %s (delayed: %s, UA: %s)",
+                                tracking_pixel_id, delayed, user_agent, event='beacon',
+                                tracking_pixel_id=tracking_pixel_id, delayed=delayed, user_agent=user_agent)
+        
+        agent_class = classify_user_agent(user_agent, request.headers.get('Sec-Purpose') or request.headers.get('Purpose'))
+        
+        # Beacons count as opens, same as track_open, and share its dedup window
+        if not open_dedup_cache.is_duplicate((tracking_pixel_id, agent_class)):
+            tracking_event_buffer.record(
+                'beacon',
+                tracking_pixel_id=tracking_pixel_id,
+                source='delayed' if delayed else 'js',
+                user_agent=user_agent,
+                ip_address=request.remote_addr,
+                agent_class=agent_class
+            )
         
         # Return minimal response with CORS headers to work in any email client
-        return jsonify({'status': 'ok'}), 200, {
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Access-Control-Allow-Origin': '*',
-            'Content-Type': 'application/json'
-        }
+        return beacon_response()
     
     except Exception as e:
-        app.logger.error(f"❌ Error tracking beacon: {str(e)}")
-        if conn:
-            try:
-                conn.rollback()
-            except:
-                pass
-        return jsonify({'status': 'error'}), 200  # Return 200 even on error to avoid JS errors
-    finally:
-        if conn:
-            conn.close()
+        logger.error("❌ Error tracking beacon: %s", e)
+        return beacon_response(BEACON_ERROR_BODY)  # Return 200 even on error to avoid JS errors
             
+# One-click unsubscribe (RFC 8058) - the List-Unsubscribe URL of every campaign email
+UNSUBSCRIBE_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Unsubscribe</title></head>
+<body style="font-family: Arial, sans-serif; text-align: center; padding: 40px;">{body}</body></html>"""
+
+@api.route('/unsubscribe/<tracking_id>', methods=['GET', 'POST'])
+@handle_transaction
+def unsubscribe(tracking_id):
+    """Suppress the recipient of a campaign email. GET only shows a confirmation form so that
+    link scanners following the URL don't unsubscribe anyone; mail clients POST directly."""
+    try:
+        tracking_id = str(uuid.UUID(tracking_id))
+    except ValueError:
+        return Response(UNSUBSCRIBE_PAGE.format(body='<p>This unsubscribe link is not valid.</p>'),
+                        status=404, mimetype='text/html')
+    
+    conn, cur = get_db_connection()
+    cur.execute("SELECT 1 FROM email_tracking WHERE tracking_id = %s", (tracking_id,))
+    if cur.fetchone() is None:
+        return Response(UNSUBSCRIBE_PAGE.format(body='<p>This unsubscribe link is not valid.</p>'),
+                        status=404, mimetype='text/html')
+    
+    if request.method == 'GET':
+        form = (f'<p>Unsubscribe from these emails?</p>'
+                f'<form method="post" action="{html.escape(request.path)}">'
+                f'<button type="submit">Unsubscribe</button></form>')
+        return Response(UNSUBSCRIBE_PAGE.format(body=form), status=200, mimetype='text/html')
+    
+    suppress_tracked_recipients(cur, [tracking_id], 'unsubscribed')
+    logger.info("🚫 Unsubscribed via %s", tracking_id)
+    return Response(UNSUBSCRIBE_PAGE.format(body='<p>You have been unsubscribed.</p>'),
+                    status=200, mimetype='text/html')
+
 # Manual Reply Marking Endpoint
-@app.route('/api/campaigns/<campaign_id>/mark-replied', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/mark-replied', methods=['POST'])
 @jwt_required()
 def mark_email_repliedd(campaign_id):
     """Manually mark an email as replied"""
@@ -2999,16 +5050,9 @@ def mark_email_repliedd(campaign_id):
             return jsonify({'message': 'Recipient ID is required'}), 400
         
         recipient_id = data['recipient_id']
-        app.logger.info(f"Attempting to mark recipient {recipient_id} as replied for campaign {campaign_id}")
+        logger.info(f"Attempting to mark recipient {recipient_id} as replied for campaign {campaign_id}")
         
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
         # Verify campaign belongs to user
         cur.execute("""
@@ -3019,27 +5063,35 @@ def mark_email_repliedd(campaign_id):
         if not cur.fetchone():
             return jsonify({'message': 'Campaign not found or access denied'}), 404
         
-        # Update tracking record
+        # Update tracking record; newly_replied is false if it was already marked (by hand or by
+        # the mailbox scan), so the reply is only counted once
         cur.execute("""
-            UPDATE email_tracking
+            UPDATE email_tracking et
             SET 
                 email_status = 'replied',
-                replied_at = COALESCE(replied_at, NOW()),
+                replied_at = COALESCE(et.replied_at, NOW()),
                 updated_at = NOW()
-            WHERE campaign_id = %s AND recipient_id = %s
-            RETURNING tracking_id, replied_at
+            FROM (
+                SELECT tracking_id, replied_at FROM email_tracking
+                WHERE campaign_id = %s AND recipient_id = %s
+                FOR UPDATE
+            ) previous
+            WHERE et.tracking_id = previous.tracking_id
+            RETURNING et.tracking_id, et.replied_at, previous.replied_at IS NULL AS newly_replied
         """, (campaign_id, recipient_id))
         
         result = cur.fetchone()
         
         if not result:
-            app.logger.warning(f"No tracking record found for recipient {recipient_id} in campaign {campaign_id}")
+            logger.warning(f"No tracking record found for recipient {recipient_id} in campaign {campaign_id}")
             return jsonify({'message': 'No tracking record found for this recipient'}), 404
         
         # Explicitly commit the transaction
         conn.commit()
+        if result['newly_replied']:
+            tracking_event_buffer.record('reply', tracking_id=str(result['tracking_id']), source='manual')
         
-        app.logger.info(f"Successfully marked recipient {recipient_id} as replied for campaign {campaign_id}")
+        logger.info(f"Successfully marked recipient {recipient_id} as replied for campaign {campaign_id}")
         
         return jsonify({
             'message': 'Email marked as replied successfully',
@@ -3048,7 +5100,7 @@ def mark_email_repliedd(campaign_id):
         }), 200
         
     except Exception as e:
-        app.logger.error(f"Error marking email as replied: {str(e)}")
+        logger.error(f"Error marking email as replied: {str(e)}")
         if conn:
             conn.rollback()
         return jsonify({'message': f'Error: {str(e)}'}), 500
@@ -3057,7 +5109,7 @@ def mark_email_repliedd(campaign_id):
             conn.close()
 
 # Dashboard routes
-@app.route('/api/dashboard', methods=['GET'])
+@api.route('/api/dashboard', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_dashboard_data():
@@ -3223,7 +5275,7 @@ def get_dashboard_data():
     return jsonify(result), 200
 
 # Utility and debugging routes
-@app.route('/api/auth-test', methods=['GET'])
+@api.route('/api/auth-test', methods=['GET'])
 @jwt_required()
 def auth_test():
     """Test endpoint that requires authentication"""
@@ -3235,7 +5287,85 @@ def auth_test():
         'timestamp': datetime.now().isoformat()
     }), 200
 
-@app.route('/api/health-check', methods=['GET'])
+# Health checks
+class CachedProbe:
+    """Run check() at most once per ttl seconds; concurrent callers share one run"""
+
+    def __init__(self, check, ttl=HEALTH_CACHE_SECONDS):
+        self.check = check
+        self.ttl = ttl
+        self._result = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.ttl:
+                self._result = self.check()
+                self._checked_at = time.monotonic()
+            return self._result
+
+def check_database():
+    started = time.perf_counter()
+    conn = None
+    try:
+        conn = db_pool.getconn(timeout=HEALTH_PROBE_TIMEOUT)
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        conn.rollback()
+        return {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 2), **db_pool.stats()}
+    except Exception as e:
+        return {'ok': False, 'error': str(e), **db_pool.stats()}
+    finally:
+        if conn is not None:
+            conn.close()
+
+def check_scheduler():
+    if scheduler is None:
+        return {'ok': True, 'running_here': False}
+    if not scheduler.running:
+        return {'ok': False, 'error': 'scheduler is not running'}
+    # A job whose next run is well in the past means the scheduler thread is stuck
+    now = datetime.now(timezone.utc)
+    overdue = [job.id for job in scheduler.get_jobs()
+               if job.next_run_time is not None and (now - job.next_run_time).total_seconds() > 60]
+    if overdue:
+        return {'ok': False, 'error': 'jobs overdue', 'jobs': overdue}
+    return {'ok': True, 'jobs': len(scheduler.get_jobs())}
+
+def check_event_buffer():
+    pending = tracking_event_buffer.pending()
+    return {'ok': pending <= HEALTH_MAX_EVENT_BACKLOG, 'pending': pending, 'limit': HEALTH_MAX_EVENT_BACKLOG}
+
+def run_readiness_checks():
+    checks = {
+        'database': check_database(),
+        'scheduler': check_scheduler(),
+        'event_buffer': check_event_buffer(),
+    }
+    return {
+        'status': 'ready' if all(check['ok'] for check in checks.values()) else 'unavailable',
+        'checks': checks,
+        'checked_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+readiness_probe = CachedProbe(run_readiness_checks)
+
+@api.route('/healthz/live', methods=['GET'])
+def healthz_live():
+    """Liveness: the process is up and serving requests, no dependencies are checked"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()}), 200
+
+@api.route('/healthz/ready', methods=['GET'])
+def healthz_ready():
+    """Readiness: database, scheduler and event buffer are healthy (cached for HEALTH_CACHE_SECONDS)"""
+    result = readiness_probe.get()
+    return jsonify(result), 200 if result['status'] == 'ready' else 503
+
+@api.route('/api/health-check', methods=['GET'])
 def health_check():
     """Health check endpoint that doesn't require authentication"""
     return jsonify({
@@ -3245,7 +5375,7 @@ def health_check():
     }), 200
 
 # Debugging endpoints
-@app.route('/api/debug/tracking/<campaign_id>', methods=['GET'])
+@api.route('/api/debug/tracking/<campaign_id>', methods=['GET'])
 @jwt_required()
 def debug_tracking(campaign_id):
     """Debug endpoint to directly query tracking data"""
@@ -3253,14 +5383,8 @@ def debug_tracking(campaign_id):
     conn = None
     
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn, cur = get_direct_db_connection()
         conn.autocommit = True
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         # Verify campaign belongs to user
         cur.execute("""
@@ -3315,9 +5439,10 @@ def debug_tracking(campaign_id):
         
         # Get URL tracking data too
         cur.execute("""
-            SELECT ut.* 
+            SELECT ut.*, COALESCE(cl.original_url, ut.original_url) AS original_url
             FROM url_tracking ut
             JOIN email_tracking et ON ut.tracking_id = et.tracking_id
+            LEFT JOIN campaign_links cl ON ut.link_id = cl.link_id
             WHERE et.campaign_id = %s
             ORDER BY ut.created_at DESC
         """, (campaign_id,))
@@ -3328,6 +5453,8 @@ def debug_tracking(campaign_id):
             # Format UUIDs
             data['url_tracking_id'] = str(data['url_tracking_id'])
             data['tracking_id'] = str(data['tracking_id'])
+            if data.get('link_id'):
+                data['link_id'] = str(data['link_id'])
             
             # Format dates
             for key in ['first_clicked_at', 'last_clicked_at', 'created_at']:
@@ -3353,7 +5480,17 @@ def debug_tracking(campaign_id):
         if conn:
             conn.close()
 
-@app.route('/api/debug/check-replies', methods=['GET'])
+@api.route('/api/debug/redirect-cache', methods=['GET'])
+@jwt_required()
+def redirect_cache_stats():
+    """Hit rate and redirect latency of this worker's click redirect cache"""
+    return jsonify({
+        **redirect_cache.stats(),
+        'pid': os.getpid(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@api.route('/api/debug/check-replies', methods=['GET'])
 @jwt_required()
 def trigger_reply_check():
     """Manually trigger the email reply check"""
@@ -3369,19 +5506,12 @@ def trigger_reply_check():
         'timestamp': datetime.now().isoformat()
     }), 200
 
-@app.route('/api/debug/track-open/<campaign_id>/<recipient_id>', methods=['GET'])
+@api.route('/api/debug/track-open/<campaign_id>/<recipient_id>', methods=['GET'])
 def debug_track_open(campaign_id, recipient_id):
     """Debug endpoint to manually trigger an open tracking event"""
     conn = None
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
         # Find tracking entry
         cur.execute("""
@@ -3427,19 +5557,12 @@ def debug_track_open(campaign_id, recipient_id):
         if conn:
             conn.close()
 
-@app.route('/api/debug/test-click/<tracking_id>', methods=['GET'])
+@api.route('/api/debug/test-click/<tracking_id>', methods=['GET'])
 def test_click(tracking_id):
     """Generate a test click for debugging"""
     conn = None
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
         # Create a test URL tracking entry
         cur.execute("""
@@ -3463,7 +5586,7 @@ def test_click(tracking_id):
         if conn:
             conn.close()
 
-@app.route('/api/campaigns/<campaign_id>/groups', methods=['GET'])
+@api.route('/api/campaigns/<campaign_id>/groups', methods=['GET'])
 @jwt_required()
 @handle_transaction
 def get_campaign_groups(campaign_id):
@@ -3508,7 +5631,7 @@ def get_campaign_groups(campaign_id):
     
     return jsonify(result), 200
 
-@app.route('/api/campaigns/<campaign_id>/groups', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/groups', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def add_groups_to_campaign(campaign_id):
@@ -3558,7 +5681,7 @@ def add_groups_to_campaign(campaign_id):
         'added_count': added_count
     }), 200
 
-@app.route('/api/campaigns/<campaign_id>/groups/remove', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/groups/remove', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def remove_groups_from_campaign(campaign_id):
@@ -3601,7 +5724,7 @@ def remove_groups_from_campaign(campaign_id):
         'removed_count': len(group_ids)
     }), 200
 
-@app.route('/api/campaigns/<campaign_id>/update', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/update', methods=['POST'])
 @jwt_required()
 @handle_transaction
 def update_campaign(campaign_id):
@@ -3683,16 +5806,20 @@ def update_campaign(campaign_id):
                     template_name = %s,
                     html_content = %s,
                     text_content = %s,
+                    compiled = %s,
+                    source_template_id = NULL,
                     updated_at = NOW()
                 WHERE template_id = %s
-            """, (template_name, html_content, text_content, template['template_id']))
+            """, (template_name, html_content, text_content, compiled_template_json(html_content),
+                  template['template_id']))
         else:
             # Create new template
             cur.execute("""
                 INSERT INTO email_templates
-                (user_id, campaign_id, template_name, html_content, text_content)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, campaign_id, template_name, html_content, text_content))
+                (user_id, campaign_id, template_name, html_content, text_content, compiled)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (user_id, campaign_id, template_name, html_content, text_content,
+                  compiled_template_json(html_content)))
     
     # Update recipients if provided
     if 'recipients' in data:
@@ -3749,7 +5876,7 @@ def update_campaign(campaign_id):
         'campaign_id': str(campaign_id)
     }), 200
 
-@app.route('/api/campaigns/<campaign_id>/recipients/<recipient_id>/replied', methods=['POST'])
+@api.route('/api/campaigns/<campaign_id>/recipients/<recipient_id>/replied', methods=['POST'])
 @jwt_required()
 def mark_email_replied(campaign_id, recipient_id):
     """Manually mark an email as replied"""
@@ -3757,16 +5884,9 @@ def mark_email_replied(campaign_id, recipient_id):
     conn = None
     
     try:
-        app.logger.info(f"Attempting to mark recipient {recipient_id} as replied for campaign {campaign_id}")
+        logger.info(f"Attempting to mark recipient {recipient_id} as replied for campaign {campaign_id}")
         
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
-        conn.autocommit = False
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn, cur = get_direct_db_connection()
         
         # Verify campaign belongs to user
         cur.execute("""
@@ -3777,27 +5897,35 @@ def mark_email_replied(campaign_id, recipient_id):
         if not cur.fetchone():
             return jsonify({'message': 'Campaign not found or access denied'}), 404
         
-        # Update tracking record
+        # Update tracking record; newly_replied is false if it was already marked (by hand or by
+        # the mailbox scan), so the reply is only counted once
         cur.execute("""
-            UPDATE email_tracking
+            UPDATE email_tracking et
             SET 
                 email_status = 'replied',
-                replied_at = COALESCE(replied_at, NOW()),
+                replied_at = COALESCE(et.replied_at, NOW()),
                 updated_at = NOW()
-            WHERE campaign_id = %s AND recipient_id = %s
-            RETURNING tracking_id, replied_at
+            FROM (
+                SELECT tracking_id, replied_at FROM email_tracking
+                WHERE campaign_id = %s AND recipient_id = %s
+                FOR UPDATE
+            ) previous
+            WHERE et.tracking_id = previous.tracking_id
+            RETURNING et.tracking_id, et.replied_at, previous.replied_at IS NULL AS newly_replied
         """, (campaign_id, recipient_id))
         
         result = cur.fetchone()
         
         if not result:
-            app.logger.warning(f"No tracking record found for recipient {recipient_id} in campaign {campaign_id}")
+            logger.warning(f"No tracking record found for recipient {recipient_id} in campaign {campaign_id}")
             return jsonify({'message': 'No tracking record found for this recipient'}), 404
         
         # Explicitly commit the transaction
         conn.commit()
+        if result['newly_replied']:
+            tracking_event_buffer.record('reply', tracking_id=str(result['tracking_id']), source='manual')
         
-        app.logger.info(f"Successfully marked recipient {recipient_id} as replied for campaign {campaign_id}")
+        logger.info(f"Successfully marked recipient {recipient_id} as replied for campaign {campaign_id}")
         
         return jsonify({
             'message': 'Email marked as replied successfully',
@@ -3806,7 +5934,7 @@ def mark_email_replied(campaign_id, recipient_id):
         }), 200
         
     except Exception as e:
-        app.logger.error(f"Error marking email as replied: {str(e)}")
+        logger.error(f"Error marking email as replied: {str(e)}")
         if conn:
             conn.rollback()
         return jsonify({'message': f'Error: {str(e)}'}), 500
@@ -3815,35 +5943,162 @@ def mark_email_replied(campaign_id, recipient_id):
             conn.close()
 
 # Error handlers
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({
         'status': 'error',
         'message': 'The requested URL was not found on the server.'
     }), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({
         'status': 'error',
         'message': 'An internal server error occurred.',
-        'details': str(error) if app.debug else None
+        'details': str(error) if current_app.debug else None
     }), 500
 
 # Request logging middleware
-@app.before_request
+@api.before_app_request
 def log_request_info():
-    if app.debug:
-        app.logger.debug('Headers: %s', request.headers)
-        app.logger.debug('Body: %s', request.get_data())
+    if current_app.debug:
+        logger.debug('Headers: %s', request.headers)
+        logger.debug('Body: %s', request.get_data())
 
-@app.after_request
+@api.after_app_request
 def log_response_info(response):
-    if app.debug and response.content_type == 'application/json':
-        app.logger.debug('Response: %s', response.get_data())
+    if current_app.debug and response.content_type == 'application/json':
+        logger.debug('Response: %s', response.get_data())
+    return response
+
+# SQL timing middleware
+@api.before_app_request
+def start_sql_stats():
+    if SQL_INSTRUMENTATION:
+        g.sql_stats = _sql_scope.stats = SqlStats(f"{request.method} {request.path}")
+
+@api.after_app_request
+def report_sql_stats(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+    elapsed_ms = stats.elapsed_ms()
+    response.headers['Server-Timing'] = (f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+                                         f'app;dur={elapsed_ms:.1f}')
+    response.headers['Timing-Allow-Origin'] = '*'
+    if elapsed_ms >= SLOW_REQUEST_MS:
+        logger.warning("🐢 Slow request %s -> %s: %.0fms, %s", stats.label, response.status_code, elapsed_ms,
+                       stats.summary(), extra={'event': 'slow_request', 'route': stats.label})
     return response
 
+@api.teardown_app_request
+def clear_sql_stats(exception):
+    _sql_scope.stats = None
+
+# Request metrics middleware - the route label is the endpoint name, so recording is a
+# lookup of an existing child plus a locked add (nothing is formatted per request)
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.endpoint or 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
+        HTTP_RESPONSES.labels(route, STATUS_CLASSES[min(response.status_code // 100, 5)]).inc()
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of this process's metrics"""
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get('Authorization', ''),
+                                                    f"Bearer {METRICS_TOKEN}"):
+        return jsonify({'message': 'Unauthorized'}), 401
+    return Response(METRICS_REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Application factory
+_default_app = None
+_default_app_lock = threading.RLock()
+
+def create_app(config=None):
+    """Build the Flask app. `config` overrides app.config, e.g. {'INIT_DB': False} in tests."""
+    configure_logging()
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = JWT_ACCESS_TOKEN_EXPIRES
+    app.config['INIT_DB'] = INIT_DB
+    app.config.update(config or {})
+
+    # Configure CORS to allow cross-origin requests
+    CORS(app, 
+         resources={r"/*": {"origins": "*"}},
+         supports_credentials=True,
+         allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin"],
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         expose_headers=["Content-Type", "Authorization"])
+    jwt.init_app(app)
+    app.register_blueprint(api)
+    app.teardown_appcontext(close_db_connection)
+
+    if app.config['JWT_SECRET_KEY'] == generated_key:
+        logger.warning("JWT_SECRET_KEY is not set, using a generated key; tokens won't survive a restart",
+                       extra={'event': 'jwt_key_generated'})
+
+    # Initialize database tables on app startup
+    if app.config['INIT_DB']:
+        with app.app_context():
+            init_db()
+
+    # Background sends run in the first app built in this process
+    global _default_app
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = app
+    return app
+
+def get_app():
+    """The process-wide app, created with the default config on first use"""
+    if _default_app is None:
+        with _default_app_lock:
+            if _default_app is None:
+                create_app()
+    return _default_app
+
+def __getattr__(name):
+    # `app.app` (gunicorn app:app, scripts) builds the default app lazily
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Main entry point
+def main(argv=None):
+    """python app.py [all|web|worker|scheduler]"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Email tracker backend")
+    parser.add_argument('role', nargs='?', default='all', choices=['all', 'web', 'worker', 'scheduler'],
+                        help="all = API + scheduler in one process (development)")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '5000')))
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if args.role == 'scheduler':
+        start_scheduler(blocking=True)
+    elif args.role == 'worker':
+        get_app()
+        recover_interrupted_sends()
+        run_send_worker()
+    else:
+        app = get_app()
+        if not args.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            recover_interrupted_sends()
+        # With the reloader the module runs twice; only the serving child starts the scheduler
+        if args.role == 'all' and (not args.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+            start_scheduler()
+        # Set debug to False in production!
+        app.run(debug=args.debug, port=args.port)
+
 if __name__ == '__main__':
-    # Set debug to False in production!
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,142 @@
+# benchmarks/bench_audience.py
+"""Audience resolution benchmark: enqueue_campaign_recipients with and without suppressions.
+
+Seeds one user with a group of `--recipients` recipients, a campaign sent to that
+group and `--suppressed` suppressed addresses (a random subset of the group plus as
+many addresses outside it), then fills the campaign outbox, rolling back to a savepoint after every
+run:
+
+    python benchmarks/bench_audience.py --recipients 1000000 --suppressed 50000
+
+Reported as JSON: best-of-`--repeat` seconds for an empty suppression list and for the
+seeded one, the rows queued by each, and the plan of the suppressed run from EXPLAIN
+(ANALYZE). Everything happens in one transaction that is rolled back at the end, unless
+--keep is given, so nothing has to be deleted afterwards. Connection
+settings come from the same DB_* variables as app.py.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+import psycopg2
+import psycopg2.extensions
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from fixtures import COMPANIES, DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, FIRST_NAMES, copy_rows  # noqa: E402
+
+
+def seed_audience(conn, recipients, seed):
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    run = uuid.uuid4().hex[:8]
+    user_id, group_id, campaign_id = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    cur.execute("INSERT INTO users (user_id, email, password_hash, full_name) VALUES (%s, %s, 'x', 'Bench Audience')",
+                (user_id, f"bench-audience-{run}@example.invalid"))
+    cur.execute("INSERT INTO groups (group_id, user_id, name) VALUES (%s, %s, %s)",
+                (group_id, user_id, f"Audience bench {run}"))
+    cur.execute("""
+        INSERT INTO email_campaigns
+        (campaign_id, user_id, campaign_name, subject_line, from_name, from_email, reply_to_email, status)
+        VALUES (%s, %s, %s, 'Hello', 'Bench', 'bench@example.invalid', 'bench@example.invalid', 'draft')
+    """, (campaign_id, user_id, f"Audience bench {run}"))
+    cur.execute("INSERT INTO campaign_groups (campaign_id, group_id) VALUES (%s, %s)", (campaign_id, group_id))
+    # Mixed case on purpose - suppressions are stored lowercased and matched on lower(email)
+    emails = [f"R{i}.{run}@Example.invalid" for i in range(recipients)]
+    copy_rows(cur, 'recipients', [(str(uuid.uuid4()), user_id, group_id, email, rng.choice(FIRST_NAMES),
+                                   rng.choice(COMPANIES)) for email in emails],
+              columns=('recipient_id', 'user_id', 'group_id', 'email', 'first_name', 'company'))
+    cur.execute("ANALYZE recipients")
+    return user_id, campaign_id, emails
+
+
+def seed_suppressions(cur, user_id, emails, count, seed):
+    rng = random.Random(seed)
+    inside = rng.sample(emails, min(count // 2, len(emails)))
+    outside = [f"elsewhere{i}@example.invalid" for i in range(count - len(inside))]
+    copy_rows(cur, 'suppressions', [(user_id, email.lower(), 'unsubscribed') for email in inside + outside],
+              columns=('user_id', 'email', 'reason'))
+    cur.execute("ANALYZE suppressions")
+    return len(inside)
+
+
+def time_enqueue(cur, tracker, campaign_id):
+    cur.execute("SAVEPOINT enqueue")
+    started = time.perf_counter()
+    queued = tracker.enqueue_campaign_recipients(cur, campaign_id)
+    elapsed = time.perf_counter() - started
+    cur.execute("ROLLBACK TO SAVEPOINT enqueue")
+    return elapsed, queued
+
+
+class ExplainCursor(psycopg2.extensions.cursor):
+    """Runs every statement under EXPLAIN ANALYZE, so the plan can be fetched afterwards"""
+
+    def execute(self, query, vars=None):
+        return super().execute("EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF) " + query, vars)
+
+
+def explain_enqueue(conn, tracker, campaign_id):
+    conn.cursor().execute("SAVEPOINT enqueue")
+    cur = conn.cursor(cursor_factory=ExplainCursor)
+    tracker.enqueue_campaign_recipients(cur, campaign_id)
+    plan = [row[0] for row in cur.fetchall()]
+    conn.cursor().execute("ROLLBACK TO SAVEPOINT enqueue")
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=100_000)
+    parser.add_argument('--suppressed', type=int, default=10_000, help='suppressed addresses, half of them in the audience')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='commit the seeded rows instead of rolling back')
+    args = parser.parse_args()
+
+    import app as tracker
+
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+    started = time.perf_counter()
+    user_id, campaign_id, emails = seed_audience(conn, args.recipients, args.seed)
+    seed_seconds = time.perf_counter() - started
+
+    try:
+        # Alternate the two cases so both see the same table and index bloat from earlier runs
+        cur = conn.cursor()
+        timings = {'without_suppressions': [], 'with_suppressions': []}
+        for _ in range(args.repeat):
+            timings['without_suppressions'].append(time_enqueue(cur, tracker, campaign_id))
+            cur.execute("SAVEPOINT suppressions")
+            in_audience = seed_suppressions(cur, user_id, emails, args.suppressed, args.seed)
+            timings['with_suppressions'].append(time_enqueue(cur, tracker, campaign_id))
+            if len(timings['with_suppressions']) < args.repeat:
+                cur.execute("ROLLBACK TO SAVEPOINT suppressions")
+        plan = explain_enqueue(conn, tracker, campaign_id)
+    finally:
+        if args.keep:
+            conn.commit()
+        else:
+            conn.rollback()
+        conn.close()
+
+    print(json.dumps({
+        'config': {'recipients': args.recipients, 'suppressed': args.suppressed, 'repeat': args.repeat,
+                   'seed': args.seed},
+        'campaign_id': campaign_id,
+        'seed_seconds': round(seed_seconds, 1),
+        'suppressed_in_audience': in_audience,
+        **{case: {'seconds': round(min(runs)[0], 3), 'queued': runs[0][1]} for case, runs in timings.items()},
+        'suppression_overhead': round(min(timings['with_suppressions'])[0] / min(timings['without_suppressions'])[0] - 1, 3),
+        'plan': plan,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
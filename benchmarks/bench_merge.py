@@ -0,0 +1,119 @@
+# benchmarks/bench_merge.py
+"""Merge-tag benchmark: per-recipient personalization cost as the number of merge fields grows.
+
+Builds an HTML template of about `--template-kb` KB with N distinct merge fields
+(first_name, last_name, company, position, then custom_fields keys) spread through it,
+for each N in `--fields`, and renders it for `--recipients` synthetic recipients two ways:
+
+    replace   one str.replace over the whole template per field, the old send loop approach
+    compiled  app.MergeTemplate, tokenized once per template and rendered in one pass
+
+    python benchmarks/bench_merge.py --fields 1 2 4 8 16 32 64 --template-kb 20
+
+Reported as JSON: microseconds per recipient for each approach and N, plus the
+one-off compile time. No database or SMTP server is needed.
+"""
+import argparse
+import html
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import MergeTemplate  # noqa: E402
+
+COLUMNS = ('first_name', 'last_name', 'company', 'position')
+FILLER = ('<p style="font-family: Arial, sans-serif; font-size: 14px; color: #333333;">'
+          'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut '
+          'labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation.</p>')
+
+
+def field_names(count):
+    return list(COLUMNS[:count]) + [f"field_{i}" for i in range(max(0, count - len(COLUMNS)))]
+
+
+def build_template(fields, template_kb, rng):
+    paragraphs = [FILLER] * max(1, template_kb * 1024 // len(FILLER))
+    for name in fields:
+        tag = '{{' + name + '}}' if name in COLUMNS else '{{custom_fields.' + name + '}}'
+        paragraphs.insert(rng.randrange(len(paragraphs) + 1), f'<p>{name}: {tag}</p>')
+    return '<html>\n<body>\n' + '\n'.join(paragraphs) + '\n</body>\n</html>'
+
+
+def build_recipients(fields, count, rng):
+    recipients = []
+    for i in range(count):
+        recipient = {'email': f"r{i}@example.invalid", 'custom_fields': {}}
+        for name in fields:
+            value = f"{name}-{rng.randrange(10_000)}"
+            if name in COLUMNS:
+                recipient[name] = value
+            else:
+                recipient['custom_fields'][name] = value
+        recipients.append(recipient)
+    return recipients
+
+
+def render_replace(template, fields, recipient):
+    """The old approach generalized to every field: one full scan of the template per field"""
+    content = template
+    for name in fields:
+        if name in COLUMNS:
+            content = content.replace('{{' + name + '}}', html.escape(recipient[name]))
+        else:
+            content = content.replace('{{custom_fields.' + name + '}}', html.escape(recipient['custom_fields'][name]))
+    return content
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fields', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--template-kb', type=int, default=20)
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many runs')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.fields:
+        rng = random.Random(args.seed)
+        fields = field_names(count)
+        template = build_template(fields, args.template_kb, rng)
+        recipients = build_recipients(fields, args.recipients, rng)
+
+        compile_seconds = best_of(args.repeat, lambda: MergeTemplate(template, escape=html.escape))
+        compiled = MergeTemplate(template, escape=html.escape)
+        assert compiled.render(recipients[0]) == render_replace(template, fields, recipients[0])
+
+        replace_seconds = best_of(args.repeat, lambda: [render_replace(template, fields, r) for r in recipients])
+        compiled_seconds = best_of(args.repeat, lambda: [compiled.render(r) for r in recipients])
+        rows.append({
+            'fields': count,
+            'template_bytes': len(template),
+            'compile_us': round(compile_seconds * 1e6, 1),
+            'replace_us_per_recipient': round(replace_seconds / args.recipients * 1e6, 2),
+            'compiled_us_per_recipient': round(compiled_seconds / args.recipients * 1e6, 2),
+        })
+
+    print(json.dumps({
+        'config': {'template_kb': args.template_kb, 'recipients': args.recipients, 'repeat': args.repeat,
+                   'seed': args.seed},
+        'results': rows,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
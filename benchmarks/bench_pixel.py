@@ -0,0 +1,92 @@
+# benchmarks/bench_pixel.py
+"""Requests/sec for a single worker on the tracking pixel and beacon routes.
+
+The database write path (TrackingEventBuffer flushing) is stubbed out, so this
+measures only what the web worker does per hit: routing, dedup, classification,
+queuing the event and building the response. Requests are dispatched straight
+into the WSGI app in this process, one at a time, like a single sync worker.
+
+    python benchmarks/bench_pixel.py --requests 50000
+    python benchmarks/bench_pixel.py --route beacon --unique-pixels 1000
+
+Importing app doesn't touch the database; tracker.app builds the app and runs
+init_db unless INIT_DB is false. With INIT_DB=false no database is needed:
+
+    INIT_DB=false python benchmarks/bench_pixel.py --requests 3000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as tracker  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(route, requests, unique_pixels, user_agent):
+    # Stub the DB write path: events are still queued, flushes just discard them
+    tracker.write_tracking_events = lambda events: None
+
+    pixel_ids = [str(uuid.uuid4()) for _ in range(unique_pixels)]
+    path = '/track/open/{}' if route == 'open' else '/track/beacon/{}'
+    environs = [
+        EnvironBuilder(path=path.format(pixel_id), headers={'User-Agent': user_agent}).get_environ()
+        for pixel_id in pixel_ids
+    ]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    wsgi_app = tracker.app.wsgi_app
+    latencies = []
+    started = time.perf_counter()
+    for i in range(requests):
+        environ = dict(environs[i % unique_pixels])
+        t0 = time.perf_counter()
+        body = wsgi_app(environ, start_response)
+        b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    tracker.tracking_event_buffer.flush()
+
+    latencies.sort()
+    return {
+        'route': route,
+        'requests': requests,
+        'unique_pixels': unique_pixels,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(requests / elapsed, 1),
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p95_us': round(percentile(latencies, 95) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--route', choices=['open', 'beacon'], default='open')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--unique-pixels', type=int, default=20000,
+                        help='distinct pixel ids to cycle through (fewer ids = more dedup hits)')
+    parser.add_argument('--user-agent', default='Mozilla/5.0 (Windows NT 10.0; Win64; x64) Thunderbird/115.0')
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.route, args.requests, args.unique_pixels, args.user_agent), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# benchmarks/bench_send.py
+"""End-to-end send benchmark: send_email_async against a local SMTP sink.
+
+Seeds a campaign with `--recipients` recipients and a template with `--links` tracked
+links padded to about `--template-kb` KB, starts an aiosmtpd sink on a free local port,
+points app.py at it (no TLS, no login) and runs send_email_async for the campaign in
+this thread:
+
+    pip install aiosmtpd
+    python benchmarks/bench_send.py --recipients 2000 --links 5 --template-kb 20
+
+Reported as JSON: messages/sec, CPU and wall time split into rendering (merge tags,
+link rewriting and tracking elements), MIME building (encoding headers and bodies to bytes),
+SMTP, DB and other, peak RSS, and DB statements per message. The CPU split is
+exclusive time of this thread (time.thread_time), so waiting on the SMTP server or
+Postgres shows up in the wall split only. Connection settings come from the same
+DB_* variables as app.py.
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+import uuid
+
+import psycopg2
+import psycopg2.extensions
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from fixtures import (  # noqa: E402
+    COMPANIES, DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, FIRST_NAMES, LAST_NAMES, copy_rows,
+)
+
+PHASES = ('rendering', 'mime', 'smtp', 'db', 'other')
+
+
+class PhaseTimer:
+    """Exclusive CPU and wall time per phase for the thread running the send"""
+
+    def __init__(self):
+        self.cpu = dict.fromkeys(PHASES, 0.0)
+        self.wall = dict.fromkeys(PHASES, 0.0)
+        self.thread = None
+        self._stack = ['other']
+        self._last = None
+
+    def start(self):
+        self.thread = threading.current_thread()
+        self._last = (time.thread_time(), time.perf_counter())
+
+    def _switch(self):
+        cpu, wall = time.thread_time(), time.perf_counter()
+        phase = self._stack[-1]
+        self.cpu[phase] += cpu - self._last[0]
+        self.wall[phase] += wall - self._last[1]
+        self._last = (cpu, wall)
+
+    def enter(self, phase):
+        if threading.current_thread() is not self.thread:
+            return False
+        self._switch()
+        self._stack.append(phase)
+        return True
+
+    def leave(self):
+        self._switch()
+        self._stack.pop()
+
+    def stop(self):
+        self._switch()
+
+
+timer = PhaseTimer()
+statements = {'count': 0}
+
+
+def timed(phase, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not timer.enter(phase):
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timer.leave()
+    return wrapper
+
+
+_timed_cursor_classes = {}
+
+
+def timed_cursor_class(base):
+    if base not in _timed_cursor_classes:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                if timer.thread is threading.current_thread():
+                    statements['count'] += 1
+                return timed('db', super().execute)(query, vars)
+
+        _timed_cursor_classes[base] = TimedCursor
+    return _timed_cursor_classes[base]
+
+
+class TimedConnectionMixin:
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        return timed('db', super().commit)()
+
+    def rollback(self):
+        return timed('db', super().rollback)()
+
+
+class TimedConnection(TimedConnectionMixin, psycopg2.extensions.connection):
+    pass
+
+
+class Sink:
+    """aiosmtpd handler that accepts and discards everything"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        self.bytes += len(envelope.content)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build_template(links, template_kb, rng):
+    paragraphs = ['<p>Hi {{first_name}},</p>']
+    for i in range(links):
+        paragraphs.append(f'<p>Read more about <a href="https://example.com/offer/{i}?utm_source=email">offer {i}</a>.</p>')
+    filler = ('<p style="font-family: Arial, sans-serif; font-size: 14px; color: #333333;">'
+              'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut '
+              'labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation.</p>')
+    html = '\n'.join(paragraphs)
+    while len(html) < template_kb * 1024:
+        position = rng.randrange(1, len(paragraphs) + 1)
+        paragraphs.insert(position, filler)
+        html = '\n'.join(paragraphs)
+    body = '<html>\n<body>\n<table width="600"><tr><td>\n' + html + '\n</td></tr></table>\n</body>\n</html>'
+    text = 'Hi {{first_name}},\n\n' + '\n'.join(f'https://example.com/offer/{i}' for i in range(links))
+    return body, text
+
+
+def seed_campaign(conn, recipients, links, template_kb, seed):
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    run = uuid.uuid4().hex[:8]
+    user_id, campaign_id = str(uuid.uuid4()), str(uuid.uuid4())
+    cur.execute("INSERT INTO users (user_id, email, password_hash, full_name) VALUES (%s, %s, 'x', 'Bench Sender')",
+                (user_id, f"bench-send-{run}@example.invalid"))
+    cur.execute("""
+        INSERT INTO email_campaigns
+        (campaign_id, user_id, campaign_name, subject_line, from_name, from_email, reply_to_email, status)
+        VALUES (%s, %s, %s, 'Hello {{first_name}}', 'Bench', 'bench@example.invalid', 'bench@example.invalid', 'draft')
+    """, (campaign_id, user_id, f"Send bench {run}"))
+    html_content, text_content = build_template(links, template_kb, rng)
+    cur.execute("""
+        INSERT INTO email_templates (user_id, campaign_id, template_name, html_content, text_content)
+        VALUES (%s, %s, 'bench', %s, %s)
+    """, (user_id, campaign_id, html_content, text_content))
+    recipient_rows = [(str(uuid.uuid4()), user_id, f"r{i}.{run}@example.invalid", rng.choice(FIRST_NAMES),
+                       rng.choice(LAST_NAMES), rng.choice(COMPANIES)) for i in range(recipients)]
+    copy_rows(cur, 'recipients', recipient_rows)
+    copy_rows(cur, 'campaign_recipients', [(campaign_id, row[0]) for row in recipient_rows])
+    conn.commit()
+    return campaign_id, len(html_content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--links', type=int, default=5, help='tracked links in the template')
+    parser.add_argument('--template-kb', type=int, default=10, help='approximate HTML size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='WARNING', help="app log level during the send")
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        sys.exit("bench_send.py needs aiosmtpd: pip install aiosmtpd")
+
+    sink = Sink()
+    port = free_port()
+    controller = Controller(sink, hostname='127.0.0.1', port=port)
+    controller.start()
+
+    # app.py reads its SMTP settings at import time
+    os.environ.update({'SMTP_SERVER': '127.0.0.1', 'SMTP_PORT': str(port), 'SMTP_USE_TLS': 'false',
+                       'SMTP_USERNAME': '', 'SMTP_PASSWORD': ''})
+    import smtplib
+    import app as tracker
+
+    # app.py checks connections out of its pool; make new ones timed and drop the untimed ones
+    tracker.db_pool.connection_class = type('TimedPooledConnection', (TimedConnectionMixin, tracker.PooledConnection), {})
+    tracker.db_pool.close_idle()
+    tracker.app.logger.setLevel(args.log_level)
+    tracker.MergeTemplate.render = timed('rendering', tracker.MergeTemplate.render)
+    tracker.rewrite_links = timed('rendering', tracker.rewrite_links)
+    tracker.add_tracking_elements = timed('rendering', tracker.add_tracking_elements)
+    tracker.CampaignMessage.__init__ = timed('mime', tracker.CampaignMessage.__init__)
+    tracker.CampaignMessage.build = timed('mime', tracker.CampaignMessage.build)
+    smtplib.SMTP.sendmail = timed('smtp', smtplib.SMTP.sendmail)
+    psycopg2.connect = timed('db', psycopg2.connect)
+
+    conn = psycopg2.connect(connection_factory=TimedConnection, host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+    campaign_id, html_bytes = seed_campaign(conn, args.recipients, args.links, args.template_kb, args.seed)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timer.start()
+    started = time.perf_counter()
+    tracker.send_email_async(campaign_id, base_url='http://localhost:5000/')
+    elapsed = time.perf_counter() - started
+    timer.stop()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The sink handles DATA on its own loop; give it a moment to finish the last message
+    deadline = time.monotonic() + 5
+    while sink.messages < args.recipients and time.monotonic() < deadline:
+        time.sleep(0.05)
+    controller.stop()
+
+    cur = conn.cursor()
+    cur.execute("SELECT email_status, COUNT(*) FROM email_tracking WHERE campaign_id = %s GROUP BY email_status",
+                (campaign_id,))
+    statuses = dict(cur.fetchall())
+    conn.close()
+
+    cpu_total = sum(timer.cpu.values())
+    print(json.dumps({
+        'config': {
+            'recipients': args.recipients,
+            'links': args.links,
+            'template_bytes': html_bytes,
+            'seed': args.seed,
+        },
+        'campaign_id': campaign_id,
+        'messages_received': sink.messages,
+        'bytes_received': sink.bytes,
+        'tracking_statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(sink.messages / elapsed, 1) if elapsed else None,
+        'cpu_seconds': {phase: round(seconds, 3) for phase, seconds in timer.cpu.items()},
+        'cpu_share': {phase: round(seconds / cpu_total, 3) for phase, seconds in timer.cpu.items()} if cpu_total else None,
+        'wall_seconds': {phase: round(seconds, 3) for phase, seconds in timer.wall.items()},
+        'peak_rss_mb': round(rss_peak / 1024, 1),
+        'rss_growth_mb': round((rss_peak - rss_before) / 1024, 1),
+        'db_statements': statements['count'],
+        'db_statements_per_message': round(statements['count'] / sink.messages, 2) if sink.messages else None,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# benchmarks/bench_startup.py
+"""Startup benchmark: how long `import app` and create_app() take in a fresh interpreter.
+
+Each run starts a new Python process that imports app.py, then (when app.py has a
+create_app factory) builds the app, and reports wall time for each step, the
+threads alive afterwards and which heavy modules got loaded:
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --runs 10 --no-init-db   # skip the schema check
+
+Reported as JSON with the median/min/max per step and the slowest imports by
+cumulative time from `python -X importtime`. Connection settings come from the
+same DB_* variables as app.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ('bs4', 'smtplib', 'imaplib', 'email.mime.multipart', 'apscheduler.schedulers.background')
+
+CHILD = r"""
+import json, sys, threading, time
+init_db = sys.argv[1] == '1'
+heavy = sys.argv[2].split(',')
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+result = {
+    'import_ms': (imported - started) * 1000,
+    'threads_after_import': sorted(t.name for t in threading.enumerate() if t is not threading.main_thread()),
+    'heavy_after_import': [m for m in heavy if m in sys.modules],
+}
+if hasattr(app, 'create_app'):
+    app.create_app({'INIT_DB': init_db})
+    result['create_app_ms'] = (time.perf_counter() - imported) * 1000
+    result['threads_after_create_app'] = sorted(t.name for t in threading.enumerate()
+                                                if t is not threading.main_thread())
+print(json.dumps(result))
+"""
+
+
+def summarize(values):
+    return {'median': round(statistics.median(values), 1), 'min': round(min(values), 1),
+            'max': round(max(values), 1)}
+
+
+def slowest_imports(limit):
+    """Top modules by cumulative import time for `import app`, from -X importtime"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=REPO_DIR,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nesting is shown by indentation; only keep modules imported directly or one level down
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{'module': name, 'cumulative_ms': round(cumulative / 1000, 1)} for cumulative, name in rows[:limit]]
+
+
+def commit_hash():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--no-init-db', action='store_true', help="pass INIT_DB=False to create_app")
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to report')
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        proc = subprocess.run([sys.executable, '-c', CHILD, '0' if args.no_init_db else '1', ','.join(HEAVY_MODULES)],
+                              cwd=REPO_DIR, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.exit(proc.stderr)
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'commit': commit_hash(),
+        'runs': args.runs,
+        'init_db': not args.no_init_db,
+        'import_ms': summarize([run['import_ms'] for run in runs]),
+        'threads_after_import': runs[-1]['threads_after_import'],
+        'heavy_modules_after_import': runs[-1]['heavy_after_import'],
+    }
+    if 'create_app_ms' in runs[-1]:
+        report['create_app_ms'] = summarize([run['create_app_ms'] for run in runs])
+        report['threads_after_create_app'] = runs[-1]['threads_after_create_app']
+    report['slowest_imports'] = slowest_imports(args.top)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
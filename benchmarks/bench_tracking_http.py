@@ -0,0 +1,115 @@
+# benchmarks/bench_tracking_http.py
+"""HTTP load test for the tracking routes: Flask app vs the standalone ASGI service.
+
+Opens `--concurrency` keep-alive connections to each target and fires GETs at
+/track/open (or /track/beacon) with random pixel ids until `--requests` have
+completed. Unknown pixel ids are accepted by both servers and dropped when the
+batch is written, so the database only sees the batched insert. Start the servers
+first, e.g.
+
+    gunicorn -w 4 -b 127.0.0.1:5000 app:app
+    uvicorn tracking_service:app --host 127.0.0.1 --port 5001 --workers 4 --no-access-log
+
+    python benchmarks/bench_tracking_http.py \\
+        --target flask=http://127.0.0.1:5000 --target asgi=http://127.0.0.1:5001
+
+Prints requests/sec and latency percentiles per target as JSON. Only the stdlib is used.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, return its status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('server closed the connection')
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            content_length = int(value.strip())
+    if content_length:
+        await reader.readexactly(content_length)
+    return int(status_line.split()[1])
+
+
+async def worker(host, port, path_template, counter, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while counter[0] > 0:
+            counter[0] -= 1
+            path = path_template.format(uuid.uuid4())
+            request = (f'GET {path} HTTP/1.1\r\nHost: {host}\r\n'
+                       'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) Thunderbird/115.0\r\n\r\n')
+            t0 = time.perf_counter()
+            writer.write(request.encode())
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_target(name, base_url, route, requests, concurrency):
+    parts = urlsplit(base_url)
+    path_template = parts.path.rstrip('/') + f'/track/{route}/{{}}'
+    counter = [requests]
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(parts.hostname, parts.port or 80, path_template, counter, latencies, statuses)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'target': name,
+        'url': base_url,
+        'route': route,
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', action='append', required=True,
+                        help='name=base_url, may be given several times')
+    parser.add_argument('--route', choices=['open', 'beacon'], default='open')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    results = []
+    for target in args.target:
+        name, _, base_url = target.partition('=')
+        if not base_url:
+            base_url = name
+        results.append(asyncio.run(run_target(name, base_url, args.route, args.requests, args.concurrency)))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# benchmarks/fixtures.py
+"""Seed a local Postgres with synthetic users, campaigns, recipients and tracking rows.
+
+Everything is generated from a seeded RNG (ids included) and loaded with COPY, so the
+same arguments always produce the same rows and the same manifest:
+
+    python benchmarks/fixtures.py --users 10 --campaigns 5 --recipients 20000 --links 3 \\
+        --seed 42 --manifest /tmp/tracking_fixtures.tsv
+
+Each user gets `--recipients` recipients and `--campaigns` sent campaigns addressed to
+all of them, with `--links` tracked links per email. The manifest has one line per
+sent email, `campaign_id  tracking_id  tracking_pixel_id  url_tracking_id[,...]`, and is
+what benchmarks/load_tracking.py replays.
+
+If the fixture set for a seed is already loaded, only the manifest is rewritten; pass
+--reset to delete and reload it. Connection settings come from the same DB_* variables
+as app.py.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+import psycopg2
+
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_PORT = os.environ.get('DB_PORT', '5432')
+DB_NAME = os.environ.get('DB_NAME', 'email_app')
+DB_USER = os.environ.get('DB_USER', 'postgres')
+DB_PASS = os.environ.get('DB_PASS', 'Admin@123')
+
+BASE_URL = 'http://localhost:5000/'
+
+COPY_COLUMNS = {
+    'users': ('user_id', 'email', 'password_hash', 'full_name'),
+    'email_campaigns': ('campaign_id', 'user_id', 'campaign_name', 'subject_line', 'from_name', 'from_email',
+                        'reply_to_email', 'sent_at', 'status'),
+    'recipients': ('recipient_id', 'user_id', 'email', 'first_name', 'last_name', 'company'),
+    'campaign_recipients': ('campaign_id', 'recipient_id'),
+    'campaign_links': ('link_id', 'campaign_id', 'original_url'),
+    'email_tracking': ('tracking_id', 'campaign_id', 'recipient_id', 'email_status', 'sent_at', 'tracking_pixel_id'),
+    'url_tracking': ('url_tracking_id', 'tracking_id', 'link_id', 'tracking_url'),
+}
+
+FIRST_NAMES = ('Ava', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jon', 'Kira', 'Liam')
+LAST_NAMES = ('Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Gupta', 'Hughes', 'Ito', 'Jensen')
+COMPANIES = ('Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Vandelay', 'Stark', 'Wayne')
+
+
+def user_email(seed, index):
+    return f"bench-{seed}-{index}@example.invalid"
+
+
+def generate(seed, users, campaigns, recipients, links):
+    """Yield (table_rows, manifest_lines) per user. table_rows maps table name -> list of tuples."""
+    rng = random.Random(seed)
+
+    def new_id():
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    sent_at = '2024-01-01 09:00:00+00'
+    for u in range(users):
+        rows = {table: [] for table in COPY_COLUMNS}
+        manifest = []
+        user_id = new_id()
+        rows['users'].append((user_id, user_email(seed, u), 'x', f"Bench User {u}"))
+
+        recipient_ids = []
+        for r in range(recipients):
+            recipient_id = new_id()
+            recipient_ids.append(recipient_id)
+            rows['recipients'].append((recipient_id, user_id, f"r{r}.u{u}.s{seed}@example.invalid",
+                                       rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(COMPANIES)))
+
+        for c in range(campaigns):
+            campaign_id = new_id()
+            rows['email_campaigns'].append((campaign_id, user_id, f"Bench campaign {u}-{c}", 'Hello {{first_name}}',
+                                            'Bench', 'bench@example.invalid', 'bench@example.invalid', sent_at,
+                                            'completed'))
+            link_ids = []
+            for l in range(links):
+                link_id = new_id()
+                link_ids.append(link_id)
+                rows['campaign_links'].append((link_id, campaign_id, f"https://example.com/{c}/link-{l}"))
+            for recipient_id in recipient_ids:
+                tracking_id = new_id()
+                tracking_pixel_id = new_id()
+                rows['campaign_recipients'].append((campaign_id, recipient_id))
+                rows['email_tracking'].append((tracking_id, campaign_id, recipient_id, 'sent', sent_at,
+                                               tracking_pixel_id))
+                url_tracking_ids = []
+                for link_id in link_ids:
+                    url_tracking_id = new_id()
+                    url_tracking_ids.append(url_tracking_id)
+                    rows['url_tracking'].append((url_tracking_id, tracking_id, link_id,
+                                                 f"{BASE_URL}track/click/{tracking_id}/{url_tracking_id}"))
+                manifest.append(f"{campaign_id}\t{tracking_id}\t{tracking_pixel_id}\t{','.join(url_tracking_ids)}")
+        yield rows, manifest
+
+
+def copy_rows(cur, table, rows, columns=None):
+    """Load rows with COPY ... FROM STDIN (text format, values never contain tabs or newlines)"""
+    if not rows:
+        return
+    columns = columns or COPY_COLUMNS[table]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def delete_fixtures(cur, seed):
+    """Remove everything belonging to this seed's bench users"""
+    cur.execute("SELECT user_id FROM users WHERE email LIKE %s", (f"bench-{seed}-%@example.invalid",))
+    user_ids = [row[0] for row in cur.fetchall()]
+    if not user_ids:
+        return 0
+    campaigns = "SELECT campaign_id FROM email_campaigns WHERE user_id = ANY(%s::uuid[])"
+    cur.execute(f"DELETE FROM tracking_events WHERE campaign_id IN ({campaigns})", (user_ids,))
+    cur.execute(f"DELETE FROM campaign_engagement_rollups WHERE campaign_id IN ({campaigns})", (user_ids,))
+    cur.execute(f"""
+        DELETE FROM url_tracking WHERE tracking_id IN (
+            SELECT tracking_id FROM email_tracking WHERE campaign_id IN ({campaigns})
+        )
+    """, (user_ids,))
+    for table in ('campaign_links', 'email_tracking', 'campaign_recipients'):
+        cur.execute(f"DELETE FROM {table} WHERE campaign_id IN ({campaigns})", (user_ids,))
+    for table in ('email_campaigns', 'recipients', 'users'):
+        cur.execute(f"DELETE FROM {table} WHERE user_id = ANY(%s::uuid[])", (user_ids,))
+    return len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--campaigns', type=int, default=2, help='campaigns per user')
+    parser.add_argument('--recipients', type=int, default=5000, help='recipients per user (every campaign goes to all)')
+    parser.add_argument('--links', type=int, default=3, help='tracked links per email')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--manifest', default='tracking_fixtures.tsv')
+    parser.add_argument('--reset', action='store_true', help='delete and reload the fixture set for this seed')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+    cur = conn.cursor()
+    started = time.perf_counter()
+
+    if args.reset:
+        deleted = delete_fixtures(cur, args.seed)
+        conn.commit()
+        print(f"Deleted fixtures for {deleted} bench users", file=sys.stderr)
+    cur.execute("SELECT 1 FROM users WHERE email = %s", (user_email(args.seed, 0),))
+    load = cur.fetchone() is None
+
+    counts = {table: 0 for table in COPY_COLUMNS}
+    with open(args.manifest, 'w') as manifest_file:
+        for rows, manifest in generate(args.seed, args.users, args.campaigns, args.recipients, args.links):
+            if load:
+                for table in COPY_COLUMNS:
+                    copy_rows(cur, table, rows[table])
+                conn.commit()
+            for table in COPY_COLUMNS:
+                counts[table] += len(rows[table])
+            manifest_file.write('\n'.join(manifest) + '\n')
+    if load:
+        cur.execute("ANALYZE")
+        conn.commit()
+    conn.close()
+
+    print(json.dumps({
+        'seed': args.seed,
+        'loaded': load,
+        'rows': counts,
+        'manifest': os.path.abspath(args.manifest),
+        'seconds': round(time.perf_counter() - started, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+# benchmarks/load_tracking.py
+"""Load harness for the tracking routes, replaying a fixture manifest.
+
+Drives /track/open, /track/beacon and /track/click for the emails in a manifest
+written by benchmarks/fixtures.py, either in-process against app.py's WSGI app
+(default) or over HTTP against any running server (app.py or tracking_service.py):
+
+    python benchmarks/fixtures.py --seed 42 --manifest /tmp/tracking_fixtures.tsv
+    python benchmarks/load_tracking.py --manifest /tmp/tracking_fixtures.tsv --profile storm
+    python benchmarks/load_tracking.py --manifest /tmp/tracking_fixtures.tsv --mode http \\
+        --url http://127.0.0.1:5001 --concurrency 100
+
+Profiles:
+  steady  independent hits spread over all recipients, mixed per --mix
+  storm   the minutes after a large send: a random share of recipients open the email,
+          each open arriving as a burst of pixel + beacon hits (--hits-per-open), some
+          of them from mail proxies, and --click-rate of openers clicking a link
+
+The request sequence is fully determined by --seed, and the JSON report includes the
+git commit, so runs are comparable across commits. Reported per run: throughput,
+p50/p95/p99 latency overall and per route, database round-trips per request (in-process
+mode only - every execute/commit/rollback/COPY on a psycopg2 connection, split into the
+request path and the background event flusher), connections opened by the app, and
+server-side connection counts sampled from pg_stat_activity.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from bench_tracking_http import percentile, read_response  # noqa: E402
+
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_PORT = os.environ.get('DB_PORT', '5432')
+DB_NAME = os.environ.get('DB_NAME', 'email_app')
+DB_USER = os.environ.get('DB_USER', 'postgres')
+DB_PASS = os.environ.get('DB_PASS', 'Admin@123')
+
+HUMAN_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Thunderbird/115.0'
+PROXY_USER_AGENT = 'Mozilla/5.0 (Windows NT 5.1; rv:11.0) Gecko Firefox/11.0 (via ggpht.com GoogleImageProxy)'
+WORKER_THREAD_PREFIX = 'bench-worker'
+
+
+# Database round-trip counting
+class RoundTrips:
+    """Thread-safe counters, split by whether the caller is a request worker thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_path = 0
+        self.background = 0
+        self.connections_opened = 0
+
+    def add(self, count=1):
+        in_request = threading.current_thread().name.startswith(WORKER_THREAD_PREFIX)
+        with self._lock:
+            if in_request:
+                self.request_path += count
+            else:
+                self.background += count
+
+    def opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+
+round_trips = RoundTrips()
+_counting_cursor_classes = {}
+
+
+def counting_cursor_class(base):
+    if base not in _counting_cursor_classes:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                round_trips.add()
+                return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                vars_list = list(vars_list)
+                round_trips.add(len(vars_list))
+                return super().executemany(query, vars_list)
+
+            def copy_expert(self, sql, file, size=8192):
+                round_trips.add()
+                return super().copy_expert(sql, file, size)
+
+            def callproc(self, procname, parameters=None):
+                round_trips.add()
+                return super().callproc(procname, parameters)
+
+        _counting_cursor_classes[base] = CountingCursor
+    return _counting_cursor_classes[base]
+
+
+class CountingConnectionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        round_trips.opened()
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = counting_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        # No transaction open means psycopg2 doesn't talk to the server
+        if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trips.add()
+        return super().commit()
+
+    def rollback(self):
+        if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            round_trips.add()
+        return super().rollback()
+
+
+def install_round_trip_counter():
+    """Count round-trips on every connection app.py opens from here on"""
+    import app as tracker
+    tracker.db_pool.connection_class = type('CountingPooledConnection',
+                                            (CountingConnectionMixin, tracker.PooledConnection), {})
+    tracker.db_pool.close_idle()
+
+
+# Server-side connection sampling
+class ConnectionMonitor:
+    """Sample pg_stat_activity for this database on its own connection"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+        self._conn.autocommit = True
+        self._thread = threading.Thread(target=self._run, name='connection-monitor', daemon=True)
+
+    def _query(self, sql):
+        with self._conn.cursor() as cur:
+            cur.execute(sql)
+            return cur.fetchone()[0]
+
+    def transactions(self):
+        return self._query("""
+            SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()
+        """)
+
+    def start(self):
+        self.transactions_before = self.transactions()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(self._query("""
+                SELECT count(*) FROM pg_stat_activity
+                WHERE datname = current_database() AND pid <> pg_backend_pid()
+            """))
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        # Statistics are reported to pg_stat_database asynchronously
+        time.sleep(1.1)
+        # Every monitor query is its own transaction - don't count them
+        transactions = self.transactions() - self.transactions_before - len(self.samples) - 1
+        self._conn.close()
+        return {
+            'server_connections_max': max(self.samples) if self.samples else None,
+            'server_connections_mean': round(statistics.mean(self.samples), 1) if self.samples else None,
+            'transactions': transactions,
+        }
+
+
+# Request plans
+def load_manifest(path):
+    emails = []
+    with open(path) as manifest_file:
+        for line in manifest_file:
+            campaign_id, tracking_id, tracking_pixel_id, url_tracking_ids = line.rstrip('\n').split('\t')
+            emails.append((tracking_id, tracking_pixel_id, url_tracking_ids.split(',') if url_tracking_ids else []))
+    return emails
+
+
+def click_path(rng, email):
+    tracking_id, _, url_tracking_ids = email
+    if not url_tracking_ids:
+        return None
+    return f"/track/click/{tracking_id}/{rng.choice(url_tracking_ids)}"
+
+
+def steady_plan(rng, emails, requests, mix):
+    routes, weights = zip(*mix.items())
+    plan = []
+    while len(plan) < requests:
+        email = rng.choice(emails)
+        route = rng.choices(routes, weights)[0]
+        if route == 'click':
+            path = click_path(rng, email)
+            if path is None:
+                continue
+        else:
+            path = f"/track/{route}/{email[1]}"
+        plan.append((route, path, HUMAN_USER_AGENT))
+    return plan
+
+
+def storm_plan(rng, emails, requests, hits_per_open, click_rate, proxy_rate):
+    openers = list(emails)
+    rng.shuffle(openers)
+    bursts = []
+    total = 0
+    for email in openers:
+        if total >= requests:
+            break
+        user_agent = PROXY_USER_AGENT if rng.random() < proxy_rate else HUMAN_USER_AGENT
+        # An open renders the main pixel, the fallback pixels and the JS beacon at once
+        burst = [('open', f"/track/open/{email[1]}", user_agent) for _ in range(max(1, hits_per_open - 1))]
+        if hits_per_open > 1:
+            burst.append(('beacon', f"/track/beacon/{email[1]}", user_agent))
+        if user_agent == HUMAN_USER_AGENT and rng.random() < click_rate:
+            path = click_path(rng, email)
+            if path:
+                burst.append(('click', path, user_agent))
+        bursts.append(burst)
+        total += len(burst)
+    if total < requests:
+        print(f"Manifest only covers {total} storm requests", file=sys.stderr)
+    # Bursts arrive roughly in order but overlap with their neighbours
+    plan = []
+    for i in range(0, len(bursts), 8):
+        window = [hit for burst in bursts[i:i + 8] for hit in burst]
+        rng.shuffle(window)
+        plan.extend(window)
+    return plan[:requests]
+
+
+# Drivers
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, route, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def run_in_process(plan, concurrency):
+    from werkzeug.test import EnvironBuilder
+    import app as tracker
+
+    wsgi_app = tracker.app.wsgi_app
+    results = Results()
+    next_index = iter(range(len(plan))).__next__
+    index_lock = threading.Lock()
+
+    def worker():
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split()[0]))
+
+        while True:
+            with index_lock:
+                try:
+                    i = next_index()
+                except StopIteration:
+                    return
+            route, path, user_agent = plan[i]
+            environ = EnvironBuilder(path=path, headers={'User-Agent': user_agent}).get_environ()
+            t0 = time.perf_counter()
+            body = wsgi_app(environ, start_response)
+            b''.join(body)
+            if hasattr(body, 'close'):
+                body.close()
+            results.add(route, statuses.pop(), time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=WORKER_THREAD_PREFIX) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    flush_started = time.perf_counter()
+    tracker.tracking_event_buffer.flush()
+    return results, elapsed, time.perf_counter() - flush_started
+
+
+def run_http(plan, concurrency, base_url):
+    parts = urlsplit(base_url)
+    prefix = parts.path.rstrip('/')
+    results = Results()
+    cursor = [0]
+
+    async def worker():
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            while cursor[0] < len(plan):
+                route, path, user_agent = plan[cursor[0]]
+                cursor[0] += 1
+                request = (f'GET {prefix}{path} HTTP/1.1\r\nHost: {parts.hostname}\r\n'
+                           f'User-Agent: {user_agent}\r\n\r\n')
+                t0 = time.perf_counter()
+                writer.write(request.encode())
+                status = await read_response(reader)
+                results.add(route, status, time.perf_counter() - t0)
+        finally:
+            writer.close()
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return results, time.perf_counter() - started, None
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        route, _, weight = part.partition('=')
+        if route not in ('open', 'beacon', 'click'):
+            raise argparse.ArgumentTypeError(f"unknown route in mix: {route}")
+        mix[route] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--manifest', required=True, help='manifest written by benchmarks/fixtures.py')
+    parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='base URL in http mode')
+    parser.add_argument('--profile', choices=['steady', 'storm'], default='steady')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('open=0.7,beacon=0.2,click=0.1'),
+                        help='steady profile route weights')
+    parser.add_argument('--hits-per-open', type=int, default=4, help='storm: pixel + beacon requests per open')
+    parser.add_argument('--click-rate', type=float, default=0.1, help='storm: share of human openers who click')
+    parser.add_argument('--proxy-rate', type=float, default=0.2, help='storm: share of opens fetched by a mail proxy')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    emails = load_manifest(args.manifest)
+    if args.profile == 'steady':
+        plan = steady_plan(rng, emails, args.requests, args.mix)
+    else:
+        plan = storm_plan(rng, emails, args.requests, args.hits_per_open, args.click_rate, args.proxy_rate)
+
+    monitor = ConnectionMonitor()
+    if args.mode == 'inprocess':
+        install_round_trip_counter()  # imports app.py (and runs its startup queries) before the clock starts
+        baseline_request_path, baseline_background = round_trips.request_path, round_trips.background
+        baseline_connections = round_trips.connections_opened
+    monitor.start()
+    if args.mode == 'inprocess':
+        results, elapsed, flush_seconds = run_in_process(plan, args.concurrency)
+    else:
+        results, elapsed, flush_seconds = run_http(plan, args.concurrency, args.url)
+    server = monitor.stop()
+
+    all_latencies = [value for values in results.latencies.values() for value in values]
+    db = dict(server)
+    if args.mode == 'inprocess':
+        request_path = round_trips.request_path - baseline_request_path
+        background = round_trips.background - baseline_background
+        db.update({
+            'round_trips_request_path': request_path,
+            'round_trips_background': background,
+            'round_trips_per_request': round((request_path + background) / len(all_latencies), 4),
+            'connections_opened': round_trips.connections_opened - baseline_connections,
+        })
+
+    print(json.dumps({
+        'commit': git_commit(),
+        'config': {
+            'mode': args.mode,
+            'url': args.url if args.mode == 'http' else None,
+            'profile': args.profile,
+            'requests': len(plan),
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'manifest_emails': len(emails),
+        },
+        'seconds': round(elapsed, 3),
+        'flush_seconds': round(flush_seconds, 3) if flush_seconds is not None else None,
+        'requests_per_sec': round(len(all_latencies) / elapsed, 1),
+        'statuses': {str(status): count for status, count in sorted(results.statuses.items())},
+        'latency': latency_summary(all_latencies),
+        'routes': {route: latency_summary(values) for route, values in sorted(results.latencies.items())},
+        'db': db,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
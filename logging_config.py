@@ -0,0 +1,106 @@
+# logging_config.py
+"""Process-wide logging setup shared by app.py and tracking_service.py.
+
+Logging calls only build a LogRecord and put it on an in-memory queue. A
+QueueListener thread formats the records and writes them to stderr, so request
+threads and the send loop never wait on the stream. Output is one JSON object
+per line (LOG_FORMAT=json, the default) with any `extra={...}` fields as keys,
+or the old single-line text format with LOG_FORMAT=text.
+
+Use %-style arguments on hot paths - logger.info("sent %s", email) is only
+formatted if the record is actually emitted, an f-string is built every time.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()  # json or text
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# Attributes every LogRecord has - anything else on a record came from `extra`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message, extra fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock prepare() formats every record in the calling thread so it can be
+    pickled; records on an in-process queue don't need that.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_queue = queue.SimpleQueue()
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(_queue, handler)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # The listener thread doesn't survive fork, so each child gets its own queue and thread
+    global _queue
+    _queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DeferredQueueHandler):
+            handler.queue = _queue
+    _start_listener()
+
+
+def configure_logging():
+    """Send the root logger through the queue. Calling it again is a no-op."""
+    with _configure_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger()
+        root.handlers[:] = [DeferredQueueHandler(_queue)]
+        root.setLevel(LOG_LEVEL)
+        _start_listener()
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging():
+    """Write out whatever is still queued and stop the listener thread"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
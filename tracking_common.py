@@ -0,0 +1,467 @@
+# tracking_common.py
+"""Tracking pieces shared by the Flask API (app.py) and the standalone ingestion service
+(tracking_service.py): settings, prebuilt responses, hit classification, open dedup,
+the redirect cache and the SQL + batch aggregation used to write tracking_events.
+
+Nothing in here talks to a specific database driver. The SQL templates take a
+`{source}` placeholder for the batch rows, which is a VALUES list for psycopg2 and
+an unnest() of array parameters for asyncpg.
+"""
+import base64
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Tracking event log - hits are buffered in memory and written to tracking_events in batches
+TRACKING_EVENT_BATCH_SIZE = int(os.environ.get('TRACKING_EVENT_BATCH_SIZE', '500'))
+TRACKING_EVENT_FLUSH_INTERVAL = float(os.environ.get('TRACKING_EVENT_FLUSH_INTERVAL', '2'))  # seconds
+TRACKING_EVENT_MAX_BUFFER = int(os.environ.get('TRACKING_EVENT_MAX_BUFFER', '50000'))
+
+# Engagement rollups - events are pre-aggregated into 5 minute buckets per campaign and metric,
+# coarser timeseries buckets are summed from these at query time
+ROLLUP_BUCKET_SECONDS = 300
+EVENT_TYPE_METRICS = {'open': 'opens', 'beacon': 'opens', 'click': 'clicks', 'reply': 'replies'}
+
+# Open deduplication - one open fans out into several pixel/beacon requests, repeats of the
+# same tracking pixel inside this window are absorbed in memory
+OPEN_DEDUP_WINDOW_SECONDS = float(os.environ.get('OPEN_DEDUP_WINDOW_SECONDS', '30'))
+OPEN_DEDUP_MAX_ENTRIES = int(os.environ.get('OPEN_DEDUP_MAX_ENTRIES', '100000'))
+
+# Prebuilt tracking responses - the bodies and headers never change, so build them once
+TRACKING_PIXEL_GIF = base64.b64decode('R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==')
+TRACKING_PIXEL_HEADERS = (
+    ('Cache-Control', 'no-cache, no-store, must-revalidate, private'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0'),
+    ('Access-Control-Allow-Origin', '*'),
+)
+BEACON_OK_BODY = b'{"status":"ok"}\n'
+BEACON_ERROR_BODY = b'{"status":"error"}\n'
+BEACON_HEADERS = (
+    ('Cache-Control', 'no-cache, no-store, must-revalidate'),
+    ('Access-Control-Allow-Origin', '*'),
+)
+FALLBACK_REDIRECT_URL = 'https://www.google.com'
+
+# Click redirect cache - url_tracking rows never change once written, so destinations are cached
+# in a per-process LRU and optionally in a local SQLite file shared by all workers on the host
+REDIRECT_CACHE_SIZE = int(os.environ.get('REDIRECT_CACHE_SIZE', '100000'))
+REDIRECT_CACHE_PATH = os.environ.get('REDIRECT_CACHE_PATH', '')
+
+# Health checks - probe results are reused for HEALTH_CACHE_SECONDS so load balancer polling
+# never adds database load; readiness fails once the unflushed event backlog passes the limit
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', '2'))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', '2'))  # seconds
+HEALTH_MAX_EVENT_BACKLOG = int(os.environ.get('HEALTH_MAX_EVENT_BACKLOG', str(int(TRACKING_EVENT_MAX_BUFFER * 0.8))))
+
+# Metrics - both ingestion paths report their event buffer under the same names
+TRACKING_EVENT_BUFFER_DEPTH = Gauge('tracking_event_buffer_depth', 'Tracking events waiting to be flushed')
+TRACKING_EVENT_FLUSH_SECONDS = Histogram('tracking_event_flush_seconds', 'Time to write one batch of tracking events')
+TRACKING_EVENTS_FLUSHED = Counter('tracking_events_flushed_total', 'Tracking events handed to the database')
+TRACKING_EVENTS_DROPPED = Counter('tracking_events_dropped_total', 'Tracking events dropped because the buffer was full')
+
+# Partitions
+def month_start(value, offset=0):
+    """Return the first day of the month `offset` months away from `value`"""
+    month_index = value.year * 12 + (value.month - 1) + offset
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def tracking_event_partition_name(start):
+    return f"tracking_events_y{start.year:04d}m{start.month:02d}"
+
+def tracking_event_partition_ddl(months_ahead=2):
+    """CREATE statements for the current month's tracking_events partition and the next few"""
+    now = datetime.now(timezone.utc)
+    statements = []
+    for offset in range(0, months_ahead + 1):
+        start = month_start(now, offset)
+        end = month_start(now, offset + 1)
+        statements.append(f"""
+            CREATE TABLE IF NOT EXISTS {tracking_event_partition_name(start)}
+            PARTITION OF tracking_events
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+        """)
+    return statements
+
+# Hit handling
+def parse_uuid(value):
+    """Return value as a UUID string, or None if it isn't one"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except (ValueError, TypeError):
+        return None
+
+class OpenDedupCache:
+    """Remember recently seen tracking pixels so repeat hits inside the window are dropped"""
+
+    def __init__(self, window_seconds=OPEN_DEDUP_WINDOW_SECONDS, max_entries=OPEN_DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, key):
+        """Return True if key was seen within the window, otherwise remember it and return False"""
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._seen.get(key)
+            if expires_at is not None and expires_at > now:
+                return True
+            if len(self._seen) >= self.max_entries:
+                self._purge(now)
+            self._seen[key] = now + self.window_seconds
+            return False
+
+    def _purge(self, now):
+        self._seen = {k: v for k, v in self._seen.items() if v > now}
+        if len(self._seen) >= self.max_entries:
+            # Still full of live entries - forget everything rather than grow without bound
+            self._seen.clear()
+
+# User agent signatures of mail privacy proxies, prefetchers and security link scanners.
+# Hits from these are stored with their agent class instead of being counted as human engagement.
+AUTOMATED_USER_AGENTS = (
+    ('gmail_proxy', re.compile(r'GoogleImageProxy', re.I)),
+    ('yahoo_proxy', re.compile(r'YahooMailProxy', re.I)),
+    ('link_scanner', re.compile(
+        r'Barracuda|Mimecast|Proofpoint|Symantec|TrendMicro|Trend Micro|ZScaler|Forcepoint|'
+        r'SafeLinks|Microsoft-WebDAV|MSOffice Protection|Cisco|IronPort|FireEye|Sophos', re.I)),
+    ('bot', re.compile(
+        r'bot\b|crawler|spider|HeadlessChrome|python-requests|python-urllib|curl/|Wget|'
+        r'Go-http-client|okhttp|Java/|libwww|facebookexternalhit', re.I)),
+)
+
+def classify_user_agent(user_agent, purpose=None):
+    """Classify a tracking hit as 'human' or as the kind of automated agent that made it"""
+    if purpose and 'prefetch' in purpose.lower():
+        return 'prefetch'
+    if not user_agent or user_agent == 'Unknown':
+        return 'human'
+    # Apple Mail Privacy Protection fetches remote content with a bare "Mozilla/5.0" user agent
+    if user_agent.strip() == 'Mozilla/5.0':
+        return 'apple_mpp'
+    for agent_class, pattern in AUTOMATED_USER_AGENTS:
+        if pattern.search(user_agent):
+            return agent_class
+    return 'human'
+
+class RedirectCache:
+    """Map url_tracking_id -> (original_url, tracking_id) without a database round-trip.
+
+    Lookups go through a bounded in-memory LRU, then the optional file tier, then
+    the database. Hit counts and redirect latencies are kept for /api/debug/redirect-cache.
+    The file tier reads and writes SQLite on disk, so async callers use the *_memory and
+    *_file methods separately and run the file ones off the event loop.
+    """
+
+    def __init__(self, max_entries=REDIRECT_CACHE_SIZE, file_path=REDIRECT_CACHE_PATH):
+        self.max_entries = max_entries
+        self.file_path = file_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self.redirects = 0
+        self.redirect_seconds_total = 0.0
+        self._recent_latencies = deque(maxlen=1000)
+
+    def get(self, url_tracking_id):
+        entry = self.get_memory(url_tracking_id)
+        if entry is None:
+            entry = self.get_file(url_tracking_id)
+        return entry
+
+    def get_memory(self, url_tracking_id):
+        """The in-memory tier only; a miss here isn't counted, get_file() does that"""
+        with self._lock:
+            entry = self._entries.get(url_tracking_id)
+            if entry is not None:
+                self._entries.move_to_end(url_tracking_id)
+                self.memory_hits += 1
+            return entry
+
+    def get_file(self, url_tracking_id):
+        """The file tier, blocking on disk. A hit is also kept in memory"""
+        if self.file_path:
+            entry = self._file_get(url_tracking_id)
+            if entry is not None:
+                self._remember(url_tracking_id, entry)
+                self.file_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, url_tracking_id, original_url, tracking_id):
+        entry = self.put_memory(url_tracking_id, original_url, tracking_id)
+        self.put_file(url_tracking_id, entry)
+        return entry
+
+    def put_memory(self, url_tracking_id, original_url, tracking_id):
+        entry = (original_url, tracking_id)
+        self._remember(url_tracking_id, entry)
+        return entry
+
+    def put_file(self, url_tracking_id, entry):
+        """Write to the file tier, blocking on disk"""
+        if self.file_path:
+            self._file_put(url_tracking_id, entry)
+
+    def _remember(self, url_tracking_id, entry):
+        with self._lock:
+            self._entries[url_tracking_id] = entry
+            self._entries.move_to_end(url_tracking_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _file_connection(self):
+        # SQLite connections can't be shared between threads, so each thread opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS redirects (
+                    url_tracking_id TEXT PRIMARY KEY,
+                    original_url TEXT NOT NULL,
+                    tracking_id TEXT NOT NULL
+                )
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _file_get(self, url_tracking_id):
+        try:
+            row = self._file_connection().execute(
+                "SELECT original_url, tracking_id FROM redirects WHERE url_tracking_id = ?",
+                (url_tracking_id,)
+            ).fetchone()
+            return tuple(row) if row else None
+        except sqlite3.Error as e:
+            logger.warning("Redirect cache file lookup failed: %s", e, extra={'event': 'redirect_cache_error'})
+            return None
+
+    def _file_put(self, url_tracking_id, entry):
+        try:
+            self._file_connection().execute(
+                "INSERT OR IGNORE INTO redirects (url_tracking_id, original_url, tracking_id) VALUES (?, ?, ?)",
+                (url_tracking_id, *entry)
+            )
+        except sqlite3.Error as e:
+            logger.warning("Redirect cache file write failed: %s", e, extra={'event': 'redirect_cache_error'})
+
+    def record_redirect(self, seconds):
+        self.redirects += 1
+        self.redirect_seconds_total += seconds
+        self._recent_latencies.append(seconds)
+
+    def stats(self):
+        lookups = self.memory_hits + self.file_hits + self.misses
+        recent = sorted(self._recent_latencies)
+
+        def recent_percentile(pct):
+            if not recent:
+                return None
+            return round(recent[min(len(recent) - 1, int(len(recent) * pct / 100))] * 1000, 3)
+
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'file_tier': bool(self.file_path),
+            'memory_hits': self.memory_hits,
+            'file_hits': self.file_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.file_hits) / lookups, 4) if lookups else None,
+            'redirects': self.redirects,
+            'redirect_avg_ms': round(self.redirect_seconds_total / self.redirects * 1000, 3) if self.redirects else None,
+            'redirect_p50_ms': recent_percentile(50),
+            'redirect_p99_ms': recent_percentile(99),
+        }
+
+# Batch SQL. Buffered events are tuples of
+# (occurred_at, event_type, tracking_pixel_id, tracking_id, url_tracking_id, source, user_agent, ip_address, agent_class)
+CLICK_DESTINATION_SQL = """
+    SELECT ut.tracking_id, COALESCE(cl.original_url, ut.original_url) AS original_url
+    FROM url_tracking ut
+    LEFT JOIN campaign_links cl ON ut.link_id = cl.link_id
+    WHERE ut.url_tracking_id = {url_tracking_id}
+"""
+
+# Events are matched to email_tracking by pixel id (opens/beacons) or by tracking id (clicks/replies)
+EVENT_JOIN_BY_PIXEL = "et.tracking_pixel_id = v.tracking_pixel_id"
+EVENT_JOIN_BY_TRACKING_ID = "et.tracking_id = v.tracking_id::uuid"
+
+INSERT_TRACKING_EVENTS_SQL = """
+    INSERT INTO tracking_events
+    (occurred_at, event_type, tracking_id, campaign_id, url_tracking_id, source, user_agent, ip_address,
+     agent_class)
+    SELECT v.occurred_at, v.event_type, et.tracking_id, et.campaign_id,
+           v.url_tracking_id::uuid, v.source, v.user_agent, v.ip_address, v.agent_class
+    FROM {source} AS v(occurred_at, event_type, tracking_pixel_id, tracking_id,
+                       url_tracking_id, source, user_agent, ip_address, agent_class)
+    JOIN email_tracking et ON {join_condition}
+    RETURNING event_type, tracking_id, campaign_id, url_tracking_id, occurred_at, agent_class
+"""
+
+# previous locks the rows in tracking_id order and reads their latest committed opened_at/clicked_at,
+# so two workers flushing hits for the same recipient can't both report its first open or click
+EMAIL_TRACKING_ROLLUP_SQL = """
+    WITH v AS (
+        SELECT * FROM {source} AS v(tracking_id, opens, first_open, clicks, first_click,
+                                    automated_opens, automated_clicks)
+    ), previous AS (
+        SELECT tracking_id, opened_at, clicked_at
+        FROM email_tracking
+        WHERE tracking_id IN (SELECT tracking_id FROM v)
+        ORDER BY tracking_id
+        FOR UPDATE
+    )
+    UPDATE email_tracking et
+    SET
+        -- Don't downgrade 'replied'; a click wins over an open
+        email_status = CASE
+            WHEN et.email_status = 'replied' THEN et.email_status
+            WHEN v.clicks > 0 THEN 'clicked'
+            WHEN v.opens > 0 AND et.email_status IN ('sending', 'sent', 'pending', 'failed', 'unconfirmed') THEN 'opened'
+            ELSE et.email_status
+        END,
+        -- Clicking means they opened it
+        opened_at = COALESCE(et.opened_at, LEAST(v.first_open, v.first_click)),
+        open_count = CASE
+            WHEN v.clicks > 0 THEN GREATEST(et.open_count + v.opens, 1)
+            ELSE et.open_count + v.opens
+        END,
+        clicked_at = COALESCE(et.clicked_at, v.first_click),
+        click_count = et.click_count + v.clicks,
+        automated_open_count = et.automated_open_count + v.automated_opens,
+        automated_click_count = et.automated_click_count + v.automated_clicks,
+        updated_at = NOW()
+    FROM v, previous
+    WHERE et.tracking_id = v.tracking_id AND previous.tracking_id = et.tracking_id
+    RETURNING et.campaign_id, et.opened_at, et.clicked_at,
+              previous.opened_at IS NULL AND et.opened_at IS NOT NULL AS is_first_open,
+              previous.clicked_at IS NULL AND et.clicked_at IS NOT NULL AS is_first_click
+"""
+
+URL_TRACKING_ROLLUP_SQL = """
+    UPDATE url_tracking ut
+    SET
+        click_count = ut.click_count + v.clicks,
+        first_clicked_at = COALESCE(ut.first_clicked_at, v.first_click),
+        last_clicked_at = GREATEST(ut.last_clicked_at, v.last_click)
+    FROM {source} AS v(url_tracking_id, clicks, first_click, last_click)
+    WHERE ut.url_tracking_id = v.url_tracking_id
+    RETURNING ut.link_id, v.clicks, v.first_click, v.last_click,
+              ut.click_count = v.clicks AS is_first_click
+"""
+
+CAMPAIGN_LINKS_ROLLUP_SQL = """
+    UPDATE campaign_links cl
+    SET
+        total_clicks = cl.total_clicks + v.clicks,
+        unique_clicks = cl.unique_clicks + v.unique_clicks,
+        first_clicked_at = COALESCE(cl.first_clicked_at, v.first_click),
+        last_clicked_at = GREATEST(cl.last_clicked_at, v.last_click)
+    FROM {source} AS v(link_id, clicks, unique_clicks, first_click, last_click)
+    WHERE cl.link_id = v.link_id
+"""
+
+ENGAGEMENT_ROLLUP_SQL = """
+    INSERT INTO campaign_engagement_rollups
+    (campaign_id, metric, bucket_start, event_count, unique_count)
+    {source}
+    ON CONFLICT (campaign_id, metric, bucket_start) DO UPDATE
+    SET
+        event_count = campaign_engagement_rollups.event_count + EXCLUDED.event_count,
+        unique_count = campaign_engagement_rollups.unique_count + EXCLUDED.unique_count
+"""
+
+# Batch aggregation - everything returns rows sorted by key so concurrent flushes
+# from several workers lock rows in the same order
+def summarize_tracking_events(resolved):
+    """Aggregate inserted events into per-recipient and per-link click/open deltas.
+
+    Returns (tracking_rows, url_rows) ready for EMAIL_TRACKING_ROLLUP_SQL and URL_TRACKING_ROLLUP_SQL.
+    """
+    per_tracking = {}
+    per_url = {}
+    for row in resolved:
+        event_type = row['event_type']
+        occurred_at = row['occurred_at']
+        if row['agent_class'] != 'human':
+            # Proxy/prefetch/scanner hits are kept as a separate signal, not as engagement
+            if event_type in ('open', 'beacon', 'click'):
+                stats = per_tracking.setdefault(row['tracking_id'], [0, None, 0, None, 0, 0])
+                stats[4 if event_type != 'click' else 5] += 1
+            continue
+        if event_type in ('open', 'beacon'):
+            stats = per_tracking.setdefault(row['tracking_id'], [0, None, 0, None, 0, 0])
+            stats[0] += 1
+            stats[1] = min(stats[1] or occurred_at, occurred_at)
+        elif event_type == 'click':
+            stats = per_tracking.setdefault(row['tracking_id'], [0, None, 0, None, 0, 0])
+            stats[2] += 1
+            stats[3] = min(stats[3] or occurred_at, occurred_at)
+            if row['url_tracking_id']:
+                url_stats = per_url.setdefault(row['url_tracking_id'], [0, occurred_at, occurred_at])
+                url_stats[0] += 1
+                url_stats[1] = min(url_stats[1], occurred_at)
+                url_stats[2] = max(url_stats[2], occurred_at)
+        # Replies are written to email_tracking when they are detected; they are only logged here
+
+    tracking_rows = [(tracking_id, *s) for tracking_id, s in sorted(per_tracking.items())]
+    url_rows = [(url_id, *s) for url_id, s in sorted(per_url.items())]
+    return tracking_rows, url_rows
+
+def summarize_link_clicks(url_updates):
+    """Roll the per-recipient link clicks returned by URL_TRACKING_ROLLUP_SQL up per campaign link"""
+    per_link = {}
+    for row in url_updates:
+        if not row['link_id']:
+            continue
+        link_stats = per_link.setdefault(row['link_id'], [0, 0, row['first_click'], row['last_click']])
+        link_stats[0] += row['clicks']
+        link_stats[1] += 1 if row['is_first_click'] else 0
+        link_stats[2] = min(link_stats[2], row['first_click'])
+        link_stats[3] = max(link_stats[3], row['last_click'])
+    return [(link_id, *s) for link_id, s in sorted(per_link.items())]
+
+def rollup_bucket_start(value):
+    """Truncate a timestamp to the start of its rollup bucket"""
+    epoch = int(value.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % ROLLUP_BUCKET_SECONDS, tz=timezone.utc)
+
+def summarize_engagement_buckets(resolved, first_touches):
+    """Aggregate a batch of events into rows for the per-campaign 5 minute engagement rollups"""
+    buckets = {}
+    for row in resolved:
+        metric = EVENT_TYPE_METRICS.get(row['event_type'])
+        if not metric or row['agent_class'] != 'human':
+            continue
+        counts = buckets.setdefault((row['campaign_id'], metric, rollup_bucket_start(row['occurred_at'])), [0, 0])
+        counts[0] += 1
+        if metric == 'replies':
+            counts[1] += 1
+    for row in first_touches:
+        if not (row['is_first_open'] or row['is_first_click']):
+            continue
+        # Unique opens/clicks are counted in the bucket of the recipient's first open/click
+        if row['is_first_open']:
+            key = (row['campaign_id'], 'opens', rollup_bucket_start(row['opened_at']))
+            buckets.setdefault(key, [0, 0])[1] += 1
+        if row['is_first_click']:
+            key = (row['campaign_id'], 'clicks', rollup_bucket_start(row['clicked_at']))
+            buckets.setdefault(key, [0, 0])[1] += 1
+    return [(*key, counts[0], counts[1]) for key, counts in sorted(buckets.items())]
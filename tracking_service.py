@@ -0,0 +1,403 @@
+# tracking_service.py
+"""Standalone tracking ingestion service.
+
+Serves only the public tracking routes, with the same URL contract as app.py:
+
+    GET /track/open/<tracking_pixel_id>
+    GET /track/beacon/<tracking_pixel_id>
+    GET /track/click/<tracking_id>/<url_tracking_id>
+
+It is a plain ASGI app on asyncpg, so an open storm after a large send is absorbed
+by an event loop instead of tying up the API's worker threads. Deploy it behind
+the same host as the API and route /track/ to it:
+
+    uvicorn tracking_service:app --host 0.0.0.0 --port 5001 --workers 4
+
+GET /metrics returns the same text exposition format as the API's /metrics, and
+/healthz/live and /healthz/ready follow the API's health check contract.
+
+Hits are buffered and written to tracking_events in batches, then rolled up into
+the email_tracking / url_tracking / campaign_links counters and the engagement
+rollups with the same SQL app.py uses (see tracking_common.py).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, quote
+
+import asyncpg
+
+from logging_config import configure_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS_REGISTRY, Gauge, Histogram
+from tracking_common import (
+    TRACKING_EVENT_BATCH_SIZE, TRACKING_EVENT_FLUSH_INTERVAL, TRACKING_EVENT_MAX_BUFFER,
+    TRACKING_PIXEL_GIF, TRACKING_PIXEL_HEADERS, BEACON_OK_BODY, BEACON_HEADERS, FALLBACK_REDIRECT_URL,
+    CLICK_DESTINATION_SQL, EVENT_JOIN_BY_PIXEL, EVENT_JOIN_BY_TRACKING_ID, INSERT_TRACKING_EVENTS_SQL,
+    EMAIL_TRACKING_ROLLUP_SQL, URL_TRACKING_ROLLUP_SQL, CAMPAIGN_LINKS_ROLLUP_SQL, ENGAGEMENT_ROLLUP_SQL,
+    OpenDedupCache, RedirectCache, classify_user_agent, parse_uuid, summarize_engagement_buckets,
+    summarize_link_clicks, summarize_tracking_events, tracking_event_partition_ddl,
+    TRACKING_EVENT_BUFFER_DEPTH, TRACKING_EVENT_FLUSH_SECONDS, TRACKING_EVENTS_DROPPED, TRACKING_EVENTS_FLUSHED,
+    HEALTH_CACHE_SECONDS, HEALTH_MAX_EVENT_BACKLOG, HEALTH_PROBE_TIMEOUT,
+)
+
+configure_logging()
+logger = logging.getLogger('tracking_service')
+
+# Database Configuration - same variables as app.py
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_PORT = os.environ.get('DB_PORT', '5432')
+DB_NAME = os.environ.get('DB_NAME', 'email_app')
+DB_USER = os.environ.get('DB_USER', 'postgres')
+DB_PASS = os.environ.get('DB_PASS', 'Admin@123')
+TRACKING_DB_POOL_SIZE = int(os.environ.get('TRACKING_DB_POOL_SIZE', '10'))
+
+# Metrics - route labels match the API's endpoint names for the same routes
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route', ('route',))
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Pooled database connections by state', ('state',))
+DB_POOL_MAX_CONNECTIONS = Gauge('db_pool_max_connections', 'Upper bound on pooled database connections')
+DB_POOL_MAX_CONNECTIONS.set(TRACKING_DB_POOL_SIZE)
+ROUTE_SECONDS = {route: HTTP_REQUEST_SECONDS.labels(endpoint) for route, endpoint in (
+    ('open', 'api.track_open'), ('beacon', 'api.track_beacon'), ('click', 'api.track_click'), ('other', 'unmatched'))}
+
+# unnest() sources for the shared batch SQL - one array parameter per column
+INSERT_EVENTS_SOURCE = ("unnest($1::timestamptz[], $2::text[], $3::text[], $4::text[], $5::text[], "
+                        "$6::text[], $7::text[], $8::text[], $9::text[])")
+EMAIL_TRACKING_SOURCE = ("unnest($1::uuid[], $2::int[], $3::timestamptz[], $4::int[], $5::timestamptz[], "
+                         "$6::int[], $7::int[])")
+URL_TRACKING_SOURCE = "unnest($1::uuid[], $2::int[], $3::timestamptz[], $4::timestamptz[])"
+CAMPAIGN_LINKS_SOURCE = "unnest($1::uuid[], $2::int[], $3::int[], $4::timestamptz[], $5::timestamptz[])"
+ENGAGEMENT_SOURCE = "SELECT * FROM unnest($1::uuid[], $2::text[], $3::timestamptz[], $4::int[], $5::int[])"
+
+def _columns(rows):
+    """Turn a list of row tuples into one list per column for unnest()"""
+    return [list(column) for column in zip(*rows)]
+
+class AsyncTrackingEventBuffer:
+    """asyncio counterpart of app.TrackingEventBuffer: queue hits, write them in batches"""
+
+    def __init__(self, batch_size=TRACKING_EVENT_BATCH_SIZE, flush_interval=TRACKING_EVENT_FLUSH_INTERVAL,
+                 max_buffer=TRACKING_EVENT_MAX_BUFFER):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.pool = None
+        self._events = []
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = None
+
+    def start(self, pool):
+        self.pool = pool
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def record(self, event_type, tracking_pixel_id=None, tracking_id=None, url_tracking_id=None,
+               source=None, user_agent=None, ip_address=None, agent_class='human'):
+        """Queue a single tracking event. Either tracking_pixel_id or tracking_id must be given."""
+        if len(self._events) >= self.max_buffer:
+            TRACKING_EVENTS_DROPPED.inc()
+            logger.warning("Tracking event buffer full, dropping event")
+            return
+        self._events.append((datetime.now(timezone.utc), event_type, tracking_pixel_id, tracking_id,
+                             url_tracking_id, source, user_agent, ip_address, agent_class))
+        if len(self._events) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._events)
+
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("❌ Error flushing tracking events: %s", e, extra={'event': 'tracking_flush_failed'})
+
+    async def flush(self):
+        """Write all buffered events to the database"""
+        if self.pool is None:
+            return 0
+        async with self._flush_lock:
+            events, self._events = self._events, []
+            if not events:
+                return 0
+            started = time.perf_counter()
+            try:
+                await write_tracking_events(self.pool, events)
+            except Exception:
+                # Put the batch back so a transient database error doesn't lose events
+                if len(events) + len(self._events) <= self.max_buffer:
+                    self._events[:0] = events
+                else:
+                    TRACKING_EVENTS_DROPPED.inc(len(events))
+                    logger.error("❌ Dropping %s tracking events, buffer is full", len(events),
+                                 extra={'event': 'tracking_events_dropped'})
+                raise
+            finally:
+                TRACKING_EVENT_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            TRACKING_EVENTS_FLUSHED.inc(len(events))
+            return len(events)
+
+async def write_tracking_events(pool, events):
+    """Insert a batch of buffered events and roll it up into the tracking counters"""
+    async with pool.acquire() as conn:
+        try:
+            resolved = await _write_batch(conn, events)
+        except asyncpg.exceptions.CheckViolationError:
+            # No partition for the event time yet (e.g. first flush of a new month)
+            for statement in tracking_event_partition_ddl():
+                await conn.execute(statement)
+            resolved = await _write_batch(conn, events)
+    logger.debug("✅ Flushed %s tracking events (%s received)", len(resolved), len(events),
+                 extra={'event': 'tracking_flushed'})
+
+async def _write_batch(conn, events):
+    async with conn.transaction():
+        resolved = await _insert_tracking_events(conn, events)
+        first_touches = await _rollup_tracking_events(conn, resolved)
+        bucket_rows = summarize_engagement_buckets(resolved, first_touches)
+        if bucket_rows:
+            await conn.execute(ENGAGEMENT_ROLLUP_SQL.format(source=ENGAGEMENT_SOURCE), *_columns(bucket_rows))
+    return resolved
+
+async def _insert_tracking_events(conn, events):
+    by_pixel = [e for e in events if e[2] is not None]
+    by_tracking_id = [e for e in events if e[2] is None and e[3] is not None]
+    resolved = []
+    for rows, join_condition in ((by_pixel, EVENT_JOIN_BY_PIXEL), (by_tracking_id, EVENT_JOIN_BY_TRACKING_ID)):
+        if rows:
+            resolved.extend(await conn.fetch(
+                INSERT_TRACKING_EVENTS_SQL.format(source=INSERT_EVENTS_SOURCE, join_condition=join_condition),
+                *_columns(rows)))
+    return resolved
+
+async def _rollup_tracking_events(conn, resolved):
+    tracking_rows, url_rows = summarize_tracking_events(resolved)
+    first_touches = []
+    if tracking_rows:
+        first_touches = await conn.fetch(EMAIL_TRACKING_ROLLUP_SQL.format(source=EMAIL_TRACKING_SOURCE),
+                                         *_columns(tracking_rows))
+    if url_rows:
+        url_updates = await conn.fetch(URL_TRACKING_ROLLUP_SQL.format(source=URL_TRACKING_SOURCE),
+                                       *_columns(url_rows))
+        link_rows = summarize_link_clicks(url_updates)
+        if link_rows:
+            await conn.execute(CAMPAIGN_LINKS_ROLLUP_SQL.format(source=CAMPAIGN_LINKS_SOURCE), *_columns(link_rows))
+    return first_touches
+
+class TrackingService:
+    """ASGI application serving the tracking routes"""
+
+    def __init__(self):
+        self.pool = None
+        self.events = AsyncTrackingEventBuffer()
+        self.dedup = OpenDedupCache()
+        self.redirects = RedirectCache()
+        self._readiness = None
+        self._readiness_at = 0.0
+        self._readiness_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error("❌ Tracking service failed to start: %s", e, extra={'event': 'tracking_startup_failed'})
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        self.pool = await asyncpg.create_pool(
+            host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS,
+            min_size=1, max_size=TRACKING_DB_POOL_SIZE
+        )
+        self.events.start(self.pool)
+        TRACKING_EVENT_BUFFER_DEPTH.set_function(self.events.pending)
+        DB_POOL_CONNECTIONS.labels('in_use').set_function(lambda: self.pool.get_size() - self.pool.get_idle_size())
+        DB_POOL_CONNECTIONS.labels('idle').set_function(self.pool.get_idle_size)
+        logger.info("✅ Tracking service ready (pid %s)", os.getpid(), extra={'event': 'tracking_ready'})
+
+    async def shutdown(self):
+        try:
+            await self.events.stop()
+        except Exception as e:
+            logger.error("❌ Error flushing tracking events at shutdown: %s", e, extra={'event': 'tracking_flush_failed'})
+        if self.pool:
+            await self.pool.close()
+
+    async def readiness(self):
+        """Readiness result, re-checked at most once per HEALTH_CACHE_SECONDS"""
+        if self._readiness is None or time.monotonic() - self._readiness_at >= HEALTH_CACHE_SECONDS:
+            async with self._readiness_lock:
+                if self._readiness is None or time.monotonic() - self._readiness_at >= HEALTH_CACHE_SECONDS:
+                    self._readiness = await self._check_readiness()
+                    self._readiness_at = time.monotonic()
+        return self._readiness
+
+    async def _check_readiness(self):
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire(timeout=HEALTH_PROBE_TIMEOUT) as conn:
+                await conn.fetchval("SELECT 1", timeout=HEALTH_PROBE_TIMEOUT)
+            database = {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as e:
+            database = {'ok': False, 'error': str(e) or type(e).__name__}
+        pending = self.events.pending()
+        checks = {
+            'database': database,
+            'event_flusher': {'ok': self.events.running()},
+            'event_buffer': {'ok': pending <= HEALTH_MAX_EVENT_BACKLOG, 'pending': pending,
+                             'limit': HEALTH_MAX_EVENT_BACKLOG},
+        }
+        return {
+            'status': 'ready' if all(check['ok'] for check in checks.values()) else 'unavailable',
+            'checks': checks,
+            'checked_at': datetime.now(timezone.utc).isoformat(),
+        }
+
+    async def _http(self, scope, send):
+        started = time.perf_counter()
+        parts = scope['path'].strip('/').split('/')
+        route_seconds = ROUTE_SECONDS['other']
+        if len(parts) > 1 and parts[0] == 'track':
+            route_seconds = ROUTE_SECONDS.get(parts[1], route_seconds)
+        try:
+            await self._route(scope, send, parts)
+        finally:
+            route_seconds.observe(time.perf_counter() - started)
+
+    async def _route(self, scope, send, parts):
+        if scope['path'] == '/metrics' and scope['method'] == 'GET':
+            await self._respond(send, 200, METRICS_REGISTRY.render().encode(),
+                                (('Content-Type', METRICS_CONTENT_TYPE),))
+            return
+        if scope['path'] == '/healthz/live':
+            await self._respond_json(send, 200, {'status': 'alive', 'pid': os.getpid()})
+            return
+        if scope['path'] == '/healthz/ready':
+            result = await self.readiness()
+            await self._respond_json(send, 200 if result['status'] == 'ready' else 503, result)
+            return
+        if scope['method'] not in ('GET', 'HEAD') or len(parts) < 3 or parts[0] != 'track':
+            await self._respond(send, 404, b'Not Found', (('Content-Type', 'text/plain'),))
+            return
+
+        headers = {}
+        for name, value in scope['headers']:
+            headers[name.decode('latin-1')] = value.decode('latin-1')
+        user_agent = headers.get('user-agent', 'Unknown')
+        agent_class = classify_user_agent(user_agent, headers.get('sec-purpose') or headers.get('purpose'))
+        client = scope.get('client')
+        ip_address = client[0] if client else None
+
+        route = parts[1]
+        if route in ('open', 'beacon') and len(parts) == 3:
+            tracking_pixel_id = parts[2]
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            if route == 'open':
+                source = query.get('s', ['img'])[0]
+            else:
+                source = 'delayed' if query.get('d', ['0'])[0] == '1' else 'js'
+            # Same dedup key as app.py, so a burst of pixel + beacon hits counts as one open
+            if not self.dedup.is_duplicate((tracking_pixel_id, agent_class)):
+                self.events.record(route, tracking_pixel_id=tracking_pixel_id, source=source,
+                                   user_agent=user_agent, ip_address=ip_address, agent_class=agent_class)
+            if route == 'open':
+                await self._respond(send, 200, TRACKING_PIXEL_GIF, TRACKING_PIXEL_HEADERS + (('Content-Type', 'image/gif'),))
+            else:
+                await self._respond(send, 200, BEACON_OK_BODY, BEACON_HEADERS + (('Content-Type', 'application/json'),))
+        elif route == 'click' and len(parts) == 4:
+            await self._click(send, parts[3], user_agent, ip_address, agent_class)
+        else:
+            await self._respond(send, 404, b'Not Found', (('Content-Type', 'text/plain'),))
+
+    async def _click(self, send, url_tracking_id, user_agent, ip_address, agent_class):
+        destination = None
+        url_tracking_id = parse_uuid(url_tracking_id)
+        if url_tracking_id:
+            try:
+                destination = await self._resolve_click_destination(url_tracking_id)
+            except Exception as e:
+                logger.error("❌ Error resolving click destination: %s", e, extra={'event': 'click_resolve_failed'})
+        if not destination:
+            await self._redirect(send, FALLBACK_REDIRECT_URL)
+            return
+        original_url, tracking_id = destination
+        self.events.record('click', tracking_id=tracking_id, url_tracking_id=url_tracking_id,
+                           user_agent=user_agent, ip_address=ip_address, agent_class=agent_class)
+        await self._redirect(send, original_url)
+
+    async def _resolve_click_destination(self, url_tracking_id):
+        # The memory tier is checked on the loop; the SQLite file tier blocks on disk, so it
+        # runs on a worker thread instead of stalling every other request
+        entry = self.redirects.get_memory(url_tracking_id)
+        if entry is not None:
+            return entry
+        if self.redirects.file_path:
+            entry = await asyncio.to_thread(self.redirects.get_file, url_tracking_id)
+        else:
+            entry = self.redirects.get_file(url_tracking_id)  # only counts the miss
+        if entry is not None:
+            return entry
+        row = await self.pool.fetchrow(CLICK_DESTINATION_SQL.format(url_tracking_id="$1::uuid"), url_tracking_id)
+        if not row:
+            return None
+        entry = self.redirects.put_memory(url_tracking_id, row['original_url'], str(row['tracking_id']))
+        if self.redirects.file_path:
+            await asyncio.to_thread(self.redirects.put_file, url_tracking_id, entry)
+        return entry
+
+    async def _redirect(self, send, location):
+        # Percent-encode anything outside ASCII, as werkzeug's redirect() does
+        location = quote(location, safe="/:?#[]@!$&'()*+,;=%~")
+        await self._respond(send, 302, b'', (('Location', location), ('Cache-Control', 'no-cache')))
+
+    async def _respond_json(self, send, status, payload):
+        await self._respond(send, status, json.dumps(payload).encode(),
+                            (('Content-Type', 'application/json'), ('Cache-Control', 'no-store')))
+
+    @staticmethod
+    async def _respond(send, status, body, headers):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+                       + [(b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+app = TrackingService()